@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its latency covers the rest of the middleware too
+    'Rentals.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -70,7 +72,15 @@ CORS_ORIGIN_ALLOW_ALL = True
 
 ROOT_URLCONF = 'RentAGoalie.urls'
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Emails are queued in the outbox and sent by the send_outbox worker, never during a request.
+# RENTAGOALIE_EMAIL_BACKEND=file writes them to EMAIL_FILE_PATH instead of sending them, for local testing
+if os.environ.get('RENTAGOALIE_EMAIL_BACKEND') == 'file':
+    EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+    EMAIL_FILE_PATH = os.environ.get('RENTAGOALIE_EMAIL_FILE_PATH', os.path.join(BASE_DIR, 'sent_emails'))
+else:
+    EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Stops the worker hanging on an unresponsive mail server
+EMAIL_TIMEOUT = 30
 EMAIL_USE_TLS = True
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_HOST_USER = 'RentAGoalieApp@gmail.com'
@@ -100,12 +110,48 @@ WSGI_APPLICATION = 'RentAGoalie.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# Chosen with RENTAGOALIE_DB_ENGINE:
+#     sqlite   - the default. A single file, fine for one server. Waits up to RENTAGOALIE_SQLITE_TIMEOUT
+#                seconds for the write lock instead of failing straight away with "database is locked". Set
+#                RENTAGOALIE_SQLITE_JOURNAL_MODE=WAL on servers so requests can keep reading while another writes
+#     postgres - for concurrent writes. Needs psycopg2 installed. Connections are kept open for
+#                RENTAGOALIE_DB_CONN_MAX_AGE seconds instead of reconnecting on every request. Set
+#                RENTAGOALIE_DB_POOLER=pgbouncer when connecting through PgBouncer in transaction mode
+# Tests always get a throwaway database of the same kind (in memory for SQLite), so they run without a server
+# when the engine is SQLite. The loadtest_writes command compares write throughput between the setups.
+if os.environ.get('RENTAGOALIE_DB_ENGINE', 'sqlite') == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('RENTAGOALIE_DB_NAME', 'rentagoalie'),
+            'USER': os.environ.get('RENTAGOALIE_DB_USER', 'rentagoalie'),
+            'PASSWORD': os.environ.get('RENTAGOALIE_DB_PASSWORD', ''),
+            'HOST': os.environ.get('RENTAGOALIE_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('RENTAGOALIE_DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('RENTAGOALIE_DB_CONN_MAX_AGE', 60)),
+            # A transaction mode pooler can run consecutive queries on different server connections,
+            # which breaks the server side cursors QuerySet.iterator() uses
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('RENTAGOALIE_DB_POOLER') == 'pgbouncer',
+            'OPTIONS': {
+                'connect_timeout': 5,
+            },
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('RENTAGOALIE_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            'OPTIONS': {
+                # Seconds to wait for another connection's write lock
+                'timeout': int(os.environ.get('RENTAGOALIE_SQLITE_TIMEOUT', 20)),
+            },
+        }
+    }
+
+# Journal mode set on every new SQLite connection (see Rentals/db.py). None leaves the database file as it is.
+# Only set when asked for, since SQLite stores WAL mode in the file itself, and db.sqlite3 is checked in
+SQLITE_JOURNAL_MODE = os.environ.get('RENTAGOALIE_SQLITE_JOURNAL_MODE') or None
 
 
 # Password validation
@@ -126,6 +172,32 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing
+# https://docs.djangoproject.com/en/2.1/topics/auth/passwords/
+
+# New passwords are hashed with the first hasher. The rest are only there to check older hashes, which get
+# re-hashed with the first hasher (and the current cost settings) the next time their user logs in.
+# Set RENTAGOALIE_PASSWORD_HASHER=argon2 to hash new passwords with argon2 (needs argon2-cffi installed)
+PASSWORD_HASHERS = [
+    'Rentals.hashers.PooledPBKDF2PasswordHasher',
+    'Rentals.hashers.PooledArgon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+if os.environ.get('RENTAGOALIE_PASSWORD_HASHER') == 'argon2':
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(1))
+
+# Hashing runs on a bounded pool ('thread' or 'process') so a burst of logins or signups can't take every
+# CPU from the other endpoints. Set the pool to an empty string to hash on the request thread instead
+PASSWORD_HASHING_POOL = os.environ.get('RENTAGOALIE_PASSWORD_HASHING_POOL', 'thread')
+PASSWORD_HASHING_WORKERS = int(os.environ.get('RENTAGOALIE_PASSWORD_HASHING_WORKERS', 2))
+
+# Hashing cost. Changing these is safe: old hashes are upgraded on login
+PASSWORD_HASHING_ITERATIONS = int(os.environ.get('RENTAGOALIE_PBKDF2_ITERATIONS', 120000))
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get('RENTAGOALIE_ARGON2_TIME_COST', 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get('RENTAGOALIE_ARGON2_MEMORY_COST', 512))
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get('RENTAGOALIE_ARGON2_PARALLELISM', 2))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/2.1/topics/i18n/
@@ -154,6 +226,106 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
-    )
+        'Rentals.authentication.CachedTokenAuthentication',
+    ),
+    # Every list endpoint is keyset paginated. Clients can ask for up to 500 rows with ?page_size=
+    'DEFAULT_PAGINATION_CLASS': 'Rentals.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+}
+
+# Token authentication cache (see Rentals/authentication.py). Each process keeps up to TOKEN_AUTH_CACHE_SIZE
+# tokens for TOKEN_AUTH_CACHE_TTL seconds. Point TOKEN_AUTH_SHARED_CACHE at an entry in CACHES (memcached,
+# redis, ...) to share lookups and invalidations between processes
+TOKEN_AUTH_CACHE_SIZE = 10000
+TOKEN_AUTH_CACHE_TTL = 60
+TOKEN_AUTH_SHARED_CACHE = None
+
+# Publish/subscribe broker behind the /events/ long-poll endpoint. The local broker only reaches requests
+# served by the same process, so it needs a single (threaded) server process
+EVENT_BROKER = 'Rentals.events.LocalBroker'
+
+# Outbox worker (send_outbox). Failed sends are retried after OUTBOX_RETRY_DELAY seconds, doubling each
+# attempt up to OUTBOX_MAX_RETRY_DELAY, until OUTBOX_MAX_ATTEMPTS. A worker holds the batch it claimed for
+# OUTBOX_LEASE seconds, after which another worker may pick up whatever it didn't get through
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_DELAY = 30
+OUTBOX_MAX_RETRY_DELAY = 3600
+OUTBOX_LEASE = 300
+
+# Goalie matching (Rentals/matching.py). The weights are relative to each other, so they don't have to add to 1
+MATCHING_WEIGHTS = {
+    'skill': 0.4,
+    'distance': 0.3,
+    'rating': 0.2,
+    'cancellations': 0.1,
+}
+MATCHING_DISTANCE_HALF_LIFE_KM = 15
+MATCHING_MAX_DISTANCE_KM = 100
+# Upper bound on how long this process can miss profile changes made by other processes
+MATCHING_INDEX_TTL = 300
+
+# Cache for the rendered responses of read-mostly views (Rentals/caching.py). The default local memory cache
+# is per process, which is fine for this since every process invalidates its own entries. With several
+# processes, a shared cache here also shares the hits
+RESPONSE_CACHE = 'default'
+
+# Profile pictures (Rentals/pictures.py). Uploads are re-encoded as PICTURE_FORMAT ('WEBP', which needs Pillow
+# built with libwebp, or 'JPEG') no larger than PICTURE_MAX_SIDE pixels a side, and uploads over
+# PICTURE_MAX_PIXELS are refused. The variants are made on first request, sized to their longest side
+PICTURE_FORMAT = 'WEBP'
+PICTURE_QUALITY = 80
+PICTURE_MAX_SIDE = 2048
+PICTURE_MAX_PIXELS = 40000000
+PICTURE_VARIANTS = {
+    'thumb': 96,
+    'small': 256,
+    'large': 1024,
+}
+PICTURE_POOL = os.environ.get('RENTAGOALIE_PICTURE_POOL', 'thread')
+PICTURE_WORKERS = int(os.environ.get('RENTAGOALIE_PICTURE_WORKERS', 2))
+
+# Serve big JSON lists (games, messages, locations) from values_list() tuples instead of the serializers.
+# Same output, a fraction of the CPU. See Rentals/fastlist.py
+FAST_LIST_RESPONSES = True
+# Stream those lists out, encoded a chunk of rows at a time, rather than rendering them into one response.
+# Streamed responses have no response.data, so this is for production rather than development
+FAST_LIST_STREAMING = os.environ.get('RENTAGOALIE_FAST_LIST_STREAMING') == '1'
+
+# Request metrics (Rentals/metrics.py), served to admins at /metrics/. Requests slower than
+# METRICS_SLOW_REQUEST_SECONDS or running at least METRICS_QUERY_WARNING_COUNT queries are logged as warnings
+METRICS_SLOW_REQUEST_SECONDS = 1
+METRICS_QUERY_WARNING_COUNT = 50
+
+# Logs go to stderr as one JSON object per line. Warnings and errors are always kept, and a fraction
+# (RENTAGOALIE_LOG_SAMPLE_RATE) of the records below that. Set RENTAGOALIE_LOG_LEVEL to INFO for applies and
+# removals, or DEBUG for every request and its metrics
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampled': {
+            '()': 'Rentals.log.SampleFilter',
+            'rate': float(os.environ.get('RENTAGOALIE_LOG_SAMPLE_RATE', 0.01)),
+        },
+    },
+    'formatters': {
+        'json': {
+            '()': 'Rentals.log.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'json': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+            'filters': ['sampled'],
+        },
+    },
+    'loggers': {
+        'Rentals': {
+            'handlers': ['json'],
+            'level': os.environ.get('RENTAGOALIE_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
 }
@@ -1,10 +1,74 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Max
+from django.utils.functional import cached_property
 
 from .models import *
 
-# Register your models here.
-admin.site.register(Game)
-admin.site.register(Location)
-admin.site.register(Message)
-admin.site.register(Profile)
 
+# Changelist paginator for tables too big to COUNT(*) on every page view. Without filters the count is the
+# database's estimate of the table size (the highest id on SQLite). With filters it counts at most
+# exact_count_limit + 1 rows, so the page links stop there and the rest is a matter of narrowing the filters
+class EstimatedCountPaginator(Paginator):
+    exact_count_limit = 10000
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = estimate_rows(self.object_list.model)
+            if estimate is not None and estimate > self.exact_count_limit:
+                return estimate
+        return self.object_list.order_by()[:self.exact_count_limit + 1].count()
+
+
+# Roughly how many rows the model's table has, or None if the database can't say cheaply
+def estimate_rows(model):
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [model._meta.db_table])
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] >= 0 else None
+    # The highest id, straight off the primary key index. Deleted rows make it an overestimate
+    return model.objects.aggregate(highest=Max('pk'))['highest']
+
+
+# Defaults for the changelists of tables that grow without bound. Foreign keys to users are raw id widgets in
+# the subclasses, since a select would load every user into the page
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skips the second COUNT(*), of the whole table, that the changelist runs when it's filtered
+    show_full_result_count = False
+
+
+# Filters are on indexed columns: skill_level and queue_resolved lead an index each, and game_time pages
+# off the keyset pagination index
+@admin.register(Game)
+class GameAdmin(LargeTableAdmin):
+    list_display = ('id', 'game_time', 'skill_level', 'location', 'user', 'goalie_one', 'goalie_two',
+                    'two_goalies_needed')
+    list_select_related = ('user', 'goalie_one', 'goalie_two')
+    list_filter = ('game_time', 'skill_level', 'queue_resolved')
+    raw_id_fields = ('user', 'goalie_one', 'goalie_two', 'applied_goalies')
+
+
+# game_id rather than game, so rows don't join Game just to format its __str__
+@admin.register(Message)
+class MessageAdmin(LargeTableAdmin):
+    list_display = ('id', 'creation_time', 'game_id', 'game_user', 'goalie_user', 'sender_is_goalie', 'read')
+    list_select_related = ('game_user', 'goalie_user')
+    list_filter = ('creation_time',)
+    raw_id_fields = ('game', 'game_user', 'goalie_user')
+
+
+# Tokens and the card number are left off the changelist
+@admin.register(Profile)
+class ProfileAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'location', 'is_goalie', 'skill_level', 'rating', 'games_played')
+    list_select_related = ('user', 'location')
+    list_filter = ('is_goalie', 'location')
+    raw_id_fields = ('user',)
+
+
+admin.site.register(Location)
+admin.site.register(OutboxEmail)
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class RentalsConfig(AppConfig):
     name = 'Rentals'
+
+    def ready(self):
+        # Connects the receivers that keep the token authentication cache and the goalie matching index up to
+        # date, and the one that sets up new SQLite connections
+        from . import authentication, db, matching  # noqa: F401
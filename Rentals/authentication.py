@@ -0,0 +1,132 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+SHARED_CACHE_PREFIX = 'auth-token:'
+
+
+# Thread safe LRU cache where entries also expire ttl seconds after they were added. If group is given, it maps
+# each value to a group (a user id, say) and delete_group() drops a group's entries without a scan of the cache
+class LRUCache(object):
+    def __init__(self, max_size, ttl, group=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.group = group
+        self._entries = OrderedDict()
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            if self.group is not None:
+                self._groups.setdefault(self.group(value), set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def delete_group(self, group):
+        with self._lock:
+            for key in list(self._groups.get(group, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+
+    # Callers hold the lock
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None or self.group is None:
+            return
+        group = self.group(entry[0])
+        keys = self._groups[group]
+        keys.discard(key)
+        if not keys:
+            del self._groups[group]
+
+
+# Values are (user, token), grouped by user id
+local_token_cache = LRUCache(getattr(settings, 'TOKEN_AUTH_CACHE_SIZE', 10000),
+                             getattr(settings, 'TOKEN_AUTH_CACHE_TTL', 60),
+                             group=lambda cached: cached[0].pk)
+
+
+def get_shared_token_cache():
+    alias = getattr(settings, 'TOKEN_AUTH_SHARED_CACHE', None)
+    return caches[alias] if alias else None
+
+
+# Token authentication that remembers which user a token belongs to, so authenticated requests don't
+# each pay a join on authtoken_token and auth_user just to find out who is calling.
+#
+# Lookups go to an in-process LRU cache first, then to the shared cache named by
+# settings.TOKEN_AUTH_SHARED_CACHE (if any), then to the database. Entries are dropped when the token is
+# deleted (logout or rotation) and when its user is saved (deactivation, password change, ...). Other
+# processes only hear about that through the shared cache, so TOKEN_AUTH_CACHE_TTL bounds how long their
+# local copies can be stale.
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cached = local_token_cache.get(key)
+        if cached is None:
+            shared_cache = get_shared_token_cache()
+            if shared_cache is not None:
+                cached = shared_cache.get(SHARED_CACHE_PREFIX + key)
+            if cached is None:
+                # Raises AuthenticationFailed for unknown tokens and inactive users, neither of which get cached
+                cached = super().authenticate_credentials(key)
+                if shared_cache is not None:
+                    shared_cache.set(SHARED_CACHE_PREFIX + key, cached, local_token_cache.ttl)
+            local_token_cache.set(key, cached)
+        user, token = cached
+        # Each request gets its own copy so nothing it does to request.user leaks into the cache
+        return copy.copy(user), token
+
+
+def forget_token(key):
+    local_token_cache.delete(key)
+    shared_cache = get_shared_token_cache()
+    if shared_cache is not None:
+        shared_cache.delete(SHARED_CACHE_PREFIX + key)
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    forget_token(instance.key)
+
+
+# Logging in only updates last_login, which doesn't affect whether a token is good
+@receiver(post_save, sender=User)
+def forget_saved_users_tokens(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and set(update_fields) == {'last_login'}):
+        return
+    local_token_cache.delete_group(instance.pk)
+    if get_shared_token_cache() is not None:
+        for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+            forget_token(key)
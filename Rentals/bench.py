@@ -0,0 +1,92 @@
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+# Small helpers shared by the bench_* management commands
+
+
+# Runs fn repeat times and returns the individual timings in seconds
+def time_calls(fn, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings):
+    return {
+        'best': min(timings),
+        'median': statistics.median(timings),
+    }
+
+
+# values must already be sorted
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def format_seconds(seconds):
+    if seconds >= 1:
+        return '{:.2f}s'.format(seconds)
+    if seconds >= 1e-3:
+        return '{:.2f}ms'.format(seconds * 1e3)
+    return '{:.2f}us'.format(seconds * 1e6)
+
+
+# Benchmarks seed a lot of synthetic rows, so they run against a throwaway test database rather than
+# the one in settings. SQLite gets a file in a temporary directory rather than an in-memory database,
+# so timings include disk writes and concurrent connections wait on locks the way they do in production
+@contextmanager
+def scratch_database():
+    old_name = connection.settings_dict['NAME']
+    old_test_name = connection.settings_dict['TEST'].get('NAME')
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+        try:
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                yield
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            # Later test databases in this process go back to the configured name, not the deleted file
+            connection.settings_dict['TEST']['NAME'] = old_test_name
+
+
+# The checked out commit, with -dirty on the end if tracked files have changed since. Saved results are
+# keyed by it so runs on different commits can be compared
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=settings.BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def load_results(path):
+    try:
+        with open(path) as results_file:
+            return json.load(results_file)
+    except FileNotFoundError:
+        return {}
+
+
+# Replaces whatever was saved under key before, so re-running on the same commit keeps only the latest run
+def save_results(path, key, results):
+    saved = load_results(path)
+    saved[key] = results
+    with open(path, 'w') as results_file:
+        json.dump(saved, results_file, indent=2, sort_keys=True)
+        results_file.write('\n')
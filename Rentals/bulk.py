@@ -0,0 +1,42 @@
+from django.db.models import Case, F, Q, Value, When
+
+# Rows per UPDATE in a bulk update. Each row adds two parameters for every field it changes, which keeps a
+# batch under SQLite's default limit of 999 parameters per statement
+BULK_UPDATE_BATCH_SIZE = 100
+# Games per OpenGame.refresh after a bulk write, and ids per IN (...) when looking them up
+OPEN_GAME_REFRESH_BATCH_SIZE = 500
+
+
+# Writes different values to many rows in a single UPDATE:
+#     UPDATE ... SET field = CASE WHEN id = 1 THEN ... WHEN id = 2 THEN ... ELSE field END WHERE id IN (1, 2)
+# Django 2.1 has no QuerySet.bulk_update, and saving each row would be one UPDATE per row.
+#
+# rows maps primary keys to {field name: value} for that row. Rows don't all need the same fields: a row
+# keeps its current value for any field it doesn't mention. Fields named in only_if_null are only written
+# where they are still NULL, so the UPDATE can't overwrite a value another request set in the meantime.
+# Anything in extra is set on every row. Returns the number of rows matched.
+def bulk_update_by_pk(queryset, rows, only_if_null=(), **extra):
+    if not rows:
+        return 0
+    model = queryset.model
+    fields = {name for changes in rows.values() for name in changes}
+    updates = {}
+    for name in fields:
+        field = model._meta.get_field(name)
+        whens = []
+        for pk, changes in rows.items():
+            if name not in changes:
+                continue
+            condition = Q(pk=pk)
+            if name in only_if_null:
+                condition &= Q(**{name + '__isnull': True})
+            whens.append(When(condition, then=Value(changes[name], output_field=field)))
+        updates[field.name] = Case(*whens, default=F(field.attname), output_field=field)
+    updates.update(extra)
+    return queryset.filter(pk__in=list(rows)).update(**updates)
+
+
+# Splits items into lists of at most size, for statements that would otherwise have too many parameters
+def chunks(items, size):
+    items = list(items)
+    return [items[start:start + size] for start in range(0, len(items), size)]
@@ -0,0 +1,160 @@
+import hashlib
+import random
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+CACHE_PREFIX = 'response-cache:'
+GENERATION_PREFIX = 'response-cache-generation:'
+
+# Response caching for read-mostly views. Add CachedResponseMixin in front of a generic view and its GET
+# responses are kept, already rendered, in the cache named by settings.RESPONSE_CACHE:
+#
+#     class LocationList(CachedResponseMixin, generics.ListCreateAPIView):
+#
+# Cache keys include a generation number for each model the view reads (cache_models, by default the
+# model of its queryset). Saving or deleting an instance of one of those models bumps its generation, so
+# every response built from the old data is skipped at once without having to find and delete each key.
+# Updates that skip the model signals (QuerySet.update, bulk_create) need to call bump_generation() too.
+#
+# Every response carries a strong ETag (a hash of the body) and Cache-Control, so clients and proxies can
+# revalidate with If-None-Match and get an empty 304 back when nothing changed.
+
+_stats_lock = threading.Lock()
+_stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+_watched_models = set()
+
+
+def get_response_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE', 'default')]
+
+
+def generation_key(model):
+    return GENERATION_PREFIX + model._meta.label_lower
+
+
+# Starts from a random number rather than 1, so a generation that falls out of the cache can't come back
+# as a number that old entries were stored under
+def new_generation():
+    return random.randrange(1, 2 ** 48)
+
+
+def get_generations(models):
+    cache = get_response_cache()
+    keys = [generation_key(model) for model in models]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, new_generation(), None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def bump_generation(model):
+    cache = get_response_cache()
+    try:
+        cache.incr(generation_key(model))
+    except ValueError:
+        cache.set(generation_key(model), new_generation(), None)
+
+
+def on_model_change(sender, **kwargs):
+    bump_generation(sender)
+    # And again once the change is committed, in case another request cached the old data in between
+    transaction.on_commit(lambda: bump_generation(sender))
+
+
+def watch(model):
+    if model in _watched_models:
+        return
+    _watched_models.add(model)
+    post_save.connect(on_model_change, sender=model, dispatch_uid='response-cache-save-' + model._meta.label)
+    post_delete.connect(on_model_change, sender=model, dispatch_uid='response-cache-delete-' + model._meta.label)
+
+
+def record(view_name, outcome):
+    with _stats_lock:
+        _stats[view_name][outcome] += 1
+
+
+# Hit and miss counts for each cached view since this process started
+def get_cache_stats():
+    with _stats_lock:
+        return {name: dict(counts) for name, counts in sorted(_stats.items())}
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+class CachedResponseMixin(object):
+    # Models whose changes invalidate the cached responses. Defaults to the model of the view's queryset
+    cache_models = None
+    # How long clients and proxies may reuse a response before revalidating it, in seconds
+    cache_max_age = 0
+    # How long responses stay in the server side cache. None keeps them until they're invalidated or evicted
+    cache_timeout = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for model in cls.get_cache_models():
+            watch(model)
+
+    @classmethod
+    def get_cache_models(cls):
+        if cls.cache_models is not None:
+            return cls.cache_models
+        queryset = getattr(cls, 'queryset', None)
+        return (queryset.model,) if queryset is not None else ()
+
+    def get(self, request, *args, **kwargs):
+        # Only JSON is cached. The browsable API renders differently for every user
+        if request.accepted_renderer.format != 'json':
+            return super().get(request, *args, **kwargs)
+
+        view_name = type(self).__name__
+        key = self.get_response_cache_key(request)
+        cache = get_response_cache()
+        cached = cache.get(key)
+        if cached is None:
+            record(view_name, 'misses')
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            if response.streaming:
+                body = b''.join(response.streaming_content)
+            else:
+                body = request.accepted_renderer.render(response.data, request.accepted_media_type,
+                                                        self.get_renderer_context())
+            cached = (body, '"{}"'.format(hashlib.sha1(body).hexdigest()), request.accepted_media_type)
+            cache.set(key, cached, self.cache_timeout)
+            outcome = 'MISS'
+        else:
+            record(view_name, 'hits')
+            outcome = 'HIT'
+
+        body, etag, media_type = cached
+        client_etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in client_etags or '*' in client_etags:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type=media_type)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'max-age={}, must-revalidate'.format(self.cache_max_age)
+        response['X-Cache'] = outcome
+        return response
+
+    # One entry per view, URL, media type and generation of the models behind it. The URL includes the host
+    # since pagination links are absolute
+    def get_response_cache_key(self, request):
+        generations = get_generations(self.get_cache_models())
+        variant = '{} {}'.format(request.build_absolute_uri(), request.accepted_media_type)
+        return '{}{}:{}:{}'.format(CACHE_PREFIX, type(self).__name__, '.'.join(map(str, generations)),
+                                   hashlib.md5(variant.encode('utf-8')).hexdigest())
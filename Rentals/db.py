@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+SQLITE_JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+
+
+# Sets up every new SQLite connection for settings.SQLITE_JOURNAL_MODE, if it's set. In WAL mode readers no longer wait
+# for the writer, and synchronous=NORMAL only syncs at checkpoints, which is still safe against corruption
+# in WAL mode. The busy timeout is the 'timeout' in the database OPTIONS. In memory databases ignore this
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    journal_mode = getattr(settings, 'SQLITE_JOURNAL_MODE', None)
+    if not journal_mode:
+        return
+    journal_mode = journal_mode.upper()
+    if journal_mode not in SQLITE_JOURNAL_MODES:
+        raise ValueError('SQLITE_JOURNAL_MODE must be one of {}, not {!r}'.format(SQLITE_JOURNAL_MODES, journal_mode))
+    # Straight on the sqlite3 connection, so these don't show up as queries
+    connection.connection.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+    if journal_mode == 'WAL':
+        connection.connection.execute('PRAGMA synchronous = NORMAL')
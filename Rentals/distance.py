@@ -0,0 +1,98 @@
+import geopy.distance
+import numpy as np
+
+# Batch distance calculations. Every function here takes one origin (scalars) or N origins (arrays)
+# plus M destinations, and returns all the distances in km from a single NumPy pass:
+#     one origin  -> array of shape (M,)
+#     N origins   -> array of shape (N, M), row i holding the distances from origin i
+#
+# Two accuracy modes are offered:
+#     HAVERSINE - great circle on a sphere. Within 0.5% of geopy's geodesic distance, and the cheapest
+#     VINCENTY  - Vincenty's inverse formula on the WGS-84 ellipsoid. Within 1mm of geopy's geodesic
+#                 distance. Nearly antipodal pairs, where Vincenty doesn't converge, fall back to geopy
+HAVERSINE = 'haversine'
+VINCENTY = 'vincenty'
+
+EARTH_RADIUS_KM = 6371.0088
+
+WGS84_A = 6378.137  # km
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+VINCENTY_TOLERANCE = 1e-12
+VINCENTY_MAX_ITERATIONS = 200
+
+
+def batch_distance_km(origin_latitudes, origin_longitudes, latitudes, longitudes, method=HAVERSINE):
+    lat1, lon1, lat2, lon2, single_origin = _broadcast(origin_latitudes, origin_longitudes,
+                                                       latitudes, longitudes)
+    if method == HAVERSINE:
+        distances = _haversine(lat1, lon1, lat2, lon2)
+    elif method == VINCENTY:
+        distances = _vincenty(lat1, lon1, lat2, lon2)
+    else:
+        raise ValueError("Unknown distance method '{}'".format(method))
+    return distances[0] if single_origin else distances
+
+
+# Lines the origins up along the first axis and the destinations along the second
+def _broadcast(origin_latitudes, origin_longitudes, latitudes, longitudes):
+    origin_latitudes = np.asarray(origin_latitudes, dtype=np.float64)
+    origin_longitudes = np.asarray(origin_longitudes, dtype=np.float64)
+    single_origin = origin_latitudes.ndim == 0
+    lat1 = np.atleast_1d(origin_latitudes)[:, np.newaxis]
+    lon1 = np.atleast_1d(origin_longitudes)[:, np.newaxis]
+    lat2 = np.asarray(latitudes, dtype=np.float64).reshape(1, -1)
+    lon2 = np.asarray(longitudes, dtype=np.float64).reshape(1, -1)
+    return lat1, lon1, lat2, lon2, single_origin
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    half_d_phi = (phi2 - phi1) / 2
+    half_d_lambda = np.radians(lon2 - lon1) / 2
+    a = np.sin(half_d_phi) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(half_d_lambda) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _vincenty(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(lat1, lon1, lat2, lon2)
+    f = WGS84_F
+    big_l = np.radians(lon2 - lon1)
+    u1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    lam = big_l.copy()
+    converged = np.zeros(lam.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(VINCENTY_MAX_ITERATIONS):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos_sq_alpha = 1 - sin_alpha ** 2
+            # Both points on the equator leave cos_sq_alpha at 0, where cos(2 sigma_m) is defined as 0
+            cos_2_sigma_m = np.where(cos_sq_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha)
+            c = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+            previous_lam = lam
+            lam = big_l + (1 - c) * f * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2_sigma_m + c * cos_sigma * (-1 + 2 * cos_2_sigma_m ** 2)))
+            converged = np.abs(lam - previous_lam) < VINCENTY_TOLERANCE
+            if converged.all():
+                break
+
+        u_sq = cos_sq_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = big_b * sin_sigma * (cos_2_sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2_sigma_m ** 2) -
+            big_b / 6 * cos_2_sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2_sigma_m ** 2)))
+        distances = WGS84_B * big_a * (sigma - delta_sigma)
+
+    for index in zip(*np.nonzero(~converged)):
+        distances[index] = geopy.distance.distance((lat1[index], lon1[index]), (lat2[index], lon2[index])).km
+    return distances
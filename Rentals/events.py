@@ -0,0 +1,83 @@
+import itertools
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+# Events pushed to users through the /events/ long-poll endpoint, so clients can hold one request open
+# instead of polling GameDetail and MessageList in a loop
+GOALIE_ASSIGNED = 'goalie_assigned'
+GOALIE_REMOVED = 'goalie_removed'
+NEW_MESSAGE = 'new_message'
+
+
+# In-process publish/subscribe. Keeps the last few events for each user and wakes up that user's waiting
+# requests when a new one arrives. It only fans out within one process, so a deployment with several
+# server processes needs a broker backed by a shared service (with the same publish and wait methods)
+# set in settings.EVENT_BROKER.
+#
+# Cursors are "<broker id>-<event id>". The broker id changes whenever the process restarts, so a client
+# holding a cursor from an earlier process starts over instead of waiting for event ids it already saw.
+class LocalBroker(object):
+    def __init__(self, buffer_size=100):
+        self.broker_id = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._conditions = {}
+        self._events = defaultdict(lambda: deque(maxlen=buffer_size))
+        self._event_ids = itertools.count(1)
+
+    def publish(self, user_id, event_type, data):
+        with self._lock:
+            event_id = next(self._event_ids)
+            self._events[user_id].append({'id': event_id, 'type': event_type, 'data': data})
+            condition = self._conditions.get(user_id)
+            if condition is not None:
+                condition.notify_all()
+
+    # Returns (events after the cursor, new cursor), waiting up to timeout seconds for at least one event
+    def wait(self, user_id, cursor, timeout):
+        after = self.parse_cursor(cursor)
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            condition = self._conditions.setdefault(user_id, threading.Condition(self._lock))
+            while True:
+                events = [event for event in self._events.get(user_id, ()) if event['id'] > after]
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    break
+                condition.wait(remaining)
+        if events:
+            after = events[-1]['id']
+        return events, '{}-{}'.format(self.broker_id, after)
+
+    def parse_cursor(self, cursor):
+        broker_id, _, event_id = (cursor or '').partition('-')
+        if broker_id != self.broker_id:
+            return 0
+        try:
+            return int(event_id)
+        except ValueError:
+            return 0
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'EVENT_BROKER', 'Rentals.events.LocalBroker'))()
+        return _broker
+
+
+# Publishes once the current transaction commits, so nobody hears about a change that gets rolled back
+def publish_on_commit(user_id, event_type, data):
+    if user_id is None:
+        return
+    transaction.on_commit(lambda: get_broker().publish(user_id, event_type, data))
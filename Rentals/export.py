@@ -0,0 +1,190 @@
+import csv
+import io
+import itertools
+import json
+
+from django.db.models import Max
+
+from .models import Game, Message, Profile
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Full table exports for analytics, as NDJSON, CSV or Parquet. Rows are read in primary key order with
+# iterator(chunk_size=...), which is a server-side cursor on PostgreSQL, and written out a chunk at a time, so
+# memory stays the same however big the table is.
+#
+# Each export is bounded by the highest id in the table when it starts, its watermark. Rows inserted while it
+# runs are left for the next one, which passes the watermark back as after_id to pick up only the new rows.
+# The watermark only follows inserts: a game that changes after it was exported (a goalie applying, say) is
+# only exported again by a full export, or one with since= from before its creation.
+#
+# Only the columns listed in TABLES go out. Tokens, card numbers, pictures and message bodies stay behind.
+
+TABLES = {
+    'games': (Game, ('id', 'user', 'skill_level', 'location', 'latitude', 'longitude', 'game_time',
+                     'creation_time', 'goalie_one', 'goalie_two', 'two_goalies_needed', 'queue_resolved')),
+    'messages': (Message, ('id', 'game', 'game_user', 'goalie_user', 'sender_is_goalie', 'creation_time', 'read')),
+    'profiles': (Profile, ('id', 'user', 'location', 'is_goalie', 'skill_level', 'rating', 'games_played',
+                           'cancellations')),
+}
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+# Rows fetched from the database at a time
+EXPORT_CHUNK_SIZE = 2000
+# Rows in each Parquet row group. Readers skip whole row groups, so they shouldn't be too small
+PARQUET_ROW_GROUP_SIZE = 50000
+
+# Arrow types for the columns, by Django internal type. Foreign keys take the type of the key they point at
+ARROW_TYPES = {
+    'AutoField': 'int64',
+    'IntegerField': 'int64',
+    'FloatField': 'float64',
+    'BooleanField': 'bool_',
+    'CharField': 'string',
+}
+
+
+class TableExport(object):
+    # Raises ValueError for an unknown table, or a since on a table without creation times
+    def __init__(self, table, after_id=None, since=None):
+        if table not in TABLES:
+            raise ValueError('Unknown table {}, expected one of {}'.format(table, ', '.join(sorted(TABLES))))
+        self.table = table
+        self.model, names = TABLES[table]
+        self.fields = [self.model._meta.get_field(name) for name in names]
+        self.columns = [field.attname for field in self.fields]
+
+        queryset = self.model.objects.all()
+        if after_id is not None:
+            queryset = queryset.filter(pk__gt=after_id)
+        if since is not None:
+            if 'creation_time' not in names:
+                raise ValueError('{} have no creation time to export since'.format(table.capitalize()))
+            queryset = queryset.filter(creation_time__gte=since)
+        self.watermark = queryset.aggregate(highest=Max('pk'))['highest']
+        if self.watermark is None:
+            # Nothing new. The next export starts from the same place
+            self.watermark = after_id
+            queryset = queryset.none()
+        else:
+            queryset = queryset.filter(pk__lte=self.watermark)
+        self.queryset = queryset.order_by('pk')
+
+    def filename(self, file_format):
+        return '{}.{}'.format(self.table, file_format)
+
+    # The export as an iterator of bytes. Raises ValueError up front if the format can't be written, rather
+    # than partway through the stream
+    def stream(self, file_format):
+        if file_format not in EXPORT_FORMATS:
+            raise ValueError('Unknown format {}, expected one of {}'.format(
+                file_format, ', '.join(sorted(EXPORT_FORMATS))))
+        if file_format == 'parquet' and pyarrow is None:
+            raise ValueError('Parquet exports need pyarrow installed')
+        return WRITERS[file_format](self)
+
+    # Lists of up to size row tuples, with datetimes left as they are
+    def chunks(self, size=EXPORT_CHUNK_SIZE):
+        rows = self.queryset.values_list(*self.columns).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        while True:
+            chunk = list(itertools.islice(rows, size))
+            if not chunk:
+                return
+            yield chunk
+
+    # Lists of up to EXPORT_CHUNK_SIZE rows, with datetimes in ISO 8601 for the text formats
+    def text_chunks(self):
+        times = [index for index, field in enumerate(self.fields) if field.get_internal_type() == 'DateTimeField']
+        for chunk in self.chunks():
+            if times:
+                chunk = [list(row) for row in chunk]
+                for row in chunk:
+                    for index in times:
+                        if row[index] is not None:
+                            row[index] = row[index].isoformat()
+            yield chunk
+
+
+def write_ndjson(export):
+    for chunk in export.text_chunks():
+        lines = [json.dumps(dict(zip(export.columns, row)), ensure_ascii=False) for row in chunk]
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def write_csv(export):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(export.columns)
+    for chunk in export.text_chunks():
+        writer.writerows(chunk)
+        yield output.getvalue().encode('utf-8')
+        output.seek(0)
+        output.truncate()
+    # The header, if there were no rows
+    if output.tell():
+        yield output.getvalue().encode('utf-8')
+
+
+def write_parquet(export):
+    schema = pyarrow.schema([(column, arrow_type(field)) for column, field in zip(export.columns, export.fields)])
+    sink = _Sink()
+    writer = pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(sink, mode='w'), schema)
+    try:
+        for chunk in export.chunks(PARQUET_ROW_GROUP_SIZE):
+            arrays = [pyarrow.array(values, type=column.type) for values, column in zip(zip(*chunk), schema)]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    # The footer
+    yield sink.drain()
+
+
+def arrow_type(field):
+    if field.is_relation:
+        field = field.target_field
+    if field.get_internal_type() == 'DateTimeField':
+        return pyarrow.timestamp('us', tz='UTC')
+    return getattr(pyarrow, ARROW_TYPES[field.get_internal_type()])()
+
+
+WRITERS = {
+    'ndjson': write_ndjson,
+    'csv': write_csv,
+    'parquet': write_parquet,
+}
+
+
+# Write-only file that hands back whatever was written to it since the last drain()
+class _Sink(object):
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
@@ -0,0 +1,153 @@
+import itertools
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.http import StreamingHttpResponse
+from rest_framework import fields as drf_fields
+from rest_framework.compat import LONG_SEPARATORS, SHORT_SEPARATORS
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .fieldsets import wants_sparse_fields
+
+# Fast path for big list responses. Building a model instance, a serializer representation and an OrderedDict
+# for every row costs far more than the query once a page holds hundreds of rows. Views that add FastListMixin
+# instead read plain tuples with values_list() for the columns behind their serializer's fields, convert the few
+# values that need it (datetimes) and zip them into dicts, which the renderer encodes as usual.
+#
+# The rows are equal to what the serializer would have produced, key order included, so the rendered bytes are
+# the same whichever path served them. Only serializers whose fields all map straight onto a column qualify (see
+# get_columns). Anything else, and requests using ?fields= or ?expand=, go through the serializer as usual.
+# FAST_LIST_RESPONSES = False turns it off everywhere.
+#
+# With FAST_LIST_STREAMING on, JSON responses skip the renderer too. The rows are converted and encoded
+# FAST_LIST_CHUNK_SIZE at a time, each chunk in one call to a JSON encoder set up like the renderer's, and
+# streamed out as they're encoded, so the page is never held as dicts and as one big string at once. The
+# bytes are still the same. It's off by default since a streamed response has no response.data for
+# middleware, tests or the browsable API to look at.
+
+# Serializer fields whose representation of a non-null value is the value itself
+PLAIN_FIELDS = (drf_fields.IntegerField, drf_fields.FloatField, drf_fields.CharField, drf_fields.BooleanField,
+                drf_fields.NullBooleanField)
+
+# Rows converted and encoded at a time when streaming
+FAST_LIST_CHUNK_SIZE = 100
+# Stands in for the rows when encoding the paginator's envelope around them
+ROWS_PLACEHOLDER = '\0rows\0'
+
+_columns = {}
+
+
+# [(field name, column, converter or None)] for the serializer's fields, or None if one of them can't be read
+# from a column. Worked out once per serializer class
+def get_columns(serializer_class):
+    if serializer_class not in _columns:
+        _columns[serializer_class] = _find_columns(serializer_class())
+    return _columns[serializer_class]
+
+
+# Takes a serializer made without a request, so the cached converters don't hold on to one
+def _find_columns(serializer):
+    model = serializer.Meta.model
+    columns = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if len(field.source_attrs) != 1:
+            return None
+        source = field.source_attrs[0]
+        if source == 'pk':
+            source = model._meta.pk.name
+        try:
+            model_field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            return None
+        if isinstance(field, PrimaryKeyRelatedField) and field.pk_field is None and model_field.many_to_one:
+            columns.append((name, model_field.attname, None))
+        elif isinstance(field, drf_fields.DateTimeField):
+            columns.append((name, model_field.attname, field.to_representation))
+        elif isinstance(field, PLAIN_FIELDS) and not model_field.is_relation:
+            columns.append((name, model_field.attname, None))
+        else:
+            return None
+    return columns
+
+
+class FastListMixin(object):
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_list(request):
+            return super().list(request, *args, **kwargs)
+        columns = get_columns(self.get_serializer_class())
+        if columns is None:
+            return super().list(request, *args, **kwargs)
+
+        attnames = [column for _, column, _ in columns]
+        queryset = self.filter_queryset(self.get_queryset())
+        stream = self.use_streaming(request)
+        if self.paginator is None:
+            rows = queryset.values_list(*attnames)
+            if stream:
+                return stream_rows(request, rows.iterator(chunk_size=FAST_LIST_CHUNK_SIZE), columns)
+            return Response(to_dicts(rows, columns))
+        rows = self.paginator.paginate_values(queryset, attnames, request, view=self)
+        if stream:
+            return stream_rows(request, rows, columns,
+                               envelope=self.paginator.get_paginated_response(ROWS_PLACEHOLDER).data)
+        return self.paginator.get_paginated_response(to_dicts(rows, columns))
+
+    @staticmethod
+    def use_fast_list(request):
+        return getattr(settings, 'FAST_LIST_RESPONSES', True) and not wants_sparse_fields(request)
+
+    # Only plain JSON is streamed. An indent asked for in the Accept header is left to the renderer
+    @staticmethod
+    def use_streaming(request):
+        renderer = request.accepted_renderer
+        return (getattr(settings, 'FAST_LIST_STREAMING', False) and isinstance(renderer, JSONRenderer)
+                and renderer.get_indent(request.accepted_media_type, {}) is None)
+
+
+# The rows as JSON, streamed a chunk at a time and byte for byte what the request's JSONRenderer would give.
+# envelope is the paginator's response data with ROWS_PLACEHOLDER where the rows go
+def stream_rows(request, rows, columns, envelope=ROWS_PLACEHOLDER):
+    renderer = request.accepted_renderer
+    encoder = renderer.encoder_class(ensure_ascii=renderer.ensure_ascii, allow_nan=not renderer.strict,
+                                     separators=SHORT_SEPARATORS if renderer.compact else LONG_SEPARATORS)
+    head, tail = encoder.encode(envelope).split(encoder.encode(ROWS_PLACEHOLDER))
+    return StreamingHttpResponse(_encode_rows(encoder, head, tail, iter(rows), columns),
+                                 content_type=request.accepted_media_type)
+
+
+def _encode_rows(encoder, head, tail, rows, columns):
+    separator = ''
+    yield _to_bytes(head + '[')
+    while True:
+        chunk = list(itertools.islice(rows, FAST_LIST_CHUNK_SIZE))
+        if not chunk:
+            break
+        # The chunk's rows as one list, without its brackets
+        yield _to_bytes(separator + encoder.encode(to_dicts(chunk, columns))[1:-1])
+        separator = encoder.item_separator
+    yield _to_bytes(']' + tail)
+
+
+# Escapes U+2028 and U+2029 like JSONRenderer, so the JSON is also valid JavaScript
+def _to_bytes(text):
+    return text.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode('utf-8')
+
+
+# The rows as dicts keyed by the serializer's field names. Extra values at the end of a row (the paginator's
+# ordering columns) are left out
+def to_dicts(rows, columns):
+    names = [name for name, _, _ in columns]
+    converters = [(index, convert) for index, (_, _, convert) in enumerate(columns) if convert is not None]
+    results = []
+    for row in rows:
+        if converters:
+            row = list(row)
+            for index, convert in converters:
+                if row[index] is not None:
+                    row[index] = convert(row[index])
+        results.append(dict(zip(names, row)))
+    return results
@@ -0,0 +1,141 @@
+import sys
+
+from rest_framework import serializers
+
+# Sparse fieldsets and expansion of related objects, chosen by the client with query parameters:
+#     ?fields=id,game_time,goalie_one.username   only these fields. Dotted names pick fields of expanded objects
+#     ?expand=goalie_one,goalie_two.profile      inline these related objects instead of their ids
+#
+# Serializers opt in with SparseFieldsMixin and list what can be expanded in expandable_fields:
+#     expandable_fields = {'goalie_one': ('PublicUserSerializer', 'goalie_one', ONE)}
+# name: (serializer class name in the same module, ORM lookup, ONE or FIRST). ONE is a foreign key, fetched
+# with select_related. FIRST is a reverse foreign key that only ever has one row (a user's profile), fetched
+# with prefetch_related. Views add ExpandedQuerysetMixin so the lookups for the requested expansions are
+# added to their queryset, and a page of games costs the same few queries whatever is expanded.
+#
+# Only the top level serializer reads the query parameters. Nested ones get their part of the trees from it.
+
+ONE = 'one'
+FIRST = 'first'
+
+
+# 'a,b.c,b.d' -> {'a': {}, 'b': {'c': {}, 'd': {}}}
+def parse_field_tree(value):
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+# The (fields, expand) trees asked for in the request. fields is None when every field is wanted
+def get_request_trees(request):
+    if request is None:
+        return None, {}
+    params = request.query_params
+    fields = parse_field_tree(params['fields']) if params.get('fields') else None
+    return fields, parse_field_tree(params.get('expand', ''))
+
+
+def wants_sparse_fields(request):
+    fields, expand = get_request_trees(request)
+    return fields is not None or bool(expand)
+
+
+class SparseFieldsMixin(object):
+    expandable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        self._field_tree = kwargs.pop('fields', None)
+        self._expand_tree = kwargs.pop('expand', None)
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        only, expand = self.get_trees()
+        self.check_names(expand, 'expand', self.expandable_fields)
+        for name, subtree in expand.items():
+            fields[name] = self.build_expanded_field(name, (only or {}).get(name) or None, subtree)
+        if only is not None:
+            self.check_names(only, 'fields', fields)
+            fields = type(fields)((name, field) for name, field in fields.items() if name in only)
+        return fields
+
+    def get_trees(self):
+        if self._field_tree is not None or self._expand_tree is not None:
+            return self._field_tree, self._expand_tree or {}
+        # Only the top level serializer (on its own or as the child of many=True) reads the request
+        parent = self.parent
+        if parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None):
+            return get_request_trees(self.context.get('request'))
+        return None, {}
+
+    @staticmethod
+    def check_names(tree, parameter, known):
+        unknown = sorted(set(tree) - set(known))
+        if unknown:
+            raise serializers.ValidationError({parameter: ['Unknown field {}'.format(name) for name in unknown]})
+
+    def build_expanded_field(self, name, fields, expand):
+        serializer_class, lookup, kind = self.get_expansion(name)
+        if kind == FIRST:
+            return FirstRelatedField(serializer_class, fields, expand, source=lookup)
+        return serializer_class(source=lookup if lookup != name else None, read_only=True, fields=fields,
+                                expand=expand)
+
+    @classmethod
+    def get_expansion(cls, name):
+        serializer_name, lookup, kind = cls.expandable_fields[name]
+        return getattr(sys.modules[cls.__module__], serializer_name), lookup, kind
+
+    # The select_related and prefetch_related lookups for an expand tree. Anything below a prefetch has to be
+    # prefetched too
+    @classmethod
+    def get_related_lookups(cls, expand, prefix='', prefetching=False):
+        cls.check_names(expand, 'expand', cls.expandable_fields)
+        select, prefetch = [], []
+        for name, subtree in sorted(expand.items()):
+            serializer_class, lookup, kind = cls.get_expansion(name)
+            path = prefix + lookup
+            below_prefetch = prefetching or kind == FIRST
+            (prefetch if below_prefetch else select).append(path)
+            nested_select, nested_prefetch = serializer_class.get_related_lookups(subtree, path + '__', below_prefetch)
+            select += nested_select
+            prefetch += nested_prefetch
+        return select, prefetch
+
+
+# The single related object of a to-many relation, serialized with serializer_class. Reads the prefetched rows
+# when there are any, so it costs no queries of its own
+class FirstRelatedField(serializers.Field):
+    def __init__(self, serializer_class, fields, expand, **kwargs):
+        self.serializer_class = serializer_class
+        self.field_tree = fields
+        self.expand_tree = expand
+        super().__init__(read_only=True, **kwargs)
+
+    def get_attribute(self, instance):
+        related = list(super().get_attribute(instance).all()[:1])
+        return related[0] if related else None
+
+    def to_representation(self, value):
+        return self.serializer_class(value, context=self.context, fields=self.field_tree,
+                                     expand=self.expand_tree).data
+
+
+# For generic views whose serializer has SparseFieldsMixin. Adds the related lookups for ?expand= to the
+# queryset the view lists or fetches from
+class ExpandedQuerysetMixin(object):
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        _, expand = get_request_trees(self.request)
+        if not expand:
+            return queryset
+        select, prefetch = self.get_serializer_class().get_related_lookups(expand)
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
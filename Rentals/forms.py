@@ -0,0 +1,18 @@
+from django.contrib.auth.forms import PasswordResetForm
+from django.template import loader
+
+from .models import OutboxEmail
+
+
+# Django's password reset form, except the email goes through the outbox rather than being sent during the request
+class OutboxPasswordResetForm(PasswordResetForm):
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email, html_email_template_name=None):
+        subject = loader.render_to_string(subject_template_name, context)
+        # Email subject *must not* contain newlines
+        subject = ''.join(subject.splitlines())
+        body = loader.render_to_string(email_template_name, context)
+        html_body = ''
+        if html_email_template_name is not None:
+            html_body = loader.render_to_string(html_email_template_name, context)
+        OutboxEmail.enqueue(subject, body, [to_email], from_email=from_email, html_body=html_body)
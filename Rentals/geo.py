@@ -0,0 +1,112 @@
+import math
+
+from django.db.models import Q
+
+# Geohash helpers used to index games by location. A geohash is a base32 string where every
+# extra character narrows the cell, so all points inside a cell share the cell's hash as a prefix.
+# That lets us find nearby games with plain B-tree range scans instead of a full table scan.
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # Roughly 5m x 5m cells, more than enough for rinks
+
+KM_PER_DEGREE_LATITUDE = 111.32
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits = bits << 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits = bits << 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+# Returns the (height, width) of a geohash cell in degrees
+def geohash_cell_size(precision):
+    lat_bits = (5 * precision) // 2
+    lon_bits = 5 * precision - lat_bits
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+# Picks the finest precision whose cells are still at least radius_km across at the given latitude,
+# so that a cell plus its eight neighbours always covers the whole search circle.
+# Returns 0 if the radius is too large for any cell, which happens close to the poles
+def geohash_precision_for_radius(latitude, radius_km):
+    # Use the edge of the circle farthest from the equator, where a degree of longitude is shortest
+    edge_latitude = min(abs(latitude) + radius_km / KM_PER_DEGREE_LATITUDE, 90.0)
+    lon_scale = max(math.cos(math.radians(edge_latitude)), 0.01)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = geohash_cell_size(precision)
+        if height * KM_PER_DEGREE_LATITUDE >= radius_km and \
+                width * KM_PER_DEGREE_LATITUDE * lon_scale >= radius_km:
+            return precision
+    return 0
+
+
+# Returns the geohash cells (at the given precision) covering the point and its eight neighbours
+def geohash_neighbourhood(latitude, longitude, precision):
+    height, width = geohash_cell_size(precision)
+    cells = set()
+    for lat_step in (-1, 0, 1):
+        lat = latitude + lat_step * height
+        if lat > 90.0 or lat < -90.0:
+            continue
+        for lon_step in (-1, 0, 1):
+            lon = longitude + lon_step * width
+            # Wrap around the antimeridian
+            lon = (lon + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(lat, lon, precision))
+    return sorted(cells)
+
+
+# Returns the coarsest geohash cells, all the way around the globe, in the rows that overlap the
+# latitude band. Covers a search circle whose cells can't be found with geohash_neighbourhood
+def geohash_latitude_band(min_latitude, max_latitude):
+    height, width = geohash_cell_size(1)
+    cells = set()
+    for row in range(round(180.0 / height)):
+        bottom = -90.0 + row * height
+        if bottom > max_latitude or bottom + height < min_latitude:
+            continue
+        for column in range(round(360.0 / width)):
+            cells.add(encode_geohash(bottom + height / 2, -180.0 + (column + 0.5) * width, 1))
+    return sorted(cells)
+
+
+# Builds a filter matching every row whose geohash lies in one of the cells around the point.
+# Uses range lookups rather than startswith so any backend can answer it from the B-tree index.
+def geohash_radius_filter(latitude, longitude, radius_km, field='geohash'):
+    precision = geohash_precision_for_radius(latitude, radius_km)
+    if precision == 0:
+        margin = radius_km / KM_PER_DEGREE_LATITUDE
+        cells = geohash_latitude_band(latitude - margin, latitude + margin)
+    else:
+        cells = geohash_neighbourhood(latitude, longitude, precision)
+    query = Q()
+    for cell in cells:
+        # '{' sorts directly after 'z', the last character in the geohash alphabet
+        query |= Q(**{field + '__gte': cell, field + '__lt': cell + '{'})
+    return query
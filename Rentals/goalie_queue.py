@@ -0,0 +1,105 @@
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .bulk import bulk_update_by_pk, chunks, BULK_UPDATE_BATCH_SIZE
+from .events import publish_on_commit, GOALIE_ASSIGNED
+from .matching import rank_goalies
+from .models import Game, OpenGame
+
+# New games collect applications for WAIT_TIME minutes instead of going to the first goalie who applies.
+# Applying to a game whose queue hasn't been resolved yet is one INSERT into Game.applied_goalies. A
+# periodic job (the resolve_goalie_queues command) then resolves every game whose window has closed in one
+# pass: it ranks each game's applicants with the matching engine, fills the open slots with one bulk UPDATE
+# per BULK_UPDATE_BATCH_SIZE games, and empties the queue. Once a game's queue is resolved, applying to it is
+# first come, first served.
+#
+# A goalie can join the queue just after a pass has resolved the game. Their row is left in the queue and
+# the next pass gives them any slot that is still open, so nobody who got a "queued" response is forgotten.
+
+# Wait time in minutes
+WAIT_TIME = 5
+
+Applicant = Game.applied_goalies.through
+
+
+# Adds the goalie to the game's queue. Returns False if they were already in it
+def enqueue(game_id, goalie_id):
+    try:
+        with transaction.atomic():
+            Applicant.objects.create(game_id=game_id, user_id=goalie_id)
+    except IntegrityError:
+        return False
+    return True
+
+
+# Resolves up to batch_size games whose window has closed. Returns the number of games resolved
+def resolve_closed_queues(now=None, batch_size=500):
+    now = now or timezone.now()
+    with transaction.atomic():
+        # Closed windows, plus resolved games that someone joined the queue of after they were resolved
+        games = list(Game.objects
+                     .filter(Q(queue_resolved=False, creation_time__lte=now - timedelta(minutes=WAIT_TIME))
+                             | Q(queue_resolved=True, pk__in=Applicant.objects.values('game_id')))
+                     .only('id', 'user', 'skill_level', 'latitude', 'longitude', 'goalie_one', 'goalie_two',
+                           'two_goalies_needed')
+                     .order_by('id')[:batch_size])
+        if not games:
+            return 0
+
+        # Each statement covers at most BULK_UPDATE_BATCH_SIZE games or queue rows, to stay under the database's
+        # limit on parameters per statement
+        assignments = {}
+        queued = []
+        for batch in chunks(games, BULK_UPDATE_BATCH_SIZE):
+            applicants = {}
+            for row_id, game_id, goalie_id in Applicant.objects.filter(game_id__in=[game.id for game in batch])\
+                    .order_by('id').values_list('id', 'game_id', 'user_id'):
+                applicants.setdefault(game_id, []).append(goalie_id)
+                queued.append(row_id)
+
+            picks = {game.id: pick_goalies(game, applicants.get(game.id, [])) for game in batch}
+            # The slots are only filled if they are still empty, in case a goalie claimed one since we looked
+            bulk_update_by_pk(Game.objects.all(), picks, only_if_null=('goalie_one', 'goalie_two'),
+                              queue_resolved=True)
+            assignments.update(picks)
+
+        # Only the rows read above, so anyone who joins a queue during the pass waits for the next one
+        for batch in chunks(queued, BULK_UPDATE_BATCH_SIZE):
+            Applicant.objects.filter(pk__in=batch).delete()
+
+        renters = {game.id: game.user_id for game in games}
+        for batch in chunks((game_id for game_id, picks in assignments.items() if picks), BULK_UPDATE_BATCH_SIZE):
+            OpenGame.refresh(batch)
+            for game_id, goalie_one_id, goalie_two_id in Game.objects.filter(pk__in=batch)\
+                    .values_list('id', 'goalie_one_id', 'goalie_two_id'):
+                for slot, goalie_id in (('goalie_one', goalie_one_id), ('goalie_two', goalie_two_id)):
+                    if goalie_id is not None and assignments[game_id].get(slot) == goalie_id:
+                        publish_on_commit(renters[game_id], GOALIE_ASSIGNED,
+                                          {'game': game_id, 'goalie': goalie_id, 'slot': slot})
+    return len(games)
+
+
+# Picks goalies for the game's open slots from its applicants. Returns {slot: goalie id}
+def pick_goalies(game, applicant_ids):
+    open_slots = []
+    if game.goalie_one_id is None:
+        open_slots.append('goalie_one')
+    if game.two_goalies_needed and game.goalie_two_id is None:
+        open_slots.append('goalie_two')
+    if not open_slots or not applicant_ids:
+        return {}
+
+    already_playing = {game.goalie_one_id, game.goalie_two_id}
+    ranked = [candidate['goalie'] for candidate in
+              rank_goalies(game, limit=len(open_slots), exclude=already_playing, only=applicant_ids)]
+    # Applicants the matching engine can't score (no goalie profile, say) still beat an empty slot, in the
+    # order they applied
+    for goalie_id in applicant_ids:
+        if len(ranked) >= len(open_slots):
+            break
+        if goalie_id not in ranked and goalie_id not in already_playing and goalie_id != game.user_id:
+            ranked.append(goalie_id)
+    return dict(zip(open_slots, ranked))
@@ -0,0 +1,99 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, PBKDF2PasswordHasher
+
+# Password hashers that run the expensive part (hashing on signup, verifying on login) on a bounded
+# worker pool instead of directly on the request thread. Chosen with settings.PASSWORD_HASHING_POOL:
+#     'thread'  - a thread pool. PBKDF2 and argon2 both release the GIL while they hash, so this caps how
+#                 many hashes run at once without stopping the rest of the worker from serving requests
+#     'process' - a process pool, for hashers that hold the GIL
+#     None      - hash inline on the request thread
+# PASSWORD_HASHING_WORKERS is the size of the pool. A burst of logins queues for the pool rather than
+# taking every CPU away from the other endpoints.
+#
+# The cost parameters come from settings as well, so each deployment can tune them. Hashes made with
+# other parameters still verify, and Django re-hashes them with the current ones when their user logs in.
+
+_executor = None
+_executor_config = None
+_executor_lock = threading.Lock()
+
+
+def get_hashing_executor():
+    global _executor, _executor_config
+    kind = getattr(settings, 'PASSWORD_HASHING_POOL', None)
+    if not kind:
+        return None
+    config = (kind, getattr(settings, 'PASSWORD_HASHING_WORKERS', 2))
+    with _executor_lock:
+        if _executor_config != config:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            if kind == 'process':
+                _executor = ProcessPoolExecutor(max_workers=config[1])
+            elif kind == 'thread':
+                _executor = ThreadPoolExecutor(max_workers=config[1], thread_name_prefix='password-hashing')
+            else:
+                raise ValueError("PASSWORD_HASHING_POOL must be 'thread', 'process' or None, not {!r}".format(kind))
+            _executor_config = config
+        return _executor
+
+
+# Runs in the pool. Takes the plain Django hasher class and the cost parameters rather than a pooled
+# hasher, so that it's picklable for process pools and never submits back to the pool it's running on
+def _run_hasher(hasher_class, cost, method, args):
+    hasher = hasher_class()
+    for name, value in cost.items():
+        setattr(hasher, name, value)
+    return getattr(hasher, method)(*args)
+
+
+class PooledHasherMixin(object):
+    base_hasher = None
+    # The base hasher's cost parameters, each with the setting it's read from
+    cost_settings = {}
+
+    # Each cost parameter becomes a property reading its setting, falling back to the base hasher's default, so
+    # Django's own checks (must_update, ...) see the configured values too
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name, setting in cls.cost_settings.items():
+            setattr(cls, name, _cost_property(setting, getattr(cls.base_hasher, name)))
+
+    def get_cost(self):
+        return {name: getattr(self, name) for name in self.cost_settings}
+
+    def encode(self, password, salt, *args):
+        return self._pooled('encode', password, salt, *args)
+
+    def verify(self, password, encoded):
+        return self._pooled('verify', password, encoded)
+
+    def _pooled(self, method, *args):
+        executor = get_hashing_executor()
+        if executor is None:
+            return _run_hasher(self.base_hasher, self.get_cost(), method, args)
+        return executor.submit(_run_hasher, self.base_hasher, self.get_cost(), method, args).result()
+
+
+def _cost_property(setting, default):
+    return property(lambda hasher: getattr(settings, setting, default))
+
+
+# Drop-in for Django's PBKDF2PasswordHasher. Same algorithm name, so existing hashes keep working
+class PooledPBKDF2PasswordHasher(PooledHasherMixin, PBKDF2PasswordHasher):
+    base_hasher = PBKDF2PasswordHasher
+    cost_settings = {'iterations': 'PASSWORD_HASHING_ITERATIONS'}
+
+
+# Drop-in for Django's Argon2PasswordHasher, which needs argon2-cffi installed. PASSWORD_ARGON2_MEMORY_COST
+# is in KiB
+class PooledArgon2PasswordHasher(PooledHasherMixin, Argon2PasswordHasher):
+    base_hasher = Argon2PasswordHasher
+    cost_settings = {
+        'time_cost': 'PASSWORD_ARGON2_TIME_COST',
+        'memory_cost': 'PASSWORD_ARGON2_MEMORY_COST',
+        'parallelism': 'PASSWORD_ARGON2_PARALLELISM',
+    }
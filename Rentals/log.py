@@ -0,0 +1,34 @@
+import json
+import logging
+import random
+
+# Logging helpers used by settings.LOGGING
+
+
+# Lets every record at or above level through, and only a random sample of the ones below it, so chatty
+# info and debug logging on hot paths doesn't flood the logs under load
+class SampleFilter(logging.Filter):
+    def __init__(self, rate=1.0, level='WARNING'):
+        super().__init__()
+        self.rate = float(rate)
+        self.level = logging.getLevelName(level) if isinstance(level, str) else level
+
+    def filter(self, record):
+        return record.levelno >= self.level or random.random() < self.rate
+
+
+# One JSON object per line, with anything passed in extra= as fields of its own
+class JsonFormatter(logging.Formatter):
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in self.RESERVED)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
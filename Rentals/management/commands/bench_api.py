@@ -0,0 +1,309 @@
+import http.client
+import itertools
+import json
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import get_internal_wsgi_application, ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from Rentals.bench import current_commit, format_seconds, load_results, percentile, save_results, scratch_database
+from Rentals.geo import encode_geohash
+from Rentals.models import Game, Location, Message, OpenGame, Profile
+
+BATCH_SIZE = 5000
+LOCATIONS = 200
+# Users that requests are made as. Each has a token
+ACTORS = 200
+# Fresh games, still collecting applications, that the apply requests go to
+APPLY_GAMES = 50
+
+ENDPOINTS = ('game list', 'open games', 'inbox', 'apply', 'message', 'signup')
+
+
+class Command(BaseCommand):
+    help = ('Seeds users, profiles, games and messages at each scale and measures latency and throughput of the '
+            'hot API endpoints, in process through the test client and over HTTP against a multi-process WSGI '
+            'server. Results are saved under the current commit so later runs can --compare against them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000],
+                            help='Rows of each kind to seed, e.g. 1000 10000 100000 1000000')
+        parser.add_argument('--requests', type=int, default=300, help='Requests per endpoint and transport')
+        parser.add_argument('--transports', nargs='+', choices=['client', 'wsgi'], default=['client', 'wsgi'])
+        parser.add_argument('--server-workers', type=int, default=4,
+                            help='Processes serving the wsgi transport, each with a thread per connection')
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help='Requests in flight at once against the WSGI server')
+        parser.add_argument('--results', default=os.path.join(settings.BASE_DIR, 'bench_api.json'),
+                            help='JSON file the results are saved to, keyed by commit')
+        parser.add_argument('--compare', metavar='COMMIT', help='Show the change from the results saved for COMMIT')
+        parser.add_argument('--no-save', action='store_true')
+        parser.add_argument('--real-hasher', action='store_true',
+                            help='Hash signup passwords with the configured hasher instead of a fast one')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            baseline = load_results(options['results']).get(options['compare'])
+            if baseline is None:
+                raise CommandError('No results saved for {} in {}'.format(options['compare'], options['results']))
+
+        overrides = {'DEBUG': False}
+        if not options['real_hasher']:
+            # Signups are timed for the API, not for the password hasher
+            overrides['PASSWORD_HASHERS'] = ['django.contrib.auth.hashers.MD5PasswordHasher']
+        with override_settings(**overrides):
+            with scratch_database():
+                results = self.run(options, baseline)
+
+        if not options['no_save']:
+            commit = current_commit()
+            save_results(options['results'], commit, {
+                'recorded': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'scales': results,
+            })
+            self.stdout.write('Saved as {} in {}'.format(commit, options['results']))
+
+    def run(self, options, baseline):
+        rng = np.random.RandomState(0)
+        Location.objects.bulk_create([
+            Location(name='Rink {}'.format(i), latitude=latitude, longitude=longitude)
+            for i, (latitude, longitude) in enumerate(zip(rng.uniform(42.0, 45.0, LOCATIONS),
+                                                          rng.uniform(-82.0, -78.0, LOCATIONS)))
+        ])
+        signups = itertools.count()
+        results = {}
+        seeded = 0
+        for scale in sorted(options['scales']):
+            start = time.perf_counter()
+            self.seed(rng, seeded, scale)
+            seeded = scale
+            self.stdout.write('\n{} rows of each kind, seeded in {:.1f}s'.format(scale, time.perf_counter() - start))
+
+            requests = self.plan(rng, signups)
+            results[str(scale)] = {}
+            for transport in options['transports']:
+                measure = self.measure_client if transport == 'client' else self.measure_wsgi
+                results[str(scale)][transport] = measure(requests, options)
+                previous = (baseline or {}).get('scales', {}).get(str(scale), {}).get(transport)
+                self.report(transport, results[str(scale)][transport], previous)
+        return results
+
+    # Inserts rows start to end of each kind. Bulk inserts skip the signals, so profiles and open games are
+    # made here too
+    @staticmethod
+    def seed(rng, start, end):
+        now = timezone.now()
+        location_ids = list(Location.objects.values_list('id', flat=True))
+        all_user_ids = np.array(User.objects.values_list('id', flat=True), dtype=np.int64)
+        for chunk in range(start, end, BATCH_SIZE):
+            size = min(BATCH_SIZE, end - chunk)
+            last_user = int(all_user_ids.max()) if len(all_user_ids) else 0
+            User.objects.bulk_create([User(username='user_{}'.format(i), email='user_{}@example.com'.format(i))
+                                      for i in range(chunk, chunk + size)])
+            user_ids = np.array(User.objects.filter(id__gt=last_user).values_list('id', flat=True), dtype=np.int64)
+            all_user_ids = np.concatenate([all_user_ids, user_ids])
+            Profile.objects.bulk_create([
+                Profile(pk=int(user_id), user_id=int(user_id), location_id=int(location_id),
+                        is_goalie=bool(is_goalie), skill_level=int(skill_level), rating=float(rating))
+                for user_id, location_id, is_goalie, skill_level, rating in
+                zip(user_ids, rng.choice(location_ids, size), rng.randint(0, 2, size), rng.randint(1, 6, size),
+                    rng.uniform(0, 5, size))
+            ])
+
+            # Two years of past games and two months of upcoming ones, half of them with a goalie already
+            last_game = Game.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            latitudes = rng.uniform(42.0, 45.0, size)
+            longitudes = rng.uniform(-82.0, -78.0, size)
+            Game.objects.bulk_create([
+                Game(user_id=int(user_id), skill_level=int(skill_level), latitude=float(latitude),
+                     longitude=float(longitude), geohash=encode_geohash(latitude, longitude),
+                     game_time=now + timedelta(hours=int(hours)),
+                     goalie_one_id=int(goalie_id) if has_goalie else None,
+                     two_goalies_needed=bool(two_goalies), queue_resolved=True)
+                for user_id, skill_level, latitude, longitude, hours, goalie_id, has_goalie, two_goalies in
+                zip(rng.choice(all_user_ids, size), rng.randint(1, 6, size), latitudes, longitudes,
+                    rng.randint(-24 * 730, 24 * 60, size), rng.choice(all_user_ids, size),
+                    rng.randint(0, 2, size), rng.randint(0, 3, size) == 0)
+            ])
+            games = list(Game.objects.filter(id__gt=last_game)
+                         .only('id', 'user', 'game_time', 'skill_level', 'goalie_one', 'goalie_two',
+                               'two_goalies_needed'))
+            OpenGame.objects.bulk_create([OpenGame.from_game(game) for game in games if game.open_slots()])
+
+            Message.objects.bulk_create([
+                Message(game_id=game.id, game_user_id=game.user_id, goalie_user_id=int(goalie_id),
+                        sender_is_goalie=bool(from_goalie), body='Message {}'.format(game.id))
+                for game, goalie_id, from_goalie in
+                zip(games, rng.choice(all_user_ids, size), rng.randint(0, 2, size))
+            ])
+
+    # The requests for each endpoint, as functions of a request number returning (method, path, data, token)
+    @staticmethod
+    def plan(rng, signups):
+        user_ids = list(User.objects.filter(username__startswith='user_').values_list('id', flat=True))
+        actor_ids = sorted(int(user_id) for user_id in rng.choice(user_ids, min(ACTORS, len(user_ids)), replace=False))
+        Token.objects.filter(user_id__in=actor_ids).delete()
+        tokens = [Token(user_id=user_id) for user_id in actor_ids]
+        for token in tokens:
+            token.key = token.generate_key()
+        Token.objects.bulk_create(tokens)
+        tokens = dict(Token.objects.filter(user_id__in=actor_ids).values_list('user_id', 'key'))
+        actors = [(user_id, tokens[user_id]) for user_id in actor_ids]
+        game_ids = [int(game_id) for game_id in rng.choice(list(Game.objects.values_list('id', flat=True)), ACTORS)]
+        # Applications to these are queued, so every apply is an INSERT rather than a 410 for a full game
+        apply_game_ids = [Game.objects.create(user_id=actor_ids[0], queue_resolved=False).id
+                          for _ in range(APPLY_GAMES)]
+
+        def actor(number):
+            return actors[number % len(actors)]
+
+        def apply(number):
+            goalie_id, token = actor(number)
+            game_id = apply_game_ids[(number // len(actors)) % len(apply_game_ids)]
+            return 'POST', '/apply/', {'game': game_id, 'goalie': goalie_id}, token
+
+        def message(number):
+            renter_id, token = actor(number)
+            goalie_id, _ = actor(number + 1)
+            return 'POST', '/message/', {'game': game_ids[number % len(game_ids)], 'game_user': renter_id,
+                                         'goalie_user': goalie_id, 'body': 'Message {}'.format(number)}, token
+
+        def signup(number):
+            username = 'signup_{}'.format(next(signups))
+            return 'POST', '/user/', {'username': username, 'password': username + '_password'}, None
+
+        return {
+            'game list': lambda number: ('GET', '/game/', None, actor(number)[1]),
+            'open games': lambda number: ('GET', '/game/?open=true', None, actor(number)[1]),
+            'inbox': lambda number: ('GET', '/inbox/', None, actor(number)[1]),
+            'apply': apply,
+            'message': message,
+            'signup': signup,
+        }
+
+    # One request at a time through the test client: the cost of the view and the middleware, with no network
+    # or server in the way
+    @staticmethod
+    def measure_client(requests, options):
+        client = APIClient()
+        results = {}
+        for endpoint in ENDPOINTS:
+            latencies = []
+            errors = 0
+            started = time.perf_counter()
+            for number in range(options['requests']):
+                method, path, data, token = requests[endpoint](number)
+                headers = {'HTTP_AUTHORIZATION': 'Token ' + token} if token else {}
+                start = time.perf_counter()
+                response = client.generic(method, path, json.dumps(data) if data is not None else '',
+                                          content_type='application/json', **headers)
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code >= 400
+            results[endpoint] = summarize_run(latencies, time.perf_counter() - started, errors)
+        return results
+
+    # Many requests at once over HTTP, the way a load balancer would send them
+    def measure_wsgi(self, requests, options):
+        results = {}
+        with self.server(options['server_workers']) as (host, port):
+            for endpoint in ENDPOINTS:
+                def send(number):
+                    method, path, data, token = requests[endpoint](number)
+                    headers = {'Content-Type': 'application/json'}
+                    if token:
+                        headers['Authorization'] = 'Token ' + token
+                    conn = http.client.HTTPConnection(host, port, timeout=60)
+                    start = time.perf_counter()
+                    try:
+                        conn.request(method, path, json.dumps(data) if data is not None else None, headers)
+                        response = conn.getresponse()
+                        response.read()
+                        failed = response.status >= 400
+                    except (OSError, http.client.HTTPException):
+                        failed = True
+                    finally:
+                        conn.close()
+                    return time.perf_counter() - start, failed
+
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                    outcomes = list(pool.map(send, range(options['requests'])))
+                elapsed = time.perf_counter() - started
+                results[endpoint] = summarize_run([latency for latency, _ in outcomes], elapsed,
+                                                  sum(failed for _, failed in outcomes))
+        return results
+
+    # Pre-forks workers that all accept connections on one listening socket
+    @contextmanager
+    def server(self, workers):
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+        server.set_app(get_internal_wsgi_application())
+        # Each worker opens its own database connection
+        connection.close()
+        pids = []
+        try:
+            for _ in range(workers):
+                pid = os.fork()
+                if pid == 0:
+                    try:
+                        server.serve_forever()
+                    finally:
+                        os._exit(0)
+                pids.append(pid)
+            yield server.server_address
+        finally:
+            for pid in pids:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            server.server_close()
+
+    def report(self, transport, results, previous):
+        self.stdout.write('{:<7} {:<11} {:>10} {:>10} {:>10} {:>7}{}'.format(
+            transport, 'endpoint', 'p50', 'p99', 'req/s', 'errors', '  change from --compare' if previous else ''))
+        for endpoint in ENDPOINTS:
+            result = results[endpoint]
+            line = '{:<7} {:<11} {:>10} {:>10} {:>10.0f} {:>7}'.format(
+                '', endpoint, format_seconds(result['p50']), format_seconds(result['p99']), result['rps'],
+                result['errors'])
+            before = (previous or {}).get(endpoint)
+            if before:
+                line += '  p50 {} p99 {} req/s {}'.format(change(before['p50'], result['p50']),
+                                                          change(before['p99'], result['p99']),
+                                                          change(before['rps'], result['rps']))
+            self.stdout.write(line)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def summarize_run(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    return {
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'rps': len(latencies) / elapsed,
+        'errors': errors,
+    }
+
+
+def change(before, after):
+    if not before:
+        return 'n/a'
+    return '{:+.0f}%'.format((after - before) / before * 100)
@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from Rentals.bench import format_seconds, scratch_database, summarize, time_calls
+from Rentals.caching import get_response_cache
+from Rentals.models import Game, Location, Message
+from Rentals.views import GameList, LocationList, MessageList
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = ('Times full pages of games, messages and locations rendered through the serializers, through the '
+            'values_list() fast path (FAST_LIST_RESPONSES) and streamed from it (FAST_LIST_STREAMING), and checks '
+            'they all give the same bytes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help='Games and messages to seed')
+        parser.add_argument('--page-size', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(options)
+
+    def run(self, options):
+        # Profiles default to location 1, which has to exist before any user is created
+        Location.objects.create(name='Kitchener', latitude=43.4516395, longitude=-80.49253369999997)
+        Location.objects.bulk_create([Location(name='Rink {}'.format(i), latitude=43 + i / 1000, longitude=-80)
+                                      for i in range(options['page_size'])])
+        renter = User.objects.create_user('renter', 'renter@example.com', 'benchpassword')
+        goalie = User.objects.create_user('goalie', 'goalie@example.com', 'benchpassword')
+        self.seed(renter, goalie, options['rows'])
+
+        factory = APIRequestFactory()
+        endpoints = [('games', GameList, '/game/'), ('messages', MessageList, '/message/'),
+                     ('locations', LocationList, '/location/')]
+
+        # Each configuration is (FAST_LIST_RESPONSES, FAST_LIST_STREAMING)
+        configurations = [('serializer', False, False), ('fast', True, False), ('streamed', True, True)]
+        self.stdout.write('{:>10} {:>12} {:>12} {:>12} {:>9}'.format(
+            'endpoint', *[label for label, _, _ in configurations], 'speedup'))
+        for name, view_class, url in endpoints:
+            view = view_class.as_view()
+
+            def render_page():
+                request = factory.get(url, {'page_size': options['page_size']})
+                force_authenticate(request, user=renter)
+                # The location list is cached, and renders its body itself on a miss
+                get_response_cache().clear()
+                response = view(request)
+                if response.streaming:
+                    return b''.join(response.streaming_content)
+                return response.content if response.get('X-Cache') else response.render().content
+
+            bodies = []
+            medians = []
+            for label, fast, streamed in configurations:
+                with override_settings(FAST_LIST_RESPONSES=fast, FAST_LIST_STREAMING=streamed):
+                    bodies.append(render_page())
+                    medians.append(summarize(time_calls(render_page, options['repeat']))['median'])
+            for (label, _, _), body in zip(configurations[1:], bodies[1:]):
+                if body != bodies[0]:
+                    self.stderr.write('{}: the {} path gave different bytes'.format(name, label))
+            # Of the fastest fast path over the serializers
+            self.stdout.write('{:>10} {:>12} {:>12} {:>12} {:>8.1f}x'.format(
+                name, *[format_seconds(median) for median in medians], medians[0] / min(medians[1:])))
+
+    @staticmethod
+    def seed(renter, goalie, rows):
+        now = timezone.now()
+        games = [Game(user=renter, skill_level=i % 5 + 1, game_time=now + timedelta(minutes=i),
+                      goalie_one=goalie if i % 2 else None, location='Rink {}'.format(i), geohash='dpwz0q55u')
+                 for i in range(rows)]
+        for start in range(0, len(games), BATCH_SIZE):
+            Game.objects.bulk_create(games[start:start + BATCH_SIZE])
+        game_ids = list(Game.objects.values_list('id', flat=True))
+        messages = [Message(game_id=game_ids[i % len(game_ids)], body='Still need a goalie for this one?',
+                            game_user=renter, goalie_user=goalie, sender_is_goalie=bool(i % 2))
+                    for i in range(rows)]
+        for start in range(0, len(messages), BATCH_SIZE):
+            Message.objects.bulk_create(messages[start:start + BATCH_SIZE])
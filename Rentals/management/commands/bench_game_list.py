@@ -0,0 +1,59 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from Rentals.bench import format_seconds, scratch_database, summarize, time_calls
+from Rentals.models import Game, Location
+from Rentals.views import GameList
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = 'Times GET /game/ as the number of past games grows while the upcoming games stay fixed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history', type=int, nargs='+', default=[0, 10000, 100000, 500000])
+        parser.add_argument('--upcoming', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(options)
+
+    def run(self, options):
+        # Profiles default to location 1, which has to exist before any user is created
+        Location.objects.create(name='Kitchener', latitude=43.4516395, longitude=-80.49253369999997)
+        user = User.objects.create_user('bench', 'bench@example.com', 'benchpassword')
+        now = timezone.now()
+        self.seed(user, [now + timedelta(hours=i) for i in range(options['upcoming'])])
+
+        view = GameList.as_view()
+        factory = APIRequestFactory()
+
+        def list_games(**params):
+            request = factory.get('/game/', params)
+            force_authenticate(request, user=user)
+            view(request).render()
+
+        self.stdout.write('{:>10} {:>12} {:>12} {:>16}'.format('past games', 'median', 'best', 'skill_level=3'))
+        seeded = 0
+        for history in sorted(options['history']):
+            # Past games spread over the last few years, all outside the upcoming window
+            self.seed(user, [now - timedelta(days=2, minutes=i) for i in range(seeded, history)])
+            seeded = history
+            timings = summarize(time_calls(list_games, options['repeat']))
+            skill_timings = summarize(time_calls(lambda: list_games(skill_level=3), options['repeat']))
+            self.stdout.write('{:>10} {:>12} {:>12} {:>16}'.format(
+                history, format_seconds(timings['median']), format_seconds(timings['best']),
+                format_seconds(skill_timings['median'])))
+
+    @staticmethod
+    def seed(user, game_times):
+        games = [Game(user=user, skill_level=i % 5 + 1, game_time=game_time, geohash='dpwz0q55u')
+                 for i, game_time in enumerate(game_times)]
+        for start in range(0, len(games), BATCH_SIZE):
+            Game.objects.bulk_create(games[start:start + BATCH_SIZE])
@@ -0,0 +1,62 @@
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from Rentals.bench import format_seconds, scratch_database, summarize, time_calls
+from Rentals.matching import candidate_index, rank_goalies
+from Rentals.models import Game, Location, Profile
+
+
+class Command(BaseCommand):
+    help = 'Measures how long the matching engine takes to build its index and rank goalies for a game'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, nargs='+', default=[1000, 10000, 50000])
+        parser.add_argument('--locations', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(options)
+
+    def run(self, options):
+        rng = np.random.RandomState(0)
+        locations = Location.objects.bulk_create([
+            Location(name='Rink {}'.format(i), latitude=latitude, longitude=longitude)
+            for i, (latitude, longitude) in enumerate(zip(rng.uniform(42.0, 45.0, options['locations']),
+                                                          rng.uniform(-82.0, -78.0, options['locations'])))
+        ])
+        location_ids = list(Location.objects.values_list('id', flat=True))
+        game = Game(skill_level=3, latitude=43.4516395, longitude=-80.4925337)
+
+        self.stdout.write('{:>9} {:>12} {:>12}'.format('profiles', 'build', 'rank top 10'))
+        seeded = 0
+        for size in sorted(options['profiles']):
+            self.seed(rng, seeded, size, location_ids)
+            seeded = size
+
+            build = summarize(time_calls(candidate_index.build, options['repeat']))
+            candidate_index.invalidate()
+            rank_goalies(game)
+            rank = summarize(time_calls(lambda: rank_goalies(game), options['repeat']))
+            self.stdout.write('{:>9} {:>12} {:>12}'.format(size, format_seconds(build['median']),
+                                                          format_seconds(rank['median'])))
+        self.stdout.write('build runs once per profile change; rank is what each request pays. '
+                          '{} locations'.format(len(locations)))
+
+    # Bulk inserts skip the signals, so the profiles are made here instead of by create_user_profile
+    @staticmethod
+    def seed(rng, start, end, location_ids):
+        User.objects.bulk_create([User(username='goalie_{}'.format(i)) for i in range(start, end)],
+                                 batch_size=500)
+        user_ids = User.objects.filter(profileUser__isnull=True).values_list('id', flat=True)
+        Profile.objects.bulk_create([
+            Profile(pk=user_id,
+                    user_id=user_id,
+                    location_id=int(rng.choice(location_ids)),
+                    skill_level=int(rng.randint(1, 6)),
+                    rating=float(rng.uniform(0, 5)),
+                    games_played=int(rng.randint(0, 100)),
+                    cancellations=int(rng.randint(0, 5)))
+            for user_id in user_ids
+        ], batch_size=500)
@@ -0,0 +1,60 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+
+from Rentals.bench import format_seconds, percentile, scratch_database
+from Rentals.models import Location
+from Rentals.views import UserList
+
+
+class Command(BaseCommand):
+    help = 'Measures signup throughput and queries per signup through UserList'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--signups', type=int, default=200)
+        parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(options)
+
+    def run(self, options):
+        # Profiles default to location 1
+        Location.objects.create(name='Kitchener', latitude=43.4516395, longitude=-80.49253369999997)
+        view = UserList.as_view()
+        factory = APIRequestFactory()
+        counter = iter(range(10 ** 9))
+
+        def signup():
+            number = next(counter)
+            request = factory.post('/user/', {
+                'username': 'bench_{}'.format(number),
+                'email': 'bench_{}@example.com'.format(number),
+                'password': 'benchpassword{}'.format(number),
+            }, format='json')
+            start = time.perf_counter()
+            try:
+                response = view(request)
+                assert response.status_code == 201, response.data
+            finally:
+                connection.close()
+            return time.perf_counter() - start
+
+        with CaptureQueriesContext(connection) as queries:
+            request = factory.post('/user/', {'username': 'counted', 'password': 'countedpassword'}, format='json')
+            view(request)
+        self.stdout.write('{} queries per signup'.format(len(queries)))
+
+        self.stdout.write('{:>8} {:>12} {:>12} {:>12}'.format('threads', 'signups/s', 'median', 'p99'))
+        for threads in options['threads']:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                latencies = sorted(pool.map(lambda _: signup(), range(options['signups'])))
+            elapsed = time.perf_counter() - start
+            self.stdout.write('{:>8} {:>12.1f} {:>12} {:>12}'.format(
+                threads, options['signups'] / elapsed, format_seconds(percentile(latencies, 0.5)),
+                format_seconds(percentile(latencies, 0.99))))
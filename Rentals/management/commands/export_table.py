@@ -0,0 +1,83 @@
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from Rentals.export import EXPORT_FORMATS, TABLES, TableExport
+
+
+class Command(BaseCommand):
+    help = ('Streams the games, messages or profiles table to a file as NDJSON, CSV or Parquet, for analytics. '
+            'With --state, each run only exports the rows added since the last one')
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=sorted(TABLES))
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson', dest='file_format')
+        parser.add_argument('--output', default='-', help='File to write to, - for standard output')
+        parser.add_argument('--after-id', type=int, help='Only export rows with a greater id')
+        parser.add_argument('--since', help='ISO 8601 time. Only export games or messages created since then')
+        parser.add_argument('--state', help='JSON file keeping the watermark of the last export of each table. '
+                                            'Exports start after it, and it is moved on once they finish')
+
+    def handle(self, *args, **options):
+        table = options['table']
+        after_id = options['after_id']
+        state = self.load_state(options['state']) if options['state'] else {}
+        if after_id is None:
+            after_id = state.get(table)
+
+        try:
+            export = TableExport(table, after_id=after_id, since=self.parse_since(options['since']))
+            body = export.stream(options['file_format'])
+        except ValueError as error:
+            raise CommandError(error)
+
+        written = 0
+        if options['output'] == '-':
+            output = sys.stdout.buffer
+            for data in body:
+                output.write(data)
+                written += len(data)
+            output.flush()
+        else:
+            with open(options['output'], 'wb') as output:
+                for data in body:
+                    output.write(data)
+                    written += len(data)
+
+        if options['state'] and export.watermark is not None:
+            state[table] = export.watermark
+            self.save_state(options['state'], state)
+        self.stderr.write('Exported {} up to id {} ({} bytes)'.format(table, export.watermark, written))
+
+    @staticmethod
+    def parse_since(value):
+        if value is None:
+            return None
+        try:
+            since = parse_datetime(value)
+        except ValueError:
+            since = None
+        if since is None:
+            raise CommandError('--since expects an ISO 8601 date and time, e.g. 2019-02-12T20:00:00Z')
+        return timezone.make_aware(since) if timezone.is_naive(since) else since
+
+    @staticmethod
+    def load_state(path):
+        try:
+            with open(path) as state_file:
+                return json.load(state_file)
+        except FileNotFoundError:
+            return {}
+
+    # Written to a temporary file and moved into place, so a crash never leaves it half written
+    @staticmethod
+    def save_state(path, state):
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as state_file:
+            json.dump(state, state_file, indent=2, sort_keys=True)
+            state_file.write('\n')
+        os.replace(temporary, path)
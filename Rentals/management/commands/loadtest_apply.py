@@ -0,0 +1,76 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from Rentals.bench import scratch_database
+from Rentals.goalie_queue import resolve_closed_queues, WAIT_TIME
+from Rentals.models import Game
+from Rentals.views import ApplyForGame
+
+
+class Command(BaseCommand):
+    help = 'Fires concurrent applies at one game and checks that only the open slots were handed out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--applicants', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=64)
+        parser.add_argument('--games', type=int, default=1,
+                            help='Run the whole thing this many times, each against a fresh game')
+        parser.add_argument('--one-goalie', action='store_true', help='Only one slot is open on the game')
+        parser.add_argument('--queue', action='store_true',
+                            help="Apply while the game's applicant queue is open, then resolve it")
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(options)
+
+    def run(self, options):
+        User.objects.bulk_create([User(username='goalie_{}'.format(i)) for i in range(options['applicants'] + 1)])
+        goalies = list(User.objects.values_list('id', flat=True))
+        renter = goalies.pop()
+        expected_winners = 1 if options['one_goalie'] else 2
+        view = ApplyForGame.as_view()
+        factory = APIRequestFactory()
+
+        for _ in range(options['games']):
+            game = Game.objects.create(user_id=renter, two_goalies_needed=not options['one_goalie'],
+                                       queue_resolved=not options['queue'])
+
+            def apply(goalie_id):
+                try:
+                    request = factory.post('/apply/', {'game': game.id, 'goalie': goalie_id}, format='json')
+                    force_authenticate(request, user=User(pk=goalie_id))
+                    return view(request).status_code
+                finally:
+                    connection.close()
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                statuses = Counter(pool.map(apply, goalies))
+            elapsed = time.perf_counter() - start
+            self.stdout.write('{} applies in {:.2f}s ({:.0f}/s), responses: {}'.format(
+                len(goalies), elapsed, len(goalies) / elapsed, dict(statuses)))
+
+            if options['queue']:
+                if statuses[200] != len(goalies):
+                    raise CommandError('Expected every apply to be queued, got {}'.format(dict(statuses)))
+                start = time.perf_counter()
+                resolve_closed_queues(now=timezone.now() + timedelta(minutes=WAIT_TIME))
+                self.stdout.write('Queue of {} resolved in {:.2f}s'.format(len(goalies), time.perf_counter() - start))
+                winners = expected_winners
+            else:
+                winners = statuses[202]
+
+            game.refresh_from_db()
+            assigned = {game.goalie_one_id, game.goalie_two_id} - {None}
+            if winners != expected_winners or len(assigned) != expected_winners:
+                raise CommandError('Expected exactly {} winners, got {} accepted applies and goalies {}'.format(
+                    expected_winners, winners, sorted(assigned)))
+        self.stdout.write('OK: exactly {} winner(s) per game'.format(expected_winners))
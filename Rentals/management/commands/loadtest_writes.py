@@ -0,0 +1,127 @@
+import itertools
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from Rentals.bench import format_seconds, percentile, scratch_database
+from Rentals.models import Game, Location
+from Rentals.views import ApplyForGame, MessageList, UserList
+
+# How often each kind of write comes up
+WORKLOAD = (
+    ('apply', 5),
+    ('message', 4),
+    ('signup', 1),
+)
+
+
+class Command(BaseCommand):
+    help = ('Measures write throughput for a mix of applies, messages and signups from many threads at once, '
+            'against a scratch copy of the configured database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32])
+        parser.add_argument('--duration', type=float, default=5, help='Seconds to run each setup for')
+        parser.add_argument('--journal-modes', nargs='+', default=['DELETE', 'WAL'],
+                            help='SQLite journal modes to compare. Ignored for other databases')
+        parser.add_argument('--goalies', type=int, default=2000)
+        parser.add_argument('--games', type=int, default=50)
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            setups = [('sqlite ' + mode.lower(), {'SQLITE_JOURNAL_MODE': mode})
+                      for mode in options['journal_modes']]
+        else:
+            setups = [(connection.vendor, {})]
+
+        self.stdout.write('{:<16} {:>8} {:>10} {:>10} {:>10} {:>8}'.format('setup', 'threads', 'writes/s', 'p50',
+                                                                          'p99', 'errors'))
+        for name, overrides in setups:
+            for threads in options['threads']:
+                # Signups are timed for the database, not for the password hasher
+                with override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+                                       **overrides):
+                    with scratch_database():
+                        result = self.run(threads, options)
+                self.stdout.write('{:<16} {:>8} {:>10.0f} {:>10} {:>10} {:>8}'.format(
+                    name, threads, result['throughput'], format_seconds(result['p50']),
+                    format_seconds(result['p99']), result['errors']))
+                if result['error_types']:
+                    self.stdout.write('    {}'.format(dict(result['error_types'])))
+
+    def run(self, threads, options):
+        # Profiles default to location 1
+        Location.objects.create(name='Kitchener', latitude=43.4516395, longitude=-80.49253369999997)
+        User.objects.bulk_create([User(username='goalie_{}'.format(i)) for i in range(options['goalies'] + 1)])
+        goalies = list(User.objects.values_list('id', flat=True))
+        renter = goalies.pop()
+        game_ids = [Game.objects.create(user_id=renter).id for _ in range(options['games'])]
+        connection.close()
+
+        factory = APIRequestFactory()
+        counter = itertools.count()
+        deadline = time.perf_counter() + options['duration']
+        kinds, weights = zip(*WORKLOAD)
+
+        def write(kind, number):
+            goalie = goalies[number % len(goalies)]
+            if kind == 'apply':
+                # Every apply is a different goalie and game pair, so each one inserts a row
+                game = game_ids[(number // len(goalies)) % len(game_ids)]
+                request = factory.post('/apply/', {'game': game, 'goalie': goalie}, format='json')
+                force_authenticate(request, user=User(pk=goalie))
+                return ApplyForGame.as_view()(request)
+            if kind == 'message':
+                request = factory.post('/message/', {'game': game_ids[number % len(game_ids)], 'game_user': renter,
+                                                     'goalie_user': goalie, 'body': 'Message {}'.format(number)},
+                                       format='json')
+                force_authenticate(request, user=User(pk=renter))
+                return MessageList.as_view()(request)
+            request = factory.post('/user/', {'username': 'signup_{}'.format(number),
+                                              'password': 'signuppassword{}'.format(number)}, format='json')
+            return UserList.as_view()(request)
+
+        def worker(seed):
+            rng = random.Random(seed)
+            latencies = []
+            errors = Counter()
+            try:
+                while time.perf_counter() < deadline:
+                    kind = rng.choices(kinds, weights)[0]
+                    start = time.perf_counter()
+                    try:
+                        response = write(kind, next(counter))
+                        if response.status_code >= 400:
+                            errors['{} {}'.format(kind, response.status_code)] += 1
+                            continue
+                    except Exception as error:
+                        errors['{} {}'.format(kind, type(error).__name__)] += 1
+                        continue
+                    latencies.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+            return latencies, errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(worker, range(threads)))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for worker_latencies, _ in results for latency in worker_latencies)
+        errors = sum((worker_errors for _, worker_errors in results), Counter())
+        if not latencies:
+            raise CommandError('Every write failed: {}'.format(dict(errors)))
+        return {
+            'throughput': len(latencies) / elapsed,
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+            'errors': sum(errors.values()),
+            'error_types': errors,
+        }
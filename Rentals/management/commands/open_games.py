@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from Rentals.models import Game, OpenGame
+from Rentals.views import UPCOMING_GAME_GRACE
+
+
+class Command(BaseCommand):
+    help = 'Checks the open games table used by the goalie feed against Game, or rebuilds it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Report the games whose rows are missing or wrong, and fail if there are any')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recompute every row from Game')
+        parser.add_argument('--prune', action='store_true',
+                            help='Delete the rows of games too old to show up in the feed')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not (options['check'] or options['rebuild'] or options['prune']):
+            raise CommandError('Pass at least one of --check, --rebuild and --prune')
+        since = timezone.now() - UPCOMING_GAME_GRACE
+
+        if options['rebuild']:
+            game_ids = list(Game.objects.order_by('id').values_list('id', flat=True))
+            for start in range(0, len(game_ids), options['batch_size']):
+                OpenGame.refresh(game_ids[start:start + options['batch_size']])
+            # Rows whose game is gone are deleted with the game, so refreshing every game covers the table
+            self.stdout.write('Rebuilt open games for {} games'.format(len(game_ids)))
+
+        if options['prune']:
+            deleted, _ = OpenGame.objects.filter(game_time__lt=since).delete()
+            self.stdout.write('Pruned {} rows for past games'.format(deleted))
+
+        if options['check']:
+            missing, wrong = OpenGame.find_inconsistencies(since)
+            if missing or wrong:
+                raise CommandError('Open games table is out of date. Missing: {}. Wrong: {}. '
+                                   'Fix it with --rebuild'.format(missing, wrong))
+            self.stdout.write('Open games table matches Game for games since {}'.format(since.isoformat()))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Rentals.goalie_queue import resolve_closed_queues
+
+
+class Command(BaseCommand):
+    help = 'Gives the games whose application window has closed their best applicants, checking every few seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Resolve every game that is due and exit instead of running as a worker')
+        parser.add_argument('--interval', type=float, default=15,
+                            help='Seconds to wait before checking again when no games are due')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Games resolved per transaction')
+
+    def handle(self, *args, **options):
+        while True:
+            resolved = resolve_closed_queues(batch_size=options['batch_size'])
+            if resolved:
+                self.stdout.write('Resolved {} games'.format(resolved))
+            if resolved < options['batch_size']:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Rentals.outbox import send_pending
+
+
+class Command(BaseCommand):
+    help = 'Sends the emails waiting in the outbox, checking for new ones every few seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Send everything that is due and exit instead of running as a worker')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait before checking again when the outbox is empty')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Emails sent per connection to the mail server')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_pending(options['batch_size'])
+            if sent or failed:
+                self.stdout.write('Sent {}, failed {}'.format(sent, failed))
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['interval'])
@@ -0,0 +1,150 @@
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .distance import batch_distance_km
+from .models import Location, Profile
+
+# Ranks the goalies who could play a game. Each goalie gets a score between 0 and 1 from four parts, weighted
+# by settings.MATCHING_WEIGHTS:
+#     skill         - how close their skill_level is to the game's. Goalies below the game's level lose twice
+#                     as much per level as goalies above it
+#     distance      - falls off exponentially with the distance from their location to the game, halving every
+#                     MATCHING_DISTANCE_HALF_LIFE_KM. Goalies further than MATCHING_MAX_DISTANCE_KM are left out
+#     rating        - their rating out of 5
+#     cancellations - the share of their games they didn't cancel
+#
+# Scoring reads every goalie's profile, so instead of querying for them on each request the candidates live
+# in an in-memory index of NumPy arrays, and a ranking is a handful of vectorized operations over it. The
+# index is rebuilt the first time it's used after a profile, location or user changes in this process.
+# Changes made by other processes are only picked up when the index is MATCHING_INDEX_TTL seconds old.
+
+DEFAULT_WEIGHTS = {
+    'skill': 0.4,
+    'distance': 0.3,
+    'rating': 0.2,
+    'cancellations': 0.1,
+}
+# Skill levels run from 1 to 5, so goalies can be at most 4 levels away from the game
+MAX_SKILL_DIFFERENCE = 4
+
+
+def get_weights():
+    return getattr(settings, 'MATCHING_WEIGHTS', DEFAULT_WEIGHTS)
+
+
+class CandidateIndex(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._arrays = None
+        self._built_at = 0
+        self._stale = True
+
+    def invalidate(self):
+        self._stale = True
+
+    def get_arrays(self):
+        ttl = getattr(settings, 'MATCHING_INDEX_TTL', 300)
+        with self._lock:
+            if self._stale or self._arrays is None or time.monotonic() - self._built_at > ttl:
+                # Cleared before reading, so a change made while the index is being built marks it stale again
+                self._stale = False
+                self._arrays = self.build()
+                self._built_at = time.monotonic()
+            return self._arrays
+
+    @staticmethod
+    def build():
+        rows = list(Profile.objects
+                    .filter(is_goalie=True, user__is_active=True)
+                    .values_list('user_id', 'skill_level', 'rating', 'cancellations', 'games_played',
+                                 'location__latitude', 'location__longitude'))
+        columns = list(zip(*rows)) or [()] * 7
+        user_ids, skill_levels, ratings, cancellations, games_played, latitudes, longitudes = columns
+        cancellations = np.array(cancellations, dtype=np.float64)
+        booked = np.array(games_played, dtype=np.float64) + cancellations
+        return {
+            'user_id': np.array(user_ids, dtype=np.int64),
+            # Where each goalie is in the arrays, by user id
+            'position': {user_id: position for position, user_id in enumerate(user_ids)},
+            'skill_level': np.array(skill_levels, dtype=np.float64),
+            'rating': np.array(ratings, dtype=np.float64),
+            # Goalies who haven't booked a game yet haven't cancelled one either
+            'reliability': 1 - np.divide(cancellations, booked, out=np.zeros_like(booked), where=booked > 0),
+            'latitude': np.array(latitudes, dtype=np.float64),
+            'longitude': np.array(longitudes, dtype=np.float64),
+        }
+
+
+candidate_index = CandidateIndex()
+
+
+# Returns up to limit candidates for the game, best first, as dicts of goalie (user id), score, distance_km,
+# skill_level and rating. Goalies in exclude (user ids) are left out. With only (user ids), just those goalies
+# are ranked, however far away they are
+def rank_goalies(game, limit=10, exclude=(), only=None):
+    arrays = candidate_index.get_arrays()
+    if only is None:
+        candidates = np.arange(len(arrays['user_id']))
+    else:
+        positions = arrays['position']
+        candidates = np.array([positions[user_id] for user_id in only if user_id in positions], dtype=np.int64)
+    excluded = [user_id for user_id in set(exclude) | {game.user_id} if user_id is not None]
+    if excluded:
+        candidates = candidates[~np.isin(arrays['user_id'][candidates], excluded)]
+    if len(candidates) == 0:
+        return []
+    weights = get_weights()
+
+    user_ids = arrays['user_id'][candidates]
+    distance = batch_distance_km(game.latitude, game.longitude,
+                                 arrays['latitude'][candidates], arrays['longitude'][candidates])
+    skill_difference = arrays['skill_level'][candidates] - game.skill_level
+    # Skill level 1 is the best, so a positive difference means the goalie is below the game's level
+    skill_penalty = np.where(skill_difference > 0, 2 * skill_difference, -skill_difference)
+    half_life = getattr(settings, 'MATCHING_DISTANCE_HALF_LIFE_KM', 15)
+
+    score = (weights['skill'] * np.clip(1 - skill_penalty / (2 * MAX_SKILL_DIFFERENCE), 0, 1)
+             + weights['distance'] * np.exp2(-distance / half_life)
+             + weights['rating'] * arrays['rating'][candidates] / 5
+             + weights['cancellations'] * arrays['reliability'][candidates])
+    score /= sum(weights.values())
+
+    if only is None:
+        eligible = np.flatnonzero(distance <= getattr(settings, 'MATCHING_MAX_DISTANCE_KM', 100))
+    else:
+        eligible = np.arange(len(candidates))
+    if len(eligible) > limit:
+        # Only the top few need sorting
+        eligible = eligible[np.argpartition(-score[eligible], limit - 1)[:limit]]
+    # Ties go to the longest-standing account
+    ranked = eligible[np.lexsort((user_ids[eligible], -score[eligible]))]
+
+    return [{
+        'goalie': int(user_ids[i]),
+        'score': round(float(score[i]), 4),
+        'distance_km': round(float(distance[i]), 2),
+        'skill_level': int(arrays['skill_level'][candidates[i]]),
+        'rating': float(arrays['rating'][candidates[i]]),
+    } for i in ranked]
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+@receiver(post_delete, sender=User)
+def invalidate_candidate_index(sender, **kwargs):
+    candidate_index.invalidate()
+
+
+# Logging in saves the user too, but only last_login, which the index doesn't use
+@receiver(post_save, sender=User)
+def invalidate_candidate_index_for_user(sender, update_fields=None, **kwargs):
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        candidate_index.invalidate()
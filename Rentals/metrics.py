@@ -0,0 +1,175 @@
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Per view request metrics, collected by MetricsMiddleware and served to admins at /metrics/:
+#     latency - seconds from the middleware getting the request to it returning the response
+#     db_time - seconds spent running SQL
+#     queries - SQL statements run. A view whose count grows with the size of the response has an N+1
+#     render  - seconds spent rendering the response body (JSON serialization for the API views)
+# Each is a histogram with fixed buckets, so recording is cheap and memory doesn't grow with traffic.
+# The numbers are for the process that serves the /metrics/ request, since the last restart.
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram(object):
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # The last bucket is for everything above the highest bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # The upper bound of the bucket the quantile falls in, or the largest value seen if it's past the last bound
+    def quantile(self, fraction):
+        if not self.total:
+            return 0
+        rank = fraction * self.total
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.total,
+            'mean': self.sum / self.total if self.total else 0,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+            'buckets': {('+Inf' if index == len(self.bounds) else str(self.bounds[index])): count
+                        for index, count in enumerate(self.counts)},
+        }
+
+
+class ViewMetrics(object):
+    def __init__(self):
+        self.latency = Histogram(SECONDS_BUCKETS)
+        self.db_time = Histogram(SECONDS_BUCKETS)
+        self.queries = Histogram(COUNT_BUCKETS)
+        self.render = Histogram(SECONDS_BUCKETS)
+        self.statuses = defaultdict(int)
+
+    def as_dict(self):
+        return {
+            'statuses': dict(self.statuses),
+            'latency': self.latency.as_dict(),
+            'db_time': self.db_time.as_dict(),
+            'queries': self.queries.as_dict(),
+            'render': self.render.as_dict(),
+        }
+
+
+_lock = threading.Lock()
+_views = defaultdict(ViewMetrics)
+
+
+def record(view_name, status_code, latency, db_time, queries, render_time):
+    with _lock:
+        metrics = _views[view_name]
+        metrics.statuses['{}xx'.format(status_code // 100)] += 1
+        metrics.latency.observe(latency)
+        metrics.db_time.observe(db_time)
+        metrics.queries.observe(queries)
+        if render_time is not None:
+            metrics.render.observe(render_time)
+
+
+def get_metrics():
+    with _lock:
+        return {name: metrics.as_dict() for name, metrics in sorted(_views.items())}
+
+
+def reset_metrics():
+    with _lock:
+        _views.clear()
+
+
+# Wrapped around every SQL statement while a request is handled (see connection.execute_wrapper)
+class QueryTimer(object):
+    def __init__(self):
+        self.queries = 0
+        self.time = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.queries += 1
+
+
+class MetricsMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        latency = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match is not None else 'unresolved'
+        render_time = getattr(request, '_metrics_render_time', None)
+        record(view_name, response.status_code, latency, timer.time, timer.queries, render_time)
+        self.log(request, view_name, response.status_code, latency, timer, render_time)
+        return response
+
+    # Called just before a DRF (or template) response is rendered
+    def process_template_response(self, request, response):
+        start = time.perf_counter()
+
+        def rendered(response):
+            request._metrics_render_time = time.perf_counter() - start
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    # Slow or query-heavy requests are logged as warnings, the rest at debug level (which the logging settings
+    # only keep a sample of)
+    @staticmethod
+    def log(request, view_name, status_code, latency, timer, render_time):
+        slow = latency >= getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', 1)
+        many_queries = timer.queries >= getattr(settings, 'METRICS_QUERY_WARNING_COUNT', 50)
+        if not (slow or many_queries or logger.isEnabledFor(logging.DEBUG)):
+            return
+        fields = {
+            'view': view_name,
+            'method': request.method,
+            'status': status_code,
+            'latency_ms': round(latency * 1000, 2),
+            'db_ms': round(timer.time * 1000, 2),
+            'queries': timer.queries,
+            'render_ms': round(render_time * 1000, 2) if render_time is not None else None,
+        }
+        if slow:
+            logger.warning('Slow request', extra=fields)
+        elif many_queries:
+            logger.warning('Request ran many queries', extra=fields)
+        else:
+            logger.debug('Request', extra=fields)
@@ -0,0 +1,63 @@
+# Generated by Django 2.1.3 on 2026-10-18 09:20
+
+from django.db import migrations, models
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+
+
+# A copy of Rentals.geo.encode_geohash as it was when this migration was written, so later changes there
+# can't change what it writes
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits = bits << 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits = bits << 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def populate_geohashes(apps, schema_editor):
+    Game = apps.get_model('Rentals', 'Game')
+    for game in Game.objects.only('id', 'latitude', 'longitude').iterator():
+        Game.objects.filter(pk=game.pk).update(geohash=encode_geohash(game.latitude, game.longitude))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Rentals', '0008_auto_20190212_0459'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='geohash',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=9),
+        ),
+        migrations.RunPython(populate_geohashes, migrations.RunPython.noop),
+    ]
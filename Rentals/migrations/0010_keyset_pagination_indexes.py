@@ -0,0 +1,21 @@
+# Generated by Django 2.1.3 on 2026-10-18 09:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Rentals', '0009_game_geohash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['game_time', 'id'], name='game_time_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['creation_time', 'id'], name='message_creation_time_id_idx'),
+        ),
+    ]
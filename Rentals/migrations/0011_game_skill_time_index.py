@@ -0,0 +1,17 @@
+# Generated by Django 2.1.3 on 2026-10-18 09:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Rentals', '0010_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['skill_level', 'game_time', 'id'], name='game_skill_time_id_idx'),
+        ),
+    ]
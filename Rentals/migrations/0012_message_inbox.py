@@ -0,0 +1,26 @@
+# Generated by Django 2.1.3 on 2026-10-18 09:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Rentals', '0011_game_skill_time_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='read',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['game_user', 'creation_time'], name='message_game_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['goalie_user', 'creation_time'], name='message_goalie_user_time_idx'),
+        ),
+    ]
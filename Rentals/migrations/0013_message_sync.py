@@ -0,0 +1,26 @@
+# Generated by Django 2.1.3 on 2026-10-18 09:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Rentals', '0012_message_inbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='creation_time',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['game_user', 'id'], name='message_game_user_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['goalie_user', 'id'], name='message_goalie_user_id_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.1.3 on 2026-10-18 09:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Rentals', '0014_outbox_email'),
+    ]
+
+    operations = [
+        # Games that already exist were first come, first served, so they start out resolved
+        migrations.AddField(
+            model_name='game',
+            name='queue_resolved',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='queue_resolved',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='creation_time',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['queue_resolved', 'creation_time'], name='game_queue_due_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 2.1.3 on 2026-10-18 09:49
+
+from django.db import migrations, models
+from django.db.models import Q
+import django.db.models.deletion
+
+
+def fill_open_games(apps, schema_editor):
+    Game = apps.get_model('Rentals', 'Game')
+    OpenGame = apps.get_model('Rentals', 'OpenGame')
+    rows = []
+    for game in Game.objects.filter(Q(goalie_one__isnull=True) | Q(two_goalies_needed=True, goalie_two__isnull=True))\
+            .iterator():
+        slots_open = int(game.goalie_one_id is None) + int(game.two_goalies_needed and game.goalie_two_id is None)
+        rows.append(OpenGame(game_id=game.id, game_time=game.game_time, skill_level=game.skill_level,
+                             slots_open=slots_open))
+    OpenGame.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Rentals', '0015_goalie_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenGame',
+            fields=[
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='open_slot', serialize=False, to='Rentals.Game')),
+                ('game_time', models.DateTimeField()),
+                ('skill_level', models.IntegerField()),
+                ('slots_open', models.IntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='opengame',
+            index=models.Index(fields=['game_time', 'game'], name='open_game_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='opengame',
+            index=models.Index(fields=['skill_level', 'game_time', 'game'], name='open_game_skill_time_idx'),
+        ),
+        migrations.RunPython(fill_open_games, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,17 @@
 from django.contrib.auth.models import User
-from django.core.mail import EmailMessage
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.template.loader import render_to_string
 from django.utils.encoding import force_bytes
+from django.utils import timezone
 from django.utils.http import urlsafe_base64_encode
 
 from rest_framework.authtoken.models import Token
 
+from .geo import encode_geohash, GEOHASH_PRECISION
 from .tokens import account_activation_token
 
 CURRENT_SITE = 'localhost:8000'
@@ -21,13 +23,73 @@ class Game(models.Model):
     location = models.CharField(max_length=512, default="No location string given")
     latitude = models.FloatField(default=0.0)
     longitude = models.FloatField(default=0.0)
+    # Spatial index for "games near me" lookups. Derived from latitude/longitude on every save
+    geohash = models.CharField(max_length=GEOHASH_PRECISION, default='', db_index=True, editable=False)
     # Format is 2018-05-16 20:00:00
     game_time = models.DateTimeField(default='1970-01-01T00:00:00Z', validators=[])
-    creation_time = models.DateTimeField(auto_now=True)
+    # Set once on insert. Applications are queued for goalie_queue.WAIT_TIME minutes after this
+    creation_time = models.DateTimeField(auto_now_add=True)
     goalie_one = models.ForeignKey(User, related_name='goalieOne', null=True, on_delete=models.CASCADE)
     goalie_two = models.ForeignKey(User, related_name='goalieTwo', null=True, on_delete=models.CASCADE)
     two_goalies_needed = models.BooleanField(default=False)
+    # Goalies waiting for the queue to be resolved (see goalie_queue.py). Emptied when it is
     applied_goalies = models.ManyToManyField(User, related_name='goalieQueued')
+    # Whether the applicant queue has been resolved. After that, applying is first come, first served
+    queue_resolved = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination order for GameList
+            models.Index(fields=['game_time', 'id'], name='game_time_id_idx'),
+            # Upcoming games at one skill level: equality on skill_level, then a range scan on game_time
+            # that comes back already in pagination order
+            models.Index(fields=['skill_level', 'game_time', 'id'], name='game_skill_time_id_idx'),
+            # Games whose applicant queue is due to be resolved
+            models.Index(fields=['queue_resolved', 'creation_time'], name='game_queue_due_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.geohash = encode_geohash(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ('latitude' in update_fields or 'longitude' in update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
+    # Gives the goalie the first open slot with one conditional UPDATE per slot. The database only applies
+    # the UPDATE if the slot is still empty, so concurrent applies can never both win the same slot and
+    # nothing but the slot's column is written. A goalie already in the other slot can't take this one too.
+    # Returns 'goalie_one', 'goalie_two' or None if the game is full or the goalie is already playing in it.
+    # OpenGame is updated in the same transaction
+    @staticmethod
+    def claim_goalie_slot(game_id, goalie_id):
+        with transaction.atomic():
+            if Game.objects.filter(pk=game_id, goalie_one__isnull=True).exclude(goalie_two=goalie_id) \
+                    .update(goalie_one_id=goalie_id):
+                slot = 'goalie_one'
+            elif Game.objects.filter(pk=game_id, two_goalies_needed=True, goalie_two__isnull=True) \
+                    .exclude(goalie_one=goalie_id).update(goalie_two_id=goalie_id):
+                slot = 'goalie_two'
+            else:
+                return None
+            OpenGame.refresh([game_id])
+        return slot
+
+    # The reverse of claim_goalie_slot. Returns the slot the goalie was removed from, or None if they had neither
+    @staticmethod
+    def release_goalie_slot(game_id, goalie_id):
+        with transaction.atomic():
+            if Game.objects.filter(pk=game_id, goalie_one=goalie_id).update(goalie_one_id=None):
+                slot = 'goalie_one'
+            elif Game.objects.filter(pk=game_id, goalie_two=goalie_id).update(goalie_two_id=None):
+                slot = 'goalie_two'
+            else:
+                return None
+            OpenGame.refresh([game_id])
+        return slot
+
+    # How many goalies the game still needs
+    def open_slots(self):
+        return int(self.goalie_one_id is None) + int(self.two_goalies_needed and self.goalie_two_id is None)
 
     def __str__(self):
         return "Id: {}, game_time: {}, location:" \
@@ -39,6 +101,81 @@ class Game(models.Model):
                                                       self.skill_level,)
 
 
+# Game fields (by name and attname) that an OpenGame row is worked out from
+OPEN_GAME_FIELDS = frozenset(('game_time', 'skill_level', 'goalie_one', 'goalie_one_id', 'goalie_two', 'goalie_two_id',
+                              'two_goalies_needed'))
+
+# Games with an open slot
+NEEDS_GOALIE = Q(goalie_one__isnull=True) | Q(two_goalies_needed=True, goalie_two__isnull=True)
+
+
+# Every game that still needs a goalie, copied from Game so the goalie feed (GameList ?open=true) only reads
+# games that can actually be applied to, instead of filtering the whole Game table on its goalie columns.
+#
+# Rows are kept in step with Game by refresh(). Claiming or releasing a slot and goalie queue resolution call
+# it in the same transaction as their UPDATE, and Game.save() (so GameDetail updates too) calls it right
+# after saving. Bulk updates that skip those need to call it themselves. The open_games command checks the table against
+# Game and rebuilds it.
+class OpenGame(models.Model):
+    game = models.OneToOneField(Game, primary_key=True, related_name='open_slot', on_delete=models.CASCADE)
+    game_time = models.DateTimeField()
+    skill_level = models.IntegerField()
+    slots_open = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            # Same orderings as the Game indexes, for the feed's keyset pagination
+            models.Index(fields=['game_time', 'game'], name='open_game_time_idx'),
+            models.Index(fields=['skill_level', 'game_time', 'game'], name='open_game_skill_time_idx'),
+        ]
+
+    # Recomputes the rows for these games from Game
+    @staticmethod
+    def refresh(game_ids):
+        game_ids = list(game_ids)
+        with transaction.atomic():
+            # Locks the games (on databases that can), so two refreshes of the same game take turns
+            games = Game.objects.select_for_update().filter(pk__in=game_ids)\
+                .only('id', 'game_time', 'skill_level', 'goalie_one', 'goalie_two', 'two_goalies_needed')
+            rows = [OpenGame.from_game(game) for game in games if game.open_slots()]
+            OpenGame.objects.filter(game_id__in=game_ids).delete()
+            OpenGame.objects.bulk_create(rows)
+
+    # Compares the table with Game for the games starting at or after since. Returns the ids of open games
+    # without a row, and of rows that are wrong or whose game isn't open any more
+    @staticmethod
+    def find_inconsistencies(since):
+        expected = {game.id: OpenGame.from_game(game) for game in
+                    Game.objects.filter(NEEDS_GOALIE, game_time__gte=since)
+                    .only('id', 'game_time', 'skill_level', 'goalie_one', 'goalie_two', 'two_goalies_needed')
+                    .iterator()}
+        missing = set(expected)
+        wrong = set()
+        for row in OpenGame.objects.filter(game_time__gte=since).iterator():
+            missing.discard(row.game_id)
+            should_be = expected.get(row.game_id)
+            if should_be is None or (row.game_time, row.skill_level, row.slots_open) != \
+                    (should_be.game_time, should_be.skill_level, should_be.slots_open):
+                wrong.add(row.game_id)
+        return sorted(missing), sorted(wrong)
+
+    @staticmethod
+    def from_game(game):
+        return OpenGame(game_id=game.id, game_time=game.game_time, skill_level=game.skill_level,
+                        slots_open=game.open_slots())
+
+    # Saves limited to update_fields that OpenGame doesn't copy can't change the game's row, so they skip it
+    @staticmethod
+    @receiver(post_save, sender=Game)
+    def refresh_saved_game(sender, instance, created, update_fields=None, **kwargs):
+        if not created and update_fields is not None and not OPEN_GAME_FIELDS.intersection(update_fields):
+            return
+        OpenGame.refresh([instance.pk])
+
+    def __str__(self):
+        return 'Game {}: {} open'.format(self.game_id, self.slots_open)
+
+
 # Locations that goalies can choose. Game locations will be map coordinates
 class Location(models.Model):
     # Name of the location, if one was given
@@ -60,7 +197,82 @@ class Message(models.Model):
     game_user = models.ForeignKey(User, related_name='gameRenter', on_delete=models.CASCADE)
     goalie_user = models.ForeignKey(User, related_name='gameGoalie', on_delete=models.CASCADE)
     sender_is_goalie = models.BooleanField(default=False)
-    creation_time = models.DateTimeField(auto_now=True)
+    # Set once on insert so that, like the id, it gives a stable insertion order
+    creation_time = models.DateTimeField(auto_now_add=True)
+    # Whether the recipient has read the message
+    read = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination order for MessageList
+            models.Index(fields=['creation_time', 'id'], name='message_creation_time_id_idx'),
+            # A user's messages, from either side of the conversation, come straight off these
+            models.Index(fields=['game_user', 'creation_time'], name='message_game_user_time_idx'),
+            models.Index(fields=['goalie_user', 'creation_time'], name='message_goalie_user_time_idx'),
+            # Incremental sync: a user's messages after a given id
+            models.Index(fields=['game_user', 'id'], name='message_game_user_id_idx'),
+            models.Index(fields=['goalie_user', 'id'], name='message_goalie_user_id_idx'),
+        ]
+
+    # Messages the user sent or received. A single filter with an OR, which the database can answer
+    # from the two user indexes
+    @staticmethod
+    def for_user(user):
+        return Message.objects.filter(models.Q(game_user=user) | models.Q(goalie_user=user))
+
+    # Matches the messages sent to the user that they haven't read yet
+    @staticmethod
+    def unread_by(user):
+        return models.Q(read=False) & (models.Q(game_user=user, sender_is_goalie=True) |
+                                       models.Q(goalie_user=user, sender_is_goalie=False))
+
+
+# Email waiting to be sent by the send_outbox worker, so requests never wait on the mail server.
+# Rows are written in the same transaction as whatever caused the email, and a failed send is retried later
+class OutboxEmail(models.Model):
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    # Sent as an alternative to the plain text body if there is one
+    html_body = models.TextField(blank=True, default='')
+    from_email = models.CharField(max_length=254, blank=True, default='')
+    # One address per line
+    to = models.TextField()
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    # Pending emails aren't sent before this. A worker pushes it back while it is sending a batch
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # Set by the worker that claimed the email for its current batch
+    lease = models.CharField(max_length=32, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    creation_time = models.DateTimeField(auto_now_add=True)
+    sent_time = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Finds the emails that are due
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_due_idx'),
+        ]
+
+    # Queues an email for the send_outbox worker. Takes the same arguments as EmailMessage
+    @staticmethod
+    def enqueue(subject, body, to, from_email=None, html_body=''):
+        return OutboxEmail.objects.create(subject=subject,
+                                          body=body,
+                                          html_body=html_body or '',
+                                          from_email=from_email or '',
+                                          to='\n'.join(to))
+
+    def __str__(self):
+        return '{} to {}'.format(self.subject, ', '.join(self.to.split()))
 
 
 class Profile(models.Model):
@@ -79,30 +291,20 @@ class Profile(models.Model):
                                       default=5)  # 1 is the best
     user = models.ForeignKey(User, related_name='profileUser', on_delete=models.CASCADE, null=True)
 
+    # Builds the profile and token straight from the saved user instead of re-fetching it, so signup is
+    # exactly three INSERTs: user, token and profile
     @staticmethod
     @receiver(post_save, sender=User)
     def create_user_profile(sender, instance, created, **kwargs):
         if created:
-            # Create a profile entry with the same primary key as the user entry
-            Profile.objects.create(pk=instance.id)
-            profile = Profile.objects.get(pk=instance.id)
-            # TODO: Write a test case to ensure that the user saved in profile is correct
-            profile.user = User.objects.get(pk=instance.id)
-            profile.reset_token = account_activation_token.make_token(User.objects.get(pk=instance.id))
-            Token.objects.create(user=User.objects.get(pk=instance.id))
-            profile.access_token = str(Token.objects.get(user=User.objects.get(pk=instance.id)))
-            profile.save()
-
-    @staticmethod
-    @receiver(post_save, sender=User)
-    def hash_user_password(sender, instance, created, **kwargs):
-        if created:
-            user = User.objects.get(pk=instance.id)
-            # TODO: There is definitely a better way to check if the password was hashed
-            if user.password[:6] != 'pbkdf2':
-                user.set_password(user.password)
-                user.save()
+            token = Token.objects.create(user=instance)
+            # The profile shares its primary key with the user
+            Profile.objects.create(pk=instance.id,
+                                   user=instance,
+                                   reset_token=account_activation_token.make_token(instance),
+                                   access_token=token.key)
 
+    # Queues the email in the outbox, so signup doesn't wait on the mail server
     @staticmethod
     # @receiver(post_save, sender=User)
     def send_verification_email(sender, instance, created, **kwargs):
@@ -115,9 +317,7 @@ class Profile(models.Model):
                 'uid': urlsafe_base64_encode(force_bytes(user.pk)).decode(),
                 'token': Profile.objects.get(pk=user.id).reset_token,
             })
-            to_email = user.email
-            email = EmailMessage(subject, body, to=[to_email])
-            email.send()
+            OutboxEmail.enqueue(subject, body, [user.email])
 
     @staticmethod
     @receiver(post_delete, sender=User)
@@ -0,0 +1,96 @@
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+# Sends the emails queued with OutboxEmail.enqueue(). Run by the send_outbox management command.
+#
+# Each batch goes out over a single connection to the mail server (settings.EMAIL_BACKEND), so the TLS
+# handshake and login happen once per batch instead of once per email. An email that fails is retried
+# after OUTBOX_RETRY_DELAY seconds, doubling on each attempt up to OUTBOX_MAX_RETRY_DELAY, and is given up
+# on after OUTBOX_MAX_ATTEMPTS attempts.
+#
+# Several workers can run at once. Each claims its batch by writing a lease onto the rows, and pushes their
+# next attempt back by OUTBOX_LEASE seconds so that if it dies mid-batch another worker picks them up.
+
+
+def retry_delay(attempts):
+    delay = getattr(settings, 'OUTBOX_RETRY_DELAY', 30) * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, getattr(settings, 'OUTBOX_MAX_RETRY_DELAY', 3600)))
+
+
+def claim_batch(batch_size):
+    now = timezone.now()
+    due = (OutboxEmail.objects
+           .filter(status=OutboxEmail.PENDING, next_attempt_at__lte=now)
+           .order_by('next_attempt_at', 'id')
+           .values_list('id', flat=True)[:batch_size])
+    lease = uuid.uuid4().hex
+    # Only rows nobody else claimed since we looked get our lease
+    OutboxEmail.objects.filter(id__in=list(due), status=OutboxEmail.PENDING, next_attempt_at__lte=now)\
+        .update(lease=lease, next_attempt_at=now + timedelta(seconds=getattr(settings, 'OUTBOX_LEASE', 300)))
+    return list(OutboxEmail.objects.filter(lease=lease).order_by('id'))
+
+
+def build_message(email, connection):
+    message = EmailMultiAlternatives(email.subject,
+                                     email.body,
+                                     email.from_email or None,
+                                     email.to.split(),
+                                     connection=connection)
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def record_failure(email, error):
+    attempts = email.attempts + 1
+    if attempts >= getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8):
+        status = OutboxEmail.FAILED
+    else:
+        status = OutboxEmail.PENDING
+    OutboxEmail.objects.filter(pk=email.pk).update(status=status,
+                                                    attempts=F('attempts') + 1,
+                                                    next_attempt_at=timezone.now() + retry_delay(attempts),
+                                                    lease='',
+                                                    last_error=repr(error))
+
+
+# Sends one batch of due emails. Returns (sent, failed) for the batch
+def send_pending(batch_size=None):
+    batch = claim_batch(batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 50))
+    if not batch:
+        return 0, 0
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        for email in batch:
+            record_failure(email, error)
+        return 0, len(batch)
+
+    sent = []
+    failed = 0
+    try:
+        for email in batch:
+            try:
+                build_message(email, connection).send()
+            except Exception as error:
+                record_failure(email, error)
+                failed += 1
+            else:
+                sent.append(email.pk)
+    finally:
+        connection.close()
+        OutboxEmail.objects.filter(pk__in=sent).update(status=OutboxEmail.SENT,
+                                                       attempts=F('attempts') + 1,
+                                                       lease='',
+                                                       last_error='',
+                                                       sent_time=timezone.now())
+    return len(sent), failed
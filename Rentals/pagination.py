@@ -0,0 +1,208 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+# Parses a page size or offset. Raises ValueError unless it's a whole number, positive if strict. Capped at cutoff
+def parse_count(value, strict=False, cutoff=None):
+    count = int(value)
+    if count < 0 or (strict and count == 0):
+        raise ValueError('Expected a {} whole number'.format('positive' if strict else 'non-negative'))
+    return min(count, cutoff) if cutoff else count
+
+
+# Keyset (seek) pagination. Pages are found with "WHERE (ordering) > (last row seen) ORDER BY ordering LIMIT n"
+# rather than an OFFSET, so with an index on the ordering fields every page costs the same no matter how deep
+# the client has scrolled. The last field in the ordering must be unique so that every row has a distinct key.
+# Fields prefixed with '-' sort descending, and a field can be an annotation on the queryset, like an aggregate
+# over a values() grouping.
+#
+# Cursors are opaque to the client: the next and previous links in the response carry them.
+class KeysetPagination(BasePagination):
+    ordering = ('id',)
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    # Where the ordering fields are in each row, when paging through tuples from paginate_values()
+    position_columns = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.names = [name.lstrip('-') for name in self.ordering]
+        self.fields = [get_ordering_field(queryset, name) for name in self.names]
+
+        position, reverse = self.decode_cursor(request)
+        if reverse:
+            queryset = queryset.order_by(*[name[1:] if name.startswith('-') else '-' + name
+                                           for name in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_seek_filter(position, reverse))
+
+        # Fetch one extra row to find out if there is another page past this one
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.page = results
+        self.has_next = has_more if not reverse else position is not None
+        self.has_previous = position is not None if not reverse else has_more
+        return results
+
+    # Like paginate_queryset, but returns the page as tuples of these columns (attnames), for the fast list
+    # path. The ordering columns are added to the end of each tuple if they aren't among them
+    def paginate_values(self, queryset, columns, request, view=None):
+        columns = list(columns)
+        attnames = [queryset.model._meta.get_field(name.lstrip('-')).attname for name in self.ordering]
+        for attname in attnames:
+            if attname not in columns:
+                columns.append(attname)
+        self.position_columns = [columns.index(attname) for attname in attnames]
+        return self.paginate_queryset(queryset.values_list(*columns), request, view)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            return parse_count(request.query_params[self.page_size_query_param], strict=True,
+                               cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    # Rows come after the position when they are further along on the first differing ordering field:
+    # (a > x) OR (a = x AND b > y) OR ..., with < for the descending fields
+    def get_seek_filter(self, position, reverse):
+        seek = Q()
+        for index, name in enumerate(self.ordering):
+            comparison = '__lt' if name.startswith('-') != reverse else '__gt'
+            condition = Q(**{self.names[index] + comparison: position[index]})
+            for previous_name, previous_value in zip(self.names[:index], position[:index]):
+                condition &= Q(**{previous_name: previous_value})
+            seek |= condition
+        return seek
+
+    # From a model instance, a tuple from paginate_values() or a dict from values()
+    def get_position(self, item):
+        if self.position_columns is not None:
+            return [item[index] for index in self.position_columns]
+        if isinstance(item, dict):
+            return [item[name] for name in self.names]
+        return [field.value_from_object(item) for field in self.fields]
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+    def encode_cursor(self, position, reverse):
+        values = [field.value_to_string(_ValueHolder(field, value)) for field, value in zip(self.fields, position)]
+        payload = json.dumps({'p': values, 'r': int(reverse)}, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    # Returns the position a cursor points at and whether it pages backwards, or (None, False) if there isn't one
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii'))
+            values = payload['p']
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                raise ValueError
+            position = [field.to_python(value) for field, value in zip(self.fields, values)]
+            return position, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+# The model field, or for an annotation the field its values come out as, that cursors encode name's values with
+def get_ordering_field(queryset, name):
+    if name in queryset.query.annotations:
+        return queryset.query.annotations[name].output_field
+    return queryset.model._meta.get_field(name)
+
+
+# Lets Field.value_to_string() serialize a bare value the same way it would a model instance's attribute
+class _ValueHolder(object):
+    def __init__(self, field, value):
+        setattr(self, field.attname, value)
+
+
+class GamePagination(KeysetPagination):
+    ordering = ('game_time', 'id')
+
+
+# Pages through a list that's already sorted in memory, like the games near a point sorted by distance. The
+# next and previous links carry an offset into the list. Takes the page_size parameter like the keyset pages
+class ListPagination(KeysetPagination):
+    offset_query_param = 'offset'
+    invalid_offset_message = 'Invalid offset'
+
+    def paginate_queryset(self, items, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        try:
+            self.offset = parse_count(request.query_params.get(self.offset_query_param, 0))
+        except ValueError:
+            raise NotFound(self.invalid_offset_message)
+        self.count = len(items)
+        return items[self.offset:self.offset + self.page_size]
+
+    def get_next_link(self):
+        if self.offset + self.page_size >= self.count:
+            return None
+        return replace_query_param(self.base_url, self.offset_query_param, self.offset + self.page_size)
+
+    def get_previous_link(self):
+        if self.offset == 0:
+            return None
+        if self.offset <= self.page_size:
+            return remove_query_param(self.base_url, self.offset_query_param)
+        return replace_query_param(self.base_url, self.offset_query_param, self.offset - self.page_size)
+
+
+class NearbyGamePagination(ListPagination):
+    page_size = GamePagination.page_size
+
+
+class OpenGamePagination(KeysetPagination):
+    ordering = ('game_time', 'game')
+
+
+class MessagePagination(KeysetPagination):
+    ordering = ('creation_time', 'id')
+
+
+# Conversations, most recently active first. latest_id is the id of a conversation's latest message
+class InboxPagination(KeysetPagination):
+    ordering = ('-latest_id',)
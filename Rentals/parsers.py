@@ -0,0 +1,22 @@
+import codecs
+import csv
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+# Parses a CSV body with a header row into a list of dicts, one per row, keyed by the header. Empty cells are
+# left out, so the field gets its default on create and keeps its current value on update
+class CSVParser(BaseParser):
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            reader = csv.DictReader(codecs.getreader(encoding)(stream))
+            return [{column: value for column, value in row.items() if column and value not in ('', None)}
+                    for row in reader]
+        except (csv.Error, UnicodeDecodeError) as error:
+            raise ParseError('CSV parse error - {}'.format(error))
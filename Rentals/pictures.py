@@ -0,0 +1,149 @@
+import hashlib
+import io
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+# Profile pictures. Uploads are decoded with Pillow, turned upright from their EXIF orientation, shrunk to
+# PICTURE_MAX_SIDE and re-encoded as PICTURE_FORMAT without any metadata (EXIF can hold the GPS position the
+# photo was taken at). The result is stored under the hash of its content:
+#     pictures/<sha1>.webp
+# so the same photo is only stored once, and its URL never changes meaning.
+#
+# Smaller variants (PICTURE_VARIANTS, name: longest side in pixels) are made the first time they're asked
+# for, by the PictureVariant view, and kept on disk next to it:
+#     pictures/<variant>/<sha1>.webp
+# List views only hand out their URLs, so nothing is resized until a client actually shows the picture.
+#
+# Decoding and resizing run on a bounded worker pool like password hashing does (see hashers.py), chosen with
+# PICTURE_POOL ('thread', 'process' or None) and PICTURE_WORKERS. Pillow releases the GIL while it resamples
+# and encodes, so threads are enough unless the server is short of cores.
+
+PICTURE_DIRECTORY = 'pictures'
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+CONTENT_TYPES = {'webp': 'image/webp', 'jpg': 'image/jpeg'}
+# Name pattern of pictures that went through store_picture, for urls.py
+HASHED_NAME_PATTERN = r'[0-9a-f]{40}\.(?:webp|jpg)'
+
+# EXIF orientation tag, and the transposes that undo each orientation
+ORIENTATION = 0x0112
+ORIENTATION_TRANSPOSES = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.FLIP_LEFT_RIGHT, Image.ROTATE_90),
+    6: (Image.ROTATE_270,),
+    7: (Image.FLIP_LEFT_RIGHT, Image.ROTATE_270),
+    8: (Image.ROTATE_90,),
+}
+
+_executor = None
+_executor_config = None
+_executor_lock = threading.Lock()
+
+
+def get_picture_executor():
+    global _executor, _executor_config
+    kind = getattr(settings, 'PICTURE_POOL', None)
+    if not kind:
+        return None
+    config = (kind, getattr(settings, 'PICTURE_WORKERS', 2))
+    with _executor_lock:
+        if _executor_config != config:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            if kind == 'process':
+                _executor = ProcessPoolExecutor(max_workers=config[1])
+            elif kind == 'thread':
+                _executor = ThreadPoolExecutor(max_workers=config[1], thread_name_prefix='pictures')
+            else:
+                raise ValueError("PICTURE_POOL must be 'thread', 'process' or None, not {!r}".format(kind))
+            _executor_config = config
+        return _executor
+
+
+def _run(function, *args):
+    executor = get_picture_executor()
+    if executor is None:
+        return function(*args)
+    return executor.submit(function, *args).result()
+
+
+def get_format():
+    return getattr(settings, 'PICTURE_FORMAT', 'WEBP').upper()
+
+
+def get_variants():
+    return getattr(settings, 'PICTURE_VARIANTS', {})
+
+
+# Re-encodes the upload and stores it. Returns the name to give Profile.picture. Raises ValueError if the
+# upload isn't an image Pillow can read, or is too big
+def store_picture(upload):
+    upload.seek(0)
+    data = _run(_encode, upload.read(), getattr(settings, 'PICTURE_MAX_SIDE', 2048), get_format(),
+                getattr(settings, 'PICTURE_QUALITY', 80), getattr(settings, 'PICTURE_MAX_PIXELS', 40000000))
+    name = '{}/{}.{}'.format(PICTURE_DIRECTORY, hashlib.sha1(data).hexdigest(), EXTENSIONS[get_format()])
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data))
+    return name
+
+
+def is_stored_picture(name):
+    return bool(name) and name.startswith(PICTURE_DIRECTORY + '/') and name.count('/') == 1
+
+
+def variant_name(picture_name, variant):
+    stem = picture_name.rsplit('/', 1)[-1].rsplit('.', 1)[0]
+    return '{}/{}/{}.{}'.format(PICTURE_DIRECTORY, variant, stem, EXTENSIONS[get_format()])
+
+
+# The stored name of the variant, making it from the picture first if it isn't on disk yet
+def get_variant(picture_name, variant):
+    name = variant_name(picture_name, variant)
+    if default_storage.exists(name):
+        return name
+    with default_storage.open(picture_name) as picture:
+        source = picture.read()
+    data = _run(_encode, source, get_variants()[variant], get_format(), getattr(settings, 'PICTURE_QUALITY', 80),
+                getattr(settings, 'PICTURE_MAX_PIXELS', 40000000))
+    # Another request may have made it meanwhile. Either copy is the same picture
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data))
+    return name
+
+
+# Runs in the pool, so it only takes and returns plain values
+def _encode(data, max_side, image_format, quality, max_pixels):
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.size[0] * image.size[1] > max_pixels:
+            raise ValueError('Picture is larger than {} pixels'.format(max_pixels))
+        orientation = _orientation(image)
+        image.load()
+    except (OSError, SyntaxError) as error:
+        raise ValueError('Not a picture: {}'.format(error))
+
+    for transpose in ORIENTATION_TRANSPOSES.get(orientation, ()):
+        image = image.transpose(transpose)
+    if image.mode not in ('RGB', 'RGBA') or (image_format == 'JPEG' and image.mode != 'RGB'):
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha and image_format != 'JPEG' else 'RGB')
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    # A new image carries no EXIF, ICC or comment metadata unless it's passed to save()
+    output = io.BytesIO()
+    image.save(output, image_format, quality=quality)
+    return output.getvalue()
+
+
+def _orientation(image):
+    if hasattr(image, 'getexif'):
+        return image.getexif().get(ORIENTATION, 1)
+    # Pillow before 6.0
+    exif = image._getexif() if hasattr(image, '_getexif') else None
+    return (exif or {}).get(ORIENTATION, 1)
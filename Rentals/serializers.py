@@ -1,41 +1,200 @@
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from django.contrib.auth.models import User
-from .models import Game, Location, Message, Profile
+from django.db import connection, transaction
+from .bulk import bulk_update_by_pk, chunks, BULK_UPDATE_BATCH_SIZE, OPEN_GAME_REFRESH_BATCH_SIZE
+from .fieldsets import FIRST, ONE, SparseFieldsMixin
+from .geo import encode_geohash
+from .models import Game, Location, Message, OpenGame, Profile
+from .pictures import get_variants, is_stored_picture, store_picture
 
 
-class GameSerializer(serializers.ModelSerializer):
+class GameSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {
+        'user': ('PublicUserSerializer', 'user', ONE),
+        'goalie_one': ('PublicUserSerializer', 'goalie_one', ONE),
+        'goalie_two': ('PublicUserSerializer', 'goalie_two', ONE),
+    }
+
     class Meta:
         model = Game
         fields = ('id', 'user', 'skill_level', 'location',
                   'game_time', 'creation_time', 'goalie_one',
                   'goalie_two', 'two_goalies_needed')
 
+    # Writes only the fields that were sent, so a PATCH doesn't overwrite columns it didn't change, and OpenGame
+    # is only refreshed when a field it copies was among them
+    def update(self, instance, validated_data):
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
+
+
+# Creates all the games with bulk INSERTs in one transaction instead of saving them one at a time. Game.save()
+# and its post_save receiver don't run, so the geohash and the OpenGame rows are filled in here
+class BulkGameListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        games = [Game(**attrs) for attrs in validated_data]
+        with transaction.atomic():
+            if connection.vendor != 'sqlite' and not connection.features.can_return_ids_from_bulk_insert:
+                # No ids back from a bulk INSERT, and no database-wide write lock to work them out from below.
+                # One INSERT per game, with Game.save() filling in the geohash and OpenGame
+                for game in games:
+                    game.save()
+                return games
+
+            for game in games:
+                game.geohash = encode_geohash(game.latitude, game.longitude)
+            Game.objects.bulk_create(games)
+            if connection.vendor == 'sqlite' and games and games[0].pk is None:
+                # SQLite can't return ids from a bulk INSERT. This transaction has held the database's write lock
+                # since the first INSERT, so the newest ids are the ones just inserted, in order
+                new_ids = reversed(Game.objects.order_by('-pk').values_list('pk', flat=True)[:len(games)])
+                for game, pk in zip(games, new_ids):
+                    game.pk = pk
+            for batch in chunks((game.pk for game in games if game.open_slots()), OPEN_GAME_REFRESH_BATCH_SIZE):
+                OpenGame.refresh(batch)
+        return games
+
+
+# For GameBulk POST. Every game needs a user, and it has to be the user making the request unless they're an admin
+class BulkGameSerializer(GameSerializer):
+    class Meta(GameSerializer.Meta):
+        list_serializer_class = BulkGameListSerializer
+        extra_kwargs = {'user': {'required': True, 'allow_null': False}}
+
+    def validate_user(self, user):
+        request = self.context['request']
+        if not request.user.is_superuser and user.id != request.user.id:
+            raise serializers.ValidationError('Game user must be same as user requesting create')
+        return user
+
+
+# Applies each row's changes to the game with its id, in batched UPDATEs in one transaction. The instance is
+# the queryset of games the rows may change
+class GameRescheduleListSerializer(serializers.ListSerializer):
+    def update(self, queryset, validated_data):
+        rows = {attrs['id']: {name: value for name, value in attrs.items() if name != 'id'}
+                for attrs in validated_data}
+        changed = {pk: changes for pk, changes in rows.items() if changes}
+        with transaction.atomic():
+            for batch in chunks(changed.items(), BULK_UPDATE_BATCH_SIZE):
+                bulk_update_by_pk(queryset, dict(batch))
+            for batch in chunks(changed, OPEN_GAME_REFRESH_BATCH_SIZE):
+                OpenGame.refresh(batch)
+        games = queryset.in_bulk(list(rows))
+        return [games[pk] for pk in rows]
+
+
+# For GameBulk PATCH. Goalies come and go through apply and unapply, so only the schedule can change here
+class GameRescheduleSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField()
+
+    class Meta:
+        model = Game
+        fields = ('id', 'skill_level', 'location', 'game_time', 'two_goalies_needed')
+        extra_kwargs = {name: {'required': False} for name in fields if name != 'id'}
+        list_serializer_class = GameRescheduleListSerializer
+
 
-class LocationSerializer(serializers.ModelSerializer):
+class LocationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Location
         fields = ('id', 'name', 'latitude', 'longitude')
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {
+        'game': ('GameSerializer', 'game', ONE),
+        'game_user': ('PublicUserSerializer', 'game_user', ONE),
+        'goalie_user': ('PublicUserSerializer', 'goalie_user', ONE),
+    }
+
     class Meta:
         model = Message
         fields = ('id', 'game', 'body', 'game_user', 'goalie_user', 'creation_time', 'sender_is_goalie')
 
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {
+        'user': ('PublicUserSerializer', 'user', ONE),
+        'location': ('LocationSerializer', 'location', ONE),
+    }
+
     id = serializers.IntegerField(source='pk', read_only=True)
     user = serializers.ReadOnlyField(source='user.id')
+    # URLs of the resized pictures, e.g. {"thumb": ..., "small": ...}. Null for no picture, or for one uploaded
+    # before pictures were re-encoded (see pictures.py)
+    picture_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Profile
         fields = ('id', 'user', 'games_played', 'is_goalie',
-                  'locations', 'picture', 'rating', 'reset_token',
+                  'location', 'picture', 'picture_variants', 'rating', 'reset_token',
                   'access_token', 'skill_level')
 
+    def get_picture_variants(self, profile):
+        if not is_stored_picture(profile.picture.name):
+            return None
+        name = profile.picture.name.split('/', 1)[1]
+        return {variant: reverse('picture-variant', args=[variant, name], request=self.context.get('request'))
+                for variant in sorted(get_variants())}
+
+    def create(self, validated_data):
+        return super().create(self.__store_picture(validated_data))
+
+    def update(self, instance, validated_data):
+        return super().update(instance, self.__store_picture(validated_data))
+
+    # Swaps the upload for the name of its re-encoded copy
+    @staticmethod
+    def __store_picture(validated_data):
+        if validated_data.get('picture') is not None:
+            try:
+                validated_data['picture'] = store_picture(validated_data['picture'])
+            except ValueError as error:
+                raise serializers.ValidationError({'picture': [str(error)]})
+        return validated_data
+
+
+# A profile as other users see it, for expanding. Leaves out the tokens
+class PublicProfileSerializer(ProfileSerializer):
+    class Meta(ProfileSerializer.Meta):
+        fields = ('id', 'user', 'games_played', 'is_goalie', 'location', 'picture', 'picture_variants', 'rating',
+                  'skill_level')
+
+
+# A user as other users see it, for expanding. No email, password or permissions
+class PublicUserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {
+        'profile': ('PublicProfileSerializer', 'profileUser', FIRST),
+    }
+
+    class Meta:
+        model = User
+        fields = ('id', 'username', 'first_name', 'last_name')
+
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'email', 'password', 'first_name',
                   'last_name', 'is_staff', 'is_active')
+
+    # Signup happens in one transaction: the user INSERT plus the token and profile INSERTs from the post_save
+    # receiver. A failure part way through can't leave a user behind without a profile. The password is hashed
+    # first, outside the transaction
+    def create(self, validated_data):
+        password = validated_data.pop('password')
+        user = User(**validated_data)
+        user.set_password(password)
+        with transaction.atomic():
+            user.save()
+        return user
+
+    # The password sent is always taken as plain text and hashed, whatever it looks like
+    def update(self, instance, validated_data):
+        if 'password' in validated_data:
+            instance.set_password(validated_data.pop('password'))
+        return super().update(instance, validated_data)
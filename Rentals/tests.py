@@ -1,14 +1,53 @@
-from django.contrib.auth.models import User
-
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password, PBKDF2PasswordHasher
+from django.contrib.auth.models import update_last_login, User
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command, CommandError
+from django.utils import timezone
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
 import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from types import SimpleNamespace
+
+import geopy.distance
+import numpy as np
+from PIL import Image
 
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.reverse import reverse
+from django.db import connection, OperationalError
+from django.test import override_settings, SimpleTestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
 
-from Rentals.models import Game, Location, Message, Profile
+from Rentals import export, goalie_queue
+from Rentals.admin import EstimatedCountPaginator
+from Rentals.authentication import local_token_cache, LRUCache
+from Rentals.bulk import chunks, BULK_UPDATE_BATCH_SIZE
+from Rentals.caching import get_cache_stats, get_response_cache, reset_cache_stats
+from Rentals.db import configure_sqlite
+from Rentals.distance import batch_distance_km, HAVERSINE, VINCENTY
+from Rentals.events import LocalBroker, GOALIE_ASSIGNED, NEW_MESSAGE
+from Rentals.fastlist import get_columns, FAST_LIST_CHUNK_SIZE
+from Rentals.geo import geohash_radius_filter
+from Rentals.hashers import PooledPBKDF2PasswordHasher
+from Rentals.matching import candidate_index
+from Rentals.metrics import get_metrics, reset_metrics
+from Rentals.models import Game, Location, Message, OpenGame, OutboxEmail, Profile
+from Rentals.outbox import send_pending
+from Rentals.serializers import GameSerializer, LocationSerializer, MessageSerializer
 from Rentals.views import GameList, GameDetail, LocationList, LocationDetail, MessageList, MessageDetail,\
-    UserList, UserDetail, ProfileList, ProfileDetail
+    UserList, UserDetail, ProfileList, ProfileDetail, ApplyForGame, RemoveGoalieFromGame, Inbox, MarkMessagesRead,\
+    Events, GameCandidates, CacheStats, GameBulk, PictureVariant
 
 # TODO: Write tests for create, patch, and delete
 
@@ -16,8 +55,6 @@ from Rentals.views import GameList, GameDetail, LocationList, LocationDetail, Me
 
 # TODO: Write test to check account activation via email
 
-# TODO: Write ApplyForGame tests
-
 factory = APIRequestFactory()
 
 
@@ -60,6 +97,131 @@ class GameCreate(APITestCase):
         self.assertEqual(response.data['two_goalies_needed'], data['two_goalies_needed'])
 
 
+class GameBulkWrite(APITestCase):
+    def setUp(self):
+        Location.objects.create(name='Kitchener', latitude=43.4516395, longitude=-80.49253369999997)
+        self.renter = User.objects.create_user('renter', 'renter@example.com', 'renterpassword')
+        self.other = User.objects.create_user('other', 'other@example.com', 'otherpassword')
+        self.url = reverse('game-bulk')
+
+    def send(self, method, body, content_type='application/json', user=None):
+        request = getattr(factory, method)(self.url, body, content_type=content_type)
+        force_authenticate(request, user=user or self.renter)
+        return GameBulk.as_view()(request)
+
+    def test_create_json(self):
+        games = [{'user': self.renter.id, 'skill_level': level, 'location': 'Rink {}'.format(level),
+                  'game_time': '2030-01-0{}T20:00:00Z'.format(level), 'two_goalies_needed': level == 1}
+                 for level in range(1, 6)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.send('post', json.dumps(games))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([game['location'] for game in response.data], ['Rink {}'.format(i) for i in range(1, 6)])
+        self.assertEqual(sorted(game['id'] for game in response.data),
+                         sorted(Game.objects.values_list('id', flat=True)))
+        self.assertEqual(OpenGame.objects.get(game=response.data[0]['id']).slots_open, 2)
+        self.assertEqual(OpenGame.objects.count(), 5)
+        # One INSERT for all the games, not one per game
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT INTO "Rentals_game"')]),
+                         1)
+
+    def test_create_csv(self):
+        body = ('user,skill_level,location,game_time,two_goalies_needed\n'
+                '{0},2,Waterloo,2030-02-01T20:00:00Z,true\n'
+                '{0},3,,2030-02-02T20:00:00Z,\n').format(self.renter.id)
+        response = self.send('post', body, content_type='text/csv')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([(game['location'], game['two_goalies_needed']) for game in response.data],
+                         [('Waterloo', True), ('No location string given', False)])
+
+    def test_errors_per_row(self):
+        games = [{'user': self.renter.id, 'game_time': '2030-01-01T20:00:00Z'},
+                 {'user': self.renter.id, 'skill_level': 9},
+                 {'user': self.other.id},
+                 {'skill_level': 2}]
+        response = self.send('post', json.dumps(games))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([(error['row'], list(error['errors'])) for error in response.data['errors']],
+                         [(1, ['skill_level']), (2, ['user']), (3, ['user'])])
+        self.assertEqual(Game.objects.count(), 0)
+
+    def test_reschedule(self):
+        mine = [Game.objects.create(user=self.renter, skill_level=3, game_time='2030-01-01T20:00:00Z',
+                                    queue_resolved=True) for _ in range(3)]
+        theirs = Game.objects.create(user=self.other, queue_resolved=True)
+        changes = [{'id': mine[0].id, 'game_time': '2030-03-01T21:00:00Z'},
+                   {'id': mine[1].id, 'skill_level': 1, 'location': 'Guelph'}]
+
+        refused = self.send('patch', json.dumps(changes + [{'id': theirs.id, 'skill_level': 1}]))
+        self.assertEqual(refused.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error['row'] for error in refused.data['errors']], [2])
+
+        response = self.send('patch', json.dumps(changes))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([game['id'] for game in response.data], [mine[0].id, mine[1].id])
+        self.assertEqual(OpenGame.objects.get(game=mine[0]).game_time.isoformat(), '2030-03-01T21:00:00+00:00')
+        mine[1].refresh_from_db()
+        self.assertEqual((mine[1].skill_level, mine[1].location, mine[1].game_time.isoformat()),
+                         (1, 'Guelph', '2030-01-01T20:00:00+00:00'))
+        self.assertEqual(OpenGame.objects.get(game=mine[1]).skill_level, 1)
+        theirs.refresh_from_db()
+        self.assertEqual(theirs.skill_level, 5)
+
+
+class GameFieldsets(APITestCase):
+    def setUp(self):
+        Location.objects.create(name='Kitchener', latitude=43.4516395, longitude=-80.49253369999997)
+        self.renter = User.objects.create_user('renter', 'renter@example.com', 'renterpassword')
+        self.goalies = [User.objects.create_user('goalie_{}'.format(i), 'goalie{}@example.com'.format(i),
+                                                 'goaliepassword') for i in range(2)]
+        Profile.objects.filter(pk=self.goalies[1].id).update(skill_level=2)
+
+    def add_games(self, count):
+        for _ in range(count):
+            Game.objects.create(user=self.renter, game_time=timezone.now() + timedelta(days=1),
+                                goalie_one=self.goalies[0], goalie_two=self.goalies[1], two_goalies_needed=True)
+
+    def list_games(self, query):
+        request = factory.get(reverse('game-list') + query)
+        force_authenticate(request, user=self.renter)
+        response = GameList.as_view()(request)
+        response.render()
+        return response
+
+    def test_sparse_fields(self):
+        self.add_games(1)
+        response = self.list_games('?fields=id,game_time')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data['results'][0]), ['id', 'game_time'])
+
+    def test_expand_in_fixed_queries(self):
+        query = '?expand=user,goalie_one,goalie_two.profile&fields=id,goalie_one.username,goalie_two'
+        self.add_games(2)
+        with CaptureQueriesContext(connection) as few:
+            self.list_games(query)
+        self.add_games(8)
+        with CaptureQueriesContext(connection) as many:
+            response = self.list_games(query)
+
+        self.assertEqual(len(few), len(many))
+        game = response.data['results'][0]
+        self.assertEqual(list(game), ['id', 'goalie_one', 'goalie_two'])
+        self.assertEqual(game['goalie_one'], {'username': 'goalie_0'})
+        self.assertEqual(game['goalie_two']['username'], 'goalie_1')
+        self.assertEqual(game['goalie_two']['profile']['skill_level'], 2)
+        # Only the public fields of other users
+        self.assertNotIn('email', game['goalie_two'])
+        self.assertNotIn('access_token', game['goalie_two']['profile'])
+
+    def test_unknown_field(self):
+        response = self.list_games('?expand=goalie_three')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'expand': ['Unknown field goalie_three']})
+
+
 class GameDelete(APITestCase):
     def setUp(self):
         self.test_user_1 = User.objects.create_user('tester_one', 'test1@fakefalse.com', 'test1password')
@@ -130,7 +292,721 @@ class GameUpdate(APITestCase):
         self.assertEqual(response.data['skill_level'], data['skill_level'])
         self.assertEqual(response.data['location'], 1)
 
-# TODO: Game GET
+
+class GameNearby(APITestCase):
+    def setUp(self):
+        self.test_user = User.objects.create_user('tester_one', 'test1@fakefalse.com', 'test1password')
+        self.get_url = reverse('game-list')
+        game_time = timezone.now() + timedelta(days=7)
+
+        self.toronto = Game.objects.create(user=self.test_user, latitude=43.6532, longitude=-79.3832,
+                                           game_time=game_time)
+        self.waterloo = Game.objects.create(user=self.test_user, latitude=43.4643, longitude=-80.5204,
+                                            game_time=game_time)
+        self.kitchener = Game.objects.create(user=self.test_user, latitude=43.4516, longitude=-80.4925,
+                                             game_time=game_time)
+        self.vancouver = Game.objects.create(user=self.test_user, latitude=49.2827, longitude=-123.1207,
+                                             game_time=game_time)
+
+    def get_nearby(self, **params):
+        view = GameList.as_view()
+        request = factory.get(self.get_url, params)
+        force_authenticate(request, user=self.test_user)
+        return view(request)
+
+    def test_geohash_kept_up_to_date(self):
+        self.assertEqual(self.kitchener.geohash, 'dpwz0q55u')
+        self.kitchener.latitude = 49.2827
+        self.kitchener.longitude = -123.1207
+        self.kitchener.save()
+        self.assertEqual(Game.objects.get(pk=self.kitchener.id).geohash, self.vancouver.geohash)
+
+    def test_nearby_sorted_by_distance(self):
+        response = self.get_nearby(lat=43.4516, lon=-80.4925, radius_km=10)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([game['id'] for game in response.data['results']], [self.kitchener.id, self.waterloo.id])
+
+    def test_nearby_large_radius(self):
+        response = self.get_nearby(lat=43.4516, lon=-80.4925, radius_km=150)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([game['id'] for game in response.data['results']],
+                         [self.kitchener.id, self.waterloo.id, self.toronto.id])
+
+    def test_nearby_paginated(self):
+        response = self.get_nearby(lat=43.4516, lon=-80.4925, radius_km=150, page_size=2)
+        self.assertEqual([game['id'] for game in response.data['results']], [self.kitchener.id, self.waterloo.id])
+        self.assertIsNone(response.data['previous'])
+
+        view = GameList.as_view()
+        request = factory.get(response.data['next'])
+        force_authenticate(request, user=self.test_user)
+        response = view(request)
+        self.assertEqual([game['id'] for game in response.data['results']], [self.toronto.id])
+        self.assertIsNone(response.data['next'])
+        self.assertNotIn('offset', response.data['previous'])
+
+    def test_nearby_radius_too_large(self):
+        response = self.get_nearby(lat=43.4516, lon=-80.4925, radius_km=20000)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_nearby_close_to_the_pole(self):
+        polar = Game.objects.create(user=self.test_user, latitude=89.5, longitude=100.0,
+                                    game_time=self.toronto.game_time)
+        self.assertTrue(geohash_radius_filter(89.9, -80.0, 400).children)
+
+        response = self.get_nearby(lat=89.9, lon=-80.0, radius_km=400)
+
+        self.assertEqual([game['id'] for game in response.data['results']], [polar.id])
+
+    def test_nearby_missing_radius(self):
+        response = self.get_nearby(lat=43.4516, lon=-80.4925)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class GameWindow(APITestCase):
+    def setUp(self):
+        self.test_user = User.objects.create_user('tester_one', 'test1@fakefalse.com', 'test1password')
+        self.get_url = reverse('game-list')
+        now = timezone.now()
+        self.old_game = Game.objects.create(user=self.test_user, game_time=now - timedelta(days=3))
+        self.next_week = Game.objects.create(user=self.test_user, game_time=now + timedelta(days=7), skill_level=2)
+        self.next_month = Game.objects.create(user=self.test_user, game_time=now + timedelta(days=30), skill_level=4)
+
+    def get_ids(self, **params):
+        view = GameList.as_view()
+        request = factory.get(self.get_url, params)
+        force_authenticate(request, user=self.test_user)
+        response = view(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [game['id'] for game in response.data['results']]
+
+    def test_default_window_skips_old_games(self):
+        self.assertEqual(self.get_ids(), [self.next_week.id, self.next_month.id])
+
+    def test_from_and_to(self):
+        start = (timezone.now() - timedelta(days=5)).isoformat()
+        end = (timezone.now() + timedelta(days=10)).isoformat()
+
+        self.assertEqual(self.get_ids(**{'from': start, 'to': end}), [self.old_game.id, self.next_week.id])
+
+    def test_skill_level(self):
+        self.assertEqual(self.get_ids(skill_level=4), [self.next_month.id])
+
+    def test_bad_from(self):
+        view = GameList.as_view()
+        request = factory.get(self.get_url, {'from': 'next tuesday'})
+        force_authenticate(request, user=self.test_user)
+        response = view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class GamePaginate(APITestCase):
+    def setUp(self):
+        self.test_user = User.objects.create_user('tester_one', 'test1@fakefalse.com', 'test1password')
+        self.get_url = reverse('game-list')
+        game_time = timezone.now() + timedelta(days=7)
+        # Several games share a game_time so the cursor has to fall back to the id to keep its place
+        self.games = [Game.objects.create(user=self.test_user, game_time=game_time + timedelta(hours=i // 2))
+                      for i in range(7)]
+
+    def get_page(self, url, **params):
+        view = GameList.as_view()
+        request = factory.get(url, params)
+        force_authenticate(request, user=self.test_user)
+        return view(request)
+
+    def test_walk_forward_and_back(self):
+        response = self.get_page(self.get_url, page_size=3)
+        seen = [game['id'] for game in response.data['results']]
+        self.assertIsNone(response.data['previous'])
+        while response.data['next']:
+            response = self.get_page(response.data['next'])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [game['id'] for game in response.data['results']]
+
+        self.assertEqual(seen, [game.id for game in self.games])
+
+        response = self.get_page(response.data['previous'])
+        self.assertEqual([game['id'] for game in response.data['results']], seen[3:6])
+
+    def test_page_size_is_capped(self):
+        response = self.get_page(self.get_url, page_size=100000)
+
+        self.assertEqual(len(response.data['results']), 7)
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursor(self):
+        response = self.get_page(self.get_url, cursor='not-a-cursor')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class FastListResponses(APITestCase):
+    def setUp(self):
+        self.location = Location.objects.create(name='Kitchener \u2028 Waterloo', latitude=43.45, longitude=-80.49)
+        self.renter = User.objects.create_user('renter', 'renter@example.com', 'renterpassword')
+        self.goalie = User.objects.create_user('goalie', 'goalie@example.com', 'goaliepassword')
+        game_time = timezone.now().replace(microsecond=123456) + timedelta(days=2)
+        # Null goalies on every other game, and pairs of games at the same time so the cursors need the id
+        self.games = [Game.objects.create(user=self.renter, game_time=game_time + timedelta(hours=i // 2),
+                                          location='Rink \u00e9 {}'.format(i),
+                                          goalie_one=self.goalie if i % 2 else None)
+                      for i in range(5)]
+        for game in self.games:
+            Message.objects.create(game=game, body='Hi \U0001f3d2 \u2029', game_user=self.renter,
+                                   goalie_user=self.goalie)
+
+    def render(self, view, url, params=None):
+        request = factory.get(url, params)
+        force_authenticate(request, user=self.renter)
+        # Locations are served from the response cache after the first request
+        get_response_cache().clear()
+        response = view.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content if response.get('X-Cache') else response.render().content
+
+    # Compares every page, following the next links. Returns how many there were
+    def assert_same_bytes(self, view, url, params=None):
+        pages = 0
+        while url:
+            fast = self.render(view, url, params)
+            with override_settings(FAST_LIST_RESPONSES=False):
+                self.assertEqual(fast, self.render(view, url, params))
+            pages += 1
+            url, params = json.loads(fast.decode('utf-8')).get('next'), None
+        return pages
+
+    def test_serializers_qualify(self):
+        for serializer_class in (GameSerializer, MessageSerializer, LocationSerializer):
+            self.assertIsNotNone(get_columns(serializer_class))
+
+    def test_games(self):
+        self.assertEqual(self.assert_same_bytes(GameList, reverse('game-list'), {'page_size': 2}), 3)
+
+    def test_messages(self):
+        self.assertEqual(self.assert_same_bytes(MessageList, reverse('message-list'), {'page_size': 2}), 3)
+
+    def test_locations(self):
+        self.assertEqual(self.assert_same_bytes(LocationList, reverse('location-list')), 1)
+
+    @override_settings(FAST_LIST_STREAMING=True)
+    def test_streamed_bytes_match(self):
+        request = factory.get(reverse('game-list'))
+        force_authenticate(request, user=self.renter)
+        response = GameList.as_view()(request)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+        self.assertEqual(self.assert_same_bytes(GameList, reverse('game-list'), {'page_size': 2}), 3)
+        self.assertEqual(self.assert_same_bytes(MessageList, reverse('message-list'), {'page_size': 4}), 2)
+        self.assertEqual(self.assert_same_bytes(LocationList, reverse('location-list')), 1)
+
+    @override_settings(FAST_LIST_STREAMING=True)
+    def test_streamed_in_chunks(self):
+        game_time = timezone.now() + timedelta(days=3)
+        Game.objects.bulk_create([Game(user=self.renter, game_time=game_time, location='Rink {}'.format(i))
+                                  for i in range(FAST_LIST_CHUNK_SIZE + 10)])
+        request = factory.get(reverse('game-list'), {'page_size': 500})
+        force_authenticate(request, user=self.renter)
+        parts = list(GameList.as_view()(request).streaming_content)
+
+        # Opening the envelope, the rows a chunk at a time, and closing it
+        self.assertEqual(len(parts), 2 + len(chunks(range(Game.objects.count()), FAST_LIST_CHUNK_SIZE)))
+        with override_settings(FAST_LIST_RESPONSES=False):
+            self.assertEqual(b''.join(parts), self.render(GameList, reverse('game-list'), {'page_size': 500}))
+
+    def test_sparse_fields_use_the_serializer(self):
+        fast = json.loads(self.render(GameList, reverse('game-list'), {'fields': 'id,location'}).decode('utf-8'))
+        self.assertEqual(list(fast['results'][0]), ['id', 'location'])
+
+
+class ApplyForGameTest(APITestCase):
+    def setUp(self):
+        self.renter = User.objects.create_user('renter', 'renter@fakefalse.com', 'renterpassword')
+        self.goalie_1 = User.objects.create_user('goalie_one', 'goalie1@fakefalse.com', 'goalie1password')
+        self.goalie_2 = User.objects.create_user('goalie_two', 'goalie2@fakefalse.com', 'goalie2password')
+        self.goalie_3 = User.objects.create_user('goalie_three', 'goalie3@fakefalse.com', 'goalie3password')
+        # Past the applicant queue, so first come, first served
+        self.game = Game.objects.create(user=self.renter, two_goalies_needed=True, queue_resolved=True,
+                                        game_time=timezone.now() + timedelta(days=7))
+
+    def apply(self, goalie, game_id=None):
+        view = ApplyForGame.as_view()
+        data = {'game': game_id or self.game.id, 'goalie': goalie.id}
+        request = factory.post(reverse('apply'), json.dumps(data), content_type='application/json')
+        force_authenticate(request, user=goalie)
+        return view(request)
+
+    def test_fills_both_slots_then_gone(self):
+        self.assertEqual(self.apply(self.goalie_1).status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self.apply(self.goalie_2).status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self.apply(self.goalie_3).status_code, status.HTTP_410_GONE)
+
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.goalie_one, self.goalie_1)
+        self.assertEqual(self.game.goalie_two, self.goalie_2)
+
+    def test_one_goalie_game(self):
+        self.game.two_goalies_needed = False
+        self.game.save()
+
+        self.assertEqual(self.apply(self.goalie_1).status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self.apply(self.goalie_2).status_code, status.HTTP_410_GONE)
+
+    def test_same_goalie_cannot_take_both_slots(self):
+        self.assertEqual(Game.claim_goalie_slot(self.game.id, self.goalie_1.id), 'goalie_one')
+        self.assertIsNone(Game.claim_goalie_slot(self.game.id, self.goalie_1.id))
+        self.assertEqual(self.apply(self.goalie_1).status_code, status.HTTP_409_CONFLICT)
+
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.goalie_one, self.game.goalie_two), (self.goalie_1, None))
+        self.assertEqual(self.apply(self.goalie_2).status_code, status.HTTP_202_ACCEPTED)
+
+    def test_same_goalie_cannot_take_freed_slot(self):
+        self.apply(self.goalie_1)
+        self.apply(self.goalie_2)
+        Game.release_goalie_slot(self.game.id, self.goalie_1.id)
+
+        # goalie_one is free again, but goalie_2 already has goalie_two
+        self.assertIsNone(Game.claim_goalie_slot(self.game.id, self.goalie_2.id))
+        self.assertEqual(self.apply(self.goalie_1).status_code, status.HTTP_202_ACCEPTED)
+
+    def test_missing_game(self):
+        self.assertEqual(self.apply(self.goalie_1, game_id=115).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unapply_keeps_other_slot(self):
+        self.apply(self.goalie_1)
+        self.apply(self.goalie_2)
+
+        view = RemoveGoalieFromGame.as_view()
+        data = {'game': self.game.id, 'goalie': self.goalie_1.id}
+        request = factory.post(reverse('unapply'), json.dumps(data), content_type='application/json')
+        force_authenticate(request, user=self.goalie_1)
+        response = view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.game.refresh_from_db()
+        self.assertIsNone(self.game.goalie_one)
+        self.assertEqual(self.game.goalie_two, self.goalie_2)
+
+
+class GoalieQueue(APITestCase):
+    def setUp(self):
+        kitchener = Location.objects.create(name='Kitchener', latitude=43.4516395, longitude=-80.4925337)
+        toronto = Location.objects.create(name='Toronto', latitude=43.6532, longitude=-79.3832)
+        self.renter = User.objects.create_user('renter', 'renter@fakefalse.com', 'renterpassword')
+        self.goalies = []
+        for i, location in enumerate([toronto, kitchener, kitchener, toronto]):
+            goalie = User.objects.create_user('goalie_{}'.format(i), 'goalie{}@fakefalse.com'.format(i),
+                                              'goalie{}password'.format(i))
+            Profile.objects.filter(pk=goalie.id).update(location=location, skill_level=3, rating=4)
+            self.goalies.append(goalie)
+        self.game = Game.objects.create(user=self.renter, two_goalies_needed=True, skill_level=3,
+                                        latitude=43.4516395, longitude=-80.4925337)
+
+    def apply(self, goalie, game=None):
+        request = factory.post(reverse('apply'), json.dumps({'game': (game or self.game).id, 'goalie': goalie.id}),
+                               content_type='application/json')
+        force_authenticate(request, user=goalie)
+        return ApplyForGame.as_view()(request)
+
+    def after_window(self):
+        return timezone.now() + timedelta(minutes=goalie_queue.WAIT_TIME, seconds=1)
+
+    def test_apply_is_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.apply(self.goalies[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        writes = [query['sql'] for query in queries if not query['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith('INSERT'))
+        self.assertEqual(self.apply(self.goalies[0]).status_code, status.HTTP_200_OK)
+        self.assertEqual(list(self.game.applied_goalies.all()), [self.goalies[0]])
+
+    def test_best_applicants_win(self):
+        for goalie in self.goalies:
+            self.apply(goalie)
+        self.game.refresh_from_db()
+        self.assertIsNone(self.game.goalie_one)
+
+        # Window still open
+        self.assertEqual(goalie_queue.resolve_closed_queues(), 0)
+        self.assertEqual(goalie_queue.resolve_closed_queues(self.after_window()), 1)
+
+        self.game.refresh_from_db()
+        # The two local goalies, although the Toronto goalie applied first
+        self.assertEqual({self.game.goalie_one, self.game.goalie_two}, {self.goalies[1], self.goalies[2]})
+        self.assertTrue(self.game.queue_resolved)
+        self.assertFalse(self.game.applied_goalies.exists())
+        # First come, first served from now on
+        self.assertEqual(self.apply(self.goalies[3]).status_code, status.HTTP_410_GONE)
+
+    def test_many_games_in_one_pass(self):
+        games = [self.game] + [Game.objects.create(user=self.renter, latitude=43.4516395, longitude=-80.4925337)
+                               for _ in range(3)]
+        for game, goalie in zip(games, self.goalies):
+            self.apply(goalie, game)
+
+        candidate_index.get_arrays()
+        # Games, applicants, the bulk UPDATE, emptying the queue, refreshing OpenGame (three queries) and reading
+        # back the slots, plus two savepoints
+        with self.assertNumQueries(12):
+            self.assertEqual(goalie_queue.resolve_closed_queues(self.after_window()), len(games))
+        self.assertEqual([Game.objects.get(pk=game.id).goalie_one for game in games], self.goalies)
+
+    def test_pass_larger_than_a_batch(self):
+        game_count = BULK_UPDATE_BATCH_SIZE + 50
+        Game.objects.bulk_create([Game(user=self.renter, two_goalies_needed=True, latitude=43.4516395,
+                                       longitude=-80.4925337) for _ in range(game_count - 1)])
+        applicant = goalie_queue.Applicant
+        applicant.objects.bulk_create([applicant(game_id=game_id, user_id=goalie.id)
+                                       for game_id in Game.objects.values_list('id', flat=True)
+                                       for goalie in self.goalies])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(goalie_queue.resolve_closed_queues(self.after_window()), game_count)
+        statements = [query['sql'] for query in queries]
+        # Two batches of games, and the queue rows a batch at a time
+        self.assertEqual(len([sql for sql in statements if sql.startswith('UPDATE "Rentals_game" ')]), 2)
+        self.assertEqual(len([sql for sql in statements if sql.startswith('DELETE FROM "Rentals_game_applied')]),
+                         len(chunks(range(game_count * len(self.goalies)), BULK_UPDATE_BATCH_SIZE)))
+        self.assertFalse(applicant.objects.exists())
+        self.assertFalse(Game.objects.filter(goalie_one=None).exists())
+        self.assertFalse(Game.objects.filter(goalie_two=None).exists())
+
+    def test_late_applicant_gets_open_slot(self):
+        self.apply(self.goalies[0])
+        goalie_queue.resolve_closed_queues(self.after_window())
+        # Joined the queue just as it was resolved
+        goalie_queue.enqueue(self.game.id, self.goalies[1].id)
+
+        self.assertEqual(goalie_queue.resolve_closed_queues(self.after_window()), 1)
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.goalie_one, self.game.goalie_two), (self.goalies[0], self.goalies[1]))
+
+    def test_claimed_slot_not_overwritten(self):
+        self.apply(self.goalies[1])
+        Game.claim_goalie_slot(self.game.id, self.goalies[0].id)
+
+        goalie_queue.resolve_closed_queues(self.after_window())
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.goalie_one, self.game.goalie_two), (self.goalies[0], self.goalies[1]))
+
+
+class ApplyForGameConcurrently(TransactionTestCase):
+    APPLICANTS = 200
+
+    def setUp(self):
+        # Skips the profile signals, which aren't under test here
+        User.objects.bulk_create([User(username='goalie_{}'.format(i)) for i in range(self.APPLICANTS)])
+        self.goalies = list(User.objects.all())
+        self.renter = self.goalies.pop()
+
+    def apply_all_at_once(self, game):
+        def apply(goalie):
+            try:
+                while True:
+                    try:
+                        return Game.claim_goalie_slot(game.id, goalie.id)
+                    except OperationalError:
+                        # The in-memory test database reports lock contention straight away instead of
+                        # waiting on it like a database file would, so wait here instead
+                        time.sleep(0.001)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            return [slot for slot in pool.map(apply, self.goalies) if slot is not None]
+
+    def test_two_winners(self):
+        game = Game.objects.create(user=self.renter, two_goalies_needed=True)
+
+        slots = self.apply_all_at_once(game)
+
+        self.assertEqual(sorted(slots), ['goalie_one', 'goalie_two'])
+        game.refresh_from_db()
+        self.assertNotEqual(game.goalie_one_id, game.goalie_two_id)
+
+    def test_one_winner(self):
+        game = Game.objects.create(user=self.renter, two_goalies_needed=False)
+
+        self.assertEqual(self.apply_all_at_once(game), ['goalie_one'])
+
+
+class OpenGameFeed(APITestCase):
+    def setUp(self):
+        self.renter = User.objects.create_user('renter', 'renter@fakefalse.com', 'renterpassword')
+        self.goalie_1 = User.objects.create_user('goalie_one', 'goalie1@fakefalse.com', 'goalie1password')
+        self.goalie_2 = User.objects.create_user('goalie_two', 'goalie2@fakefalse.com', 'goalie2password')
+        game_time = timezone.now() + timedelta(days=7)
+        self.one_goalie = Game.objects.create(user=self.renter, game_time=game_time, queue_resolved=True)
+        self.two_goalies = Game.objects.create(user=self.renter, game_time=game_time + timedelta(hours=1),
+                                               two_goalies_needed=True, queue_resolved=True)
+        self.past = Game.objects.create(user=self.renter, game_time=timezone.now() - timedelta(days=7))
+
+    def feed(self, **params):
+        request = factory.get(reverse('game-list'), dict(params, open='true'))
+        force_authenticate(request, user=self.goalie_1)
+        response = GameList.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [game['id'] for game in response.data['results']]
+
+    def apply(self, goalie, game):
+        request = factory.post(reverse('apply'), json.dumps({'game': game.id, 'goalie': goalie.id}),
+                               content_type='application/json')
+        force_authenticate(request, user=goalie)
+        return ApplyForGame.as_view()(request)
+
+    def assertConsistent(self):
+        self.assertEqual(self.inconsistencies(), ([], []))
+
+    @staticmethod
+    def inconsistencies():
+        return OpenGame.find_inconsistencies(timezone.now() - timedelta(days=30))
+
+    def test_follows_applies_and_removals(self):
+        self.assertEqual(self.feed(), [self.one_goalie.id, self.two_goalies.id])
+
+        self.apply(self.goalie_1, self.one_goalie)
+        self.apply(self.goalie_1, self.two_goalies)
+        self.assertEqual(self.feed(), [self.two_goalies.id])
+        self.assertEqual(OpenGame.objects.get(pk=self.two_goalies.id).slots_open, 1)
+        self.apply(self.goalie_2, self.two_goalies)
+        self.assertEqual(self.feed(), [])
+
+        data = {'game': self.one_goalie.id, 'goalie': self.goalie_1.id}
+        request = factory.post(reverse('unapply'), json.dumps(data), content_type='application/json')
+        force_authenticate(request, user=self.goalie_1)
+        RemoveGoalieFromGame.as_view()(request)
+        self.assertEqual(self.feed(), [self.one_goalie.id])
+        self.assertConsistent()
+
+    def test_follows_game_updates(self):
+        data = {'skill_level': 2, 'goalie_one': self.goalie_2.id}
+        request = factory.patch(reverse('game-detail', args=[self.one_goalie.id]), data, format='json')
+        force_authenticate(request, user=self.renter)
+        GameDetail.as_view()(request, pk=self.one_goalie.id)
+
+        self.assertEqual(self.feed(), [self.two_goalies.id])
+        self.assertEqual(self.feed(skill_level=5), [self.two_goalies.id])
+        self.assertConsistent()
+
+    def test_unrelated_updates_skip_refresh(self):
+        request = factory.patch(reverse('game-detail', args=[self.one_goalie.id]), {'location': 'Rink 2'},
+                                format='json')
+        force_authenticate(request, user=self.renter)
+        with CaptureQueriesContext(connection) as queries:
+            response = GameDetail.as_view()(request, pk=self.one_goalie.id)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if 'opengame' in query['sql'].lower()])
+        self.assertEqual(Game.objects.get(pk=self.one_goalie.id).location, 'Rink 2')
+        self.assertConsistent()
+
+    def test_check_and_rebuild(self):
+        Game.objects.filter(pk=self.one_goalie.id).update(goalie_one=self.goalie_1)
+        self.assertEqual(self.inconsistencies(), ([], [self.one_goalie.id]))
+        with self.assertRaises(CommandError):
+            call_command('open_games', check=True, stdout=StringIO())
+
+        call_command('open_games', rebuild=True, prune=True, check=True, stdout=StringIO())
+        self.assertEqual(self.feed(), [self.two_goalies.id])
+        self.assertFalse(OpenGame.objects.filter(pk=self.past.id).exists())
+
+
+class GameCandidatesGet(APITestCase):
+    def setUp(self):
+        kitchener = Location.objects.create(name='Kitchener', latitude=43.4516395, longitude=-80.4925337)
+        waterloo = Location.objects.create(name='Waterloo', latitude=43.4643, longitude=-80.5204)
+        toronto = Location.objects.create(name='Toronto', latitude=43.6532, longitude=-79.3832)
+        vancouver = Location.objects.create(name='Vancouver', latitude=49.2827, longitude=-123.1207)
+        self.renter = User.objects.create_user('renter', 'renter@fakefalse.com', 'renterpassword')
+        self.goalies = {}
+        for name, location, skill_level, rating, cancellations in [
+            ('local_match', kitchener, 3, 5, 0),
+            ('local_weaker', waterloo, 5, 5, 0),
+            ('local_flaky', waterloo, 3, 5, 9),
+            ('toronto_match', toronto, 3, 5, 0),
+            ('vancouver_match', vancouver, 3, 5, 0),
+        ]:
+            user = User.objects.create_user(name, name + '@fakefalse.com', name + 'password')
+            Profile.objects.filter(pk=user.id).update(location=location, skill_level=skill_level, rating=rating,
+                                                      cancellations=cancellations, games_played=1)
+            self.goalies[name] = user
+        Profile.objects.filter(pk=self.renter.id).update(location=kitchener, is_goalie=False)
+        self.game = Game.objects.create(user=self.renter, skill_level=3, latitude=43.4516395, longitude=-80.4925337)
+
+    def get(self, user, **params):
+        request = factory.get(reverse('game-candidates', args=[self.game.id]), params)
+        force_authenticate(request, user=user)
+        return GameCandidates.as_view()(request, pk=self.game.id)
+
+    def test_ranking(self):
+        response = self.get(self.renter)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ranked = [self.goalies_by_id()[candidate['goalie']] for candidate in response.data]
+        # Vancouver is too far away and the renter isn't a goalie
+        self.assertEqual(ranked, ['local_match', 'local_flaky', 'local_weaker', 'toronto_match'])
+        self.assertEqual(self.get(self.renter, limit=2).data, response.data[:2])
+
+    def test_assigned_goalie_left_out(self):
+        Game.claim_goalie_slot(self.game.id, self.goalies['local_match'].id)
+
+        ranked = [self.goalies_by_id()[candidate['goalie']] for candidate in self.get(self.renter).data]
+        self.assertNotIn('local_match', ranked)
+
+    def test_only_renter_can_see(self):
+        self.assertEqual(self.get(self.goalies['local_match']).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.get(self.renter, limit=0).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def goalies_by_id(self):
+        return {user.id: name for name, user in self.goalies.items()}
+
+
+class EventBroker(SimpleTestCase):
+    def setUp(self):
+        self.broker = LocalBroker()
+
+    def test_wakes_up_waiting_request(self):
+        _, cursor = self.broker.wait(1, None, 0)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            waiting = pool.submit(self.broker.wait, 1, cursor, 5)
+            time.sleep(0.05)
+            self.broker.publish(2, NEW_MESSAGE, {'id': 1})
+            self.broker.publish(1, GOALIE_ASSIGNED, {'game': 1})
+            events, cursor = waiting.result()
+
+        self.assertEqual([event['type'] for event in events], [GOALIE_ASSIGNED])
+        self.assertEqual(self.broker.wait(1, cursor, 0), ([], cursor))
+
+    def test_timeout(self):
+        start = time.monotonic()
+        events, _ = self.broker.wait(1, None, 0.05)
+        self.assertEqual(events, [])
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_cursor_from_another_broker_starts_over(self):
+        self.broker.publish(1, GOALIE_ASSIGNED, {'game': 1})
+        _, stale_cursor = LocalBroker().wait(1, None, 0)
+
+        events, _ = self.broker.wait(1, stale_cursor, 0)
+        self.assertEqual(len(events), 1)
+
+
+# Events are only published once the transaction commits, which never happens inside a TestCase
+class EventsGet(TransactionTestCase):
+    def setUp(self):
+        # New profiles point at location 1
+        Location.objects.create(pk=1, name='Rink')
+        self.renter = User.objects.create_user('renter', 'renter@fakefalse.com', 'renterpassword')
+        self.goalie = User.objects.create_user('goalie', 'goalie@fakefalse.com', 'goaliepassword')
+        self.game = Game.objects.create(user=self.renter, game_time=timezone.now() + timedelta(days=7),
+                                        queue_resolved=True)
+
+    def poll(self, user, **params):
+        request = factory.get(reverse('events'), params)
+        force_authenticate(request, user=user)
+        return Events.as_view()(request)
+
+    def test_goalie_assigned(self):
+        cursor = self.poll(self.renter, timeout=0).data['cursor']
+
+        request = factory.post(reverse('apply'), json.dumps({'game': self.game.id, 'goalie': self.goalie.id}),
+                               content_type='application/json')
+        force_authenticate(request, user=self.goalie)
+        ApplyForGame.as_view()(request)
+
+        response = self.poll(self.renter, cursor=cursor, timeout=1)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['events'][-1]['type'], GOALIE_ASSIGNED)
+        self.assertEqual(response.data['events'][-1]['data'],
+                         {'game': self.game.id, 'goalie': self.goalie.id, 'slot': 'goalie_one'})
+        self.assertEqual(self.poll(self.goalie, cursor=cursor, timeout=0).data['events'], [])
+
+    def test_new_message_goes_to_recipient(self):
+        cursor = self.poll(self.goalie, timeout=0).data['cursor']
+
+        data = {'game': self.game.id, 'game_user': self.renter.id, 'goalie_user': self.goalie.id,
+                'sender_is_goalie': False, 'body': 'See you at the rink'}
+        request = factory.post(reverse('message-list'), json.dumps(data), content_type='application/json')
+        force_authenticate(request, user=self.renter)
+        MessageList.as_view()(request)
+
+        events = self.poll(self.goalie, cursor=cursor, timeout=1).data['events']
+        self.assertEqual(events[-1]['type'], NEW_MESSAGE)
+        self.assertEqual(events[-1]['data']['body'], 'See you at the rink')
+
+    def test_bad_timeout(self):
+        self.assertEqual(self.poll(self.renter, timeout='soon').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.poll(self.renter, timeout=600).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SqliteJournalMode(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'journal.sqlite3')
+
+    # Configures a fresh connection to a file the way connection_created would, returns the file's journal mode
+    def configure(self):
+        raw = sqlite3.connect(self.path)
+        self.addCleanup(raw.close)
+        configure_sqlite(sender=None, connection=SimpleNamespace(vendor='sqlite', connection=raw))
+        return raw.execute('PRAGMA journal_mode').fetchone()[0]
+
+    def test_left_alone_by_default(self):
+        with override_settings(SQLITE_JOURNAL_MODE=None):
+            self.assertEqual(self.configure(), 'delete')
+
+    def test_sets_mode(self):
+        with override_settings(SQLITE_JOURNAL_MODE='wal'):
+            self.assertEqual(self.configure(), 'wal')
+
+    def test_rejects_bad_mode(self):
+        with override_settings(SQLITE_JOURNAL_MODE='fast'), self.assertRaises(ValueError):
+            self.configure()
+
+
+class BatchDistance(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.latitudes = np.append(rng.uniform(-89, 89, 200), [43.4516, 0.5])
+        self.longitudes = np.append(rng.uniform(-180, 180, 200), [-80.4925, 179.7])
+        self.origin = (43.4516, -80.4925)
+        self.expected = np.array([geopy.distance.distance(self.origin, coords).km
+                                  for coords in zip(self.latitudes, self.longitudes)])
+
+    def test_vincenty_matches_geopy(self):
+        distances = batch_distance_km(self.origin[0], self.origin[1], self.latitudes, self.longitudes, VINCENTY)
+
+        self.assertEqual(distances.shape, (202,))
+        # Within 1mm, including the nearly antipodal pair that falls back to geopy
+        self.assertLess(np.abs(distances - self.expected).max(), 1e-6)
+
+    def test_haversine_close_to_geopy(self):
+        distances = batch_distance_km(self.origin[0], self.origin[1], self.latitudes, self.longitudes, HAVERSINE)
+
+        # Within 0.5%
+        self.assertTrue(np.all(np.abs(distances - self.expected) <= 0.005 * self.expected + 1e-9))
+
+    def test_many_origins(self):
+        distances = batch_distance_km([0.0, self.origin[0]], [0.0, self.origin[1]],
+                                      self.latitudes, self.longitudes, VINCENTY)
+
+        self.assertEqual(distances.shape, (2, 202))
+        self.assertLess(np.abs(distances[1] - self.expected).max(), 1e-6)
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            batch_distance_km(0, 0, [1], [1], 'flat-earth')
 
 
 class LocationCreate(APITestCase):
@@ -158,6 +1034,219 @@ class LocationCreate(APITestCase):
         self.assertEqual(response.data['longitude'], data['longitude'])
 
 
+class LocationCached(APITestCase):
+    def setUp(self):
+        get_response_cache().clear()
+        reset_cache_stats()
+        self.test_user = User.objects.create_user('testuser', 'test@example.com', 'testpassword')
+        self.location = Location.objects.create(name='Kitchener', latitude=43.45164, longitude=-80.492534)
+
+    def get(self, view, url, view_kwargs=None, **headers):
+        request = factory.get(url, **headers)
+        force_authenticate(request, user=self.test_user)
+        return view(request, **(view_kwargs or {}))
+
+    def test_hit_after_miss(self):
+        view = LocationList.as_view()
+        first = self.get(view, reverse('location-list'))
+        with self.assertNumQueries(0):
+            second = self.get(view, reverse('location-list'))
+
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(json.loads(second.content.decode())['results'][0]['name'], 'Kitchener')
+        self.assertEqual(second['Cache-Control'], 'max-age=60, must-revalidate')
+        self.assertEqual(get_cache_stats()['LocationList'], {'hits': 1, 'misses': 1})
+
+    def test_not_modified(self):
+        view = LocationDetail.as_view()
+        url = reverse('location-detail', args=[self.location.id])
+        pk = {'pk': self.location.id}
+        etag = self.get(view, url, pk)['ETag']
+
+        response = self.get(view, url, pk, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.get(view, url, pk, HTTP_IF_NONE_MATCH='"stale"').status_code, status.HTTP_200_OK)
+
+    def test_invalidated_by_save_and_delete(self):
+        view = LocationList.as_view()
+        url = reverse('location-list')
+        etag = self.get(view, url)['ETag']
+
+        self.location.name = 'Waterloo'
+        self.location.save()
+        response = self.get(view, url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response['X-Cache']), (status.HTTP_200_OK, 'MISS'))
+        self.assertEqual(json.loads(response.content.decode())['results'][0]['name'], 'Waterloo')
+
+        Location.objects.create(name='Toronto')
+        self.assertEqual(len(json.loads(self.get(view, url).content.decode())['results']), 2)
+
+    def test_stats_for_admins_only(self):
+        request = factory.get(reverse('cache-stats'))
+        force_authenticate(request, user=self.test_user)
+        self.assertEqual(CacheStats.as_view()(request).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class RequestMetrics(APITestCase):
+    def setUp(self):
+        reset_metrics()
+        self.test_user = User.objects.create_user('testuser', 'test@example.com', 'testpassword')
+        Location.objects.create(name='Kitchener', latitude=43.45164, longitude=-80.492534)
+        for _ in range(3):
+            Game.objects.create(user=self.test_user)
+        self.client.force_authenticate(user=self.test_user)
+
+    def test_records_queries_per_view(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('game-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        recorded = get_metrics()['game-list']
+        self.assertEqual(recorded['statuses'], {'2xx': 1})
+        self.assertEqual(recorded['queries']['max'], len(queries))
+        self.assertEqual(recorded['latency']['count'], 1)
+        self.assertEqual(recorded['render']['count'], 1)
+        self.assertLessEqual(recorded['db_time']['max'], recorded['latency']['max'])
+
+    def test_warns_about_query_heavy_requests(self):
+        with override_settings(METRICS_QUERY_WARNING_COUNT=1), self.assertLogs('Rentals.metrics', 'WARNING') as logs:
+            self.client.get(reverse('game-list'))
+        self.assertEqual(logs.records[0].view, 'game-list')
+
+    def test_admins_only(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'adminpassword')
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content.decode())['views']['metrics']['statuses'], {'4xx': 1})
+
+
+class TableExports(APITestCase):
+    def setUp(self):
+        Location.objects.create(name='Kitchener', latitude=43.45164, longitude=-80.492534)
+        self.renter = User.objects.create_user('renter', 'renter@example.com', 'renterpassword')
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'adminpassword')
+        self.games = [Game.objects.create(user=self.renter, location='Rink "{}", \u00e9'.format(i)) for i in range(3)]
+        Message.objects.create(game=self.games[0], body='Secret', game_user=self.renter, goalie_user=self.admin)
+        self.client.force_authenticate(user=self.admin)
+
+    def export(self, table, file_format, **params):
+        return self.client.get(reverse('export', args=[table, file_format]), params)
+
+    def test_admins_only(self):
+        self.client.force_authenticate(user=self.renter)
+        self.assertEqual(self.export('games', 'ndjson').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_ndjson_after_watermark(self):
+        response = self.export('games', 'ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [game.id for game in self.games])
+        self.assertEqual(rows[1]['location'], 'Rink "1", \u00e9')
+        self.assertEqual(rows[0]['user_id'], self.renter.id)
+        self.assertEqual(response['X-Export-Watermark'], str(self.games[-1].id))
+
+        game = Game.objects.create(user=self.renter)
+        response = self.export('games', 'ndjson', after_id=response['X-Export-Watermark'])
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [game.id])
+
+    def test_csv_leaves_out_secrets(self):
+        response = self.export('profiles', 'csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,user_id,location_id,is_goalie,skill_level,rating,games_played,cancellations')
+        self.assertEqual(len(lines), 3)
+
+        body = b''.join(self.export('messages', 'csv').streaming_content).decode()
+        self.assertNotIn('Secret', body)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.export('profiles', 'csv', since='2019-02-12T20:00:00Z').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.export('games', 'xml').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.export('users', 'csv').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.export('games', 'csv', after_id='last').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_parquet(self):
+        response = self.export('games', 'parquet')
+        if export.pyarrow is None:
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            return
+        table = export.pyarrow.parquet.read_table(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(table.column('id').to_pylist(), [game.id for game in self.games])
+        self.assertEqual(table.column('creation_time').to_pylist()[0], self.games[0].creation_time)
+
+        response = self.export('games', 'parquet', after_id=self.games[-1].id)
+        self.assertEqual(export.pyarrow.parquet.read_table(BytesIO(b''.join(response.streaming_content))).num_rows, 0)
+
+    def test_command_keeps_state(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output, state = os.path.join(directory, 'games.csv'), os.path.join(directory, 'state.json')
+        call_command('export_table', 'games', format='csv', output=output, state=state, stderr=StringIO())
+        with open(output) as exported:
+            self.assertEqual(len(exported.read().splitlines()), 4)
+
+        game = Game.objects.create(user=self.renter)
+        call_command('export_table', 'games', format='csv', output=output, state=state, stderr=StringIO())
+        with open(output) as exported:
+            self.assertEqual(exported.read().splitlines()[1].split(',')[0], str(game.id))
+        with open(state) as state_file:
+            self.assertEqual(json.load(state_file), {'games': game.id})
+
+
+class AdminChangelists(APITestCase):
+    def setUp(self):
+        Location.objects.create(name='Kitchener', latitude=43.45164, longitude=-80.492534)
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'adminpassword')
+        self.goalie = User.objects.create_user('goalie', 'goalie@example.com', 'goaliepassword')
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count):
+        for _ in range(count):
+            game = Game.objects.create(user=self.admin, goalie_one=self.goalie)
+            Message.objects.create(game=game, game_user=self.admin, goalie_user=self.goalie)
+
+    def get_changelist(self, model, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:Rentals_{}_changelist'.format(model)), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return queries
+
+    def test_queries_dont_grow_with_rows(self):
+        self.add_rows(2)
+        few = {model: len(self.get_changelist(model)) for model in ('game', 'message', 'profile')}
+        self.add_rows(6)
+        many = {model: len(self.get_changelist(model)) for model in ('game', 'message', 'profile')}
+
+        self.assertEqual(few, many)
+
+    def test_no_full_count(self):
+        self.add_rows(3)
+        queries = self.get_changelist('game', skill_level__exact=5)
+
+        counts = [query['sql'] for query in queries if 'COUNT(' in query['sql']]
+        self.assertEqual(len(counts), 1)
+        self.assertIn('LIMIT', counts[0])
+
+    def test_estimated_count(self):
+        self.add_rows(5)
+        paginator = EstimatedCountPaginator(Game.objects.order_by('id'), 2)
+        paginator.exact_count_limit = 3
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(paginator.count, Game.objects.latest('id').id)
+        self.assertNotIn('COUNT(', queries[0]['sql'])
+
+        paginator = EstimatedCountPaginator(Game.objects.filter(skill_level=5).order_by('id'), 2)
+        paginator.exact_count_limit = 3
+        self.assertEqual(paginator.count, 4)
+
+
 class LocationDelete(APITestCase):
     def setUp(self):
         self.test_user = User.objects.create_user('testuser', 'test@example.com', 'testpassword')
@@ -263,7 +1352,7 @@ class MessageGet(APITestCase):
         response = view(request)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_get_list_user_is_goalie_in_message(self):
         view = MessageList.as_view()
@@ -272,7 +1361,7 @@ class MessageGet(APITestCase):
         response = view(request)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_get_list_user_not_in_message(self):
         view = MessageList.as_view()
@@ -281,7 +1370,7 @@ class MessageGet(APITestCase):
         response = view(request)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data['results']), 0)
 
     def test_get_list_user_is_superuser(self):
         view = MessageList.as_view()
@@ -290,7 +1379,7 @@ class MessageGet(APITestCase):
         response = view(request)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_get_detail_user_is_renter_in_message(self):
         view = MessageDetail.as_view()
@@ -329,6 +1418,138 @@ class MessageGet(APITestCase):
         self.assertEqual(len(response.data), 7)
 
 
+class MessageSync(APITestCase):
+    def setUp(self):
+        self.renter = User.objects.create_user('renter', 'renter@gmailfake.com', 'renterpassword')
+        self.goalie = User.objects.create_user('goalie', 'goalie@gmailfake.com', 'goaliepassword')
+        self.other = User.objects.create_user('other', 'other@gmailfake.com', 'otherpassword')
+        self.game = Game.objects.create(user=self.renter)
+        self.messages = [self.send(self.goalie, 'Message {}'.format(i)) for i in range(3)]
+        self.send(self.other, 'Not for the goalie')
+
+    def send(self, goalie, body):
+        return Message.objects.create(game=self.game, body=body, game_user=self.renter, goalie_user=goalie)
+
+    def sync(self, user, etag=None, **params):
+        request = factory.get(reverse('message-list'), params, HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=user)
+        return MessageList.as_view()(request)
+
+    def test_sync_from_start(self):
+        response = self.sync(self.goalie, since=0)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cursor'], self.messages[-1].id)
+        self.assertFalse(response.data['more'])
+        body = response.data['fields'].index('body')
+        self.assertEqual([message[body] for message in response.data['messages']],
+                         ['Message 0', 'Message 1', 'Message 2'])
+
+    def test_sync_in_pages(self):
+        response = self.sync(self.goalie, since=0, limit=2)
+        self.assertTrue(response.data['more'])
+        self.assertEqual(len(response.data['messages']), 2)
+
+        response = self.sync(self.goalie, since=response.data['cursor'], limit=2)
+        self.assertFalse(response.data['more'])
+        self.assertEqual(response.data['messages'][0][0], self.messages[2].id)
+
+    def test_not_modified(self):
+        response = self.sync(self.goalie, since=0)
+        cursor, etag = response.data['cursor'], response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.sync(self.goalie, etag=etag, since=cursor)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        new_message = self.send(self.goalie, 'Something new')
+        response = self.sync(self.goalie, etag=etag, since=cursor)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cursor'], new_message.id)
+        self.assertEqual(len(response.data['messages']), 1)
+
+    def test_creation_time_is_stable(self):
+        message = self.messages[0]
+        created = message.creation_time
+        message.body = 'Edited'
+        message.save()
+
+        self.assertEqual(Message.objects.get(pk=message.id).creation_time, created)
+
+    def test_bad_since(self):
+        self.assertEqual(self.sync(self.goalie, since='yesterday').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class InboxGet(APITestCase):
+    def setUp(self):
+        self.renter = User.objects.create_user('renter', 'renter@gmailfake.com', 'renterpassword')
+        self.goalie_1 = User.objects.create_user('goalie_one', 'goalie1@gmailfake.com', 'goalie1password')
+        self.goalie_2 = User.objects.create_user('goalie_two', 'goalie2@gmailfake.com', 'goalie2password')
+        self.game_1 = Game.objects.create(user=self.renter)
+        self.game_2 = Game.objects.create(user=self.renter)
+        self.send(self.game_1, self.goalie_1, 'Can I play?', sender_is_goalie=True)
+        self.send(self.game_1, self.goalie_1, 'Sure', sender_is_goalie=False)
+        self.send(self.game_1, self.goalie_1, 'See you there', sender_is_goalie=True)
+        self.send(self.game_2, self.goalie_2, 'Need a goalie?', sender_is_goalie=True)
+        self.send(self.game_1, self.goalie_2, 'Any room left?', sender_is_goalie=True)
+
+    def send(self, game, goalie, body, sender_is_goalie):
+        return Message.objects.create(game=game, body=body, game_user=self.renter, goalie_user=goalie,
+                                      sender_is_goalie=sender_is_goalie)
+
+    def get_page(self, user, url=None, params=None):
+        request = factory.get(url or reverse('inbox'), params)
+        force_authenticate(request, user=user)
+        response = Inbox.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def get_inbox(self, user):
+        return self.get_page(user)['results']
+
+    def test_renter_inbox(self):
+        with self.assertNumQueries(2):
+            inbox = self.get_inbox(self.renter)
+
+        self.assertEqual([(entry['game'], entry['goalie_user']) for entry in inbox],
+                         [(self.game_1.id, self.goalie_2.id),
+                          (self.game_2.id, self.goalie_2.id),
+                          (self.game_1.id, self.goalie_1.id)])
+        self.assertEqual(inbox[2]['latest_message']['body'], 'See you there')
+        self.assertEqual([entry['unread_count'] for entry in inbox], [1, 1, 2])
+
+    def test_paginated(self):
+        page = self.get_page(self.renter, params={'page_size': 2})
+        self.assertEqual([(entry['game'], entry['goalie_user']) for entry in page['results']],
+                         [(self.game_1.id, self.goalie_2.id), (self.game_2.id, self.goalie_2.id)])
+        self.assertIsNone(page['previous'])
+
+        # A new message moves its conversation to the top, but doesn't shift the next page
+        self.send(self.game_2, self.goalie_2, 'Still need one', sender_is_goalie=True)
+        page = self.get_page(self.renter, page['next'])
+        self.assertEqual([(entry['game'], entry['goalie_user']) for entry in page['results']],
+                         [(self.game_1.id, self.goalie_1.id)])
+        self.assertIsNone(page['next'])
+        self.assertEqual(len(self.get_page(self.renter, page['previous'])['results']), 2)
+
+    def test_goalie_inbox(self):
+        inbox = self.get_inbox(self.goalie_1)
+
+        self.assertEqual(len(inbox), 1)
+        self.assertEqual(inbox[0]['unread_count'], 1)
+
+    def test_mark_read(self):
+        request = factory.post(reverse('inbox-read'), json.dumps({'game': self.game_1.id}),
+                               content_type='application/json')
+        force_authenticate(request, user=self.renter)
+        response = MarkMessagesRead.as_view()(request)
+
+        self.assertEqual(response.data['marked_read'], 3)
+        self.assertEqual([entry['unread_count'] for entry in self.get_inbox(self.renter)], [0, 1, 0])
+        # Only the renter's side was marked read
+        self.assertEqual(self.get_inbox(self.goalie_1)[0]['unread_count'], 1)
+
+
 class UserCreate(APITestCase):
     def setUp(self):
         # We want to go ahead and originally create a user.
@@ -367,6 +1588,39 @@ class UserCreate(APITestCase):
         # Check that a profile was created as well
         self.assertEqual(Profile.objects.count(), 2)
 
+    def test_create_user_query_count(self):
+        data = {
+            'username': 'foobar',
+            'email': 'foobar@example.com',
+            'password': 'somepassword',
+        }
+
+        request = factory.post(self.create_url, json.dumps(data), content_type='application/json')
+        # Username check, savepoint, user/token/profile INSERTs, savepoint release
+        with self.assertNumQueries(6):
+            response = self.view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user = User.objects.get(username='foobar')
+        self.assertTrue(user.check_password('somepassword'))
+        profile = Profile.objects.get(pk=user.id)
+        self.assertEqual(profile.user, user)
+        self.assertEqual(profile.access_token, Token.objects.get(user=user).key)
+
+    def test_password_that_looks_hashed(self):
+        password = 'pbkdf2_sha256$1$salt$bm90IGEgcmVhbCBoYXNo'
+        data = {'username': 'foobar', 'email': 'foobar@example.com', 'password': password}
+        request = factory.post(self.create_url, json.dumps(data), content_type='application/json')
+        self.assertEqual(self.view(request).status_code, status.HTTP_201_CREATED)
+        user = User.objects.get(username='foobar')
+        self.assertNotEqual(user.password, password)
+        self.assertTrue(user.check_password(password))
+
+        request = factory.patch(reverse('user-detail', args=[user.id]), {'password': password + 'x'}, format='json')
+        force_authenticate(request, user=user)
+        self.assertEqual(UserDetail.as_view()(request, pk=user.id).status_code, status.HTTP_200_OK)
+        self.assertTrue(User.objects.get(pk=user.id).check_password(password + 'x'))
+
     def test_create_user_with_no_username(self):
         data = {
                 'username': '',
@@ -427,8 +1681,8 @@ class UserGet(APITestCase):
         force_authenticate(request, user=self.test_user_1)
         response = view(request)
 
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['username'], 'tester_one')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['username'], 'tester_one')
 
     # Superuser can see all users
     def test_get_list_as_superuser(self):
@@ -437,7 +1691,7 @@ class UserGet(APITestCase):
         force_authenticate(request, user=self.test_user_super)
         response = view(request)
 
-        self.assertEqual(len(response.data), 4)
+        self.assertEqual(len(response.data['results']), 4)
 
     # Normal user can get detail of self
     def test_get_detail_of_normal_user_as_same_user(self):
@@ -491,6 +1745,226 @@ class ProfileCreate(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+class ProfilePicture(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = override_settings(MEDIA_ROOT=media_root, PICTURE_FORMAT='JPEG')
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        Location.objects.create(name='Kitchener', latitude=43.4516395, longitude=-80.49253369999997)
+        self.test_user = User.objects.create_user('tester_one', 'test1@fakefalse.com', 'test1password')
+
+    # A landscape photo whose EXIF says the camera was turned sideways
+    @staticmethod
+    def sideways_photo():
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010f] = 'Camera maker'
+        photo = BytesIO()
+        Image.new('RGB', (400, 300), 'red').save(photo, 'JPEG', exif=exif.tobytes())
+        photo.name = 'photo.jpg'
+        photo.seek(0)
+        return photo
+
+    def upload(self):
+        request = factory.patch(reverse('profile-detail', args=[self.test_user.id]),
+                                {'picture': self.sideways_photo()}, format='multipart')
+        force_authenticate(request, user=self.test_user)
+        return ProfileDetail.as_view()(request, pk=self.test_user.id)
+
+    def test_upload_is_upright_without_exif(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        picture = Profile.objects.get(pk=self.test_user.id).picture
+        self.assertRegex(picture.name, r'^pictures/[0-9a-f]{40}\.jpg$')
+        with Image.open(picture.path) as stored:
+            self.assertEqual(stored.size, (300, 400))
+            self.assertEqual(dict(stored.getexif()), {})
+        self.assertEqual(sorted(response.data['picture_variants']), ['large', 'small', 'thumb'])
+
+        # The same photo again is stored once
+        self.upload()
+        self.assertEqual(Profile.objects.get(pk=self.test_user.id).picture.name, picture.name)
+
+    def test_variant_made_on_first_request(self):
+        self.upload()
+        name = Profile.objects.get(pk=self.test_user.id).picture.name.split('/')[1]
+        variant_path = '{}/pictures/thumb/{}'.format(settings.MEDIA_ROOT, name)
+        self.assertFalse(os.path.exists(variant_path))
+
+        request = factory.get(reverse('picture-variant', args=['thumb', name]))
+        force_authenticate(request, user=self.test_user)
+        response = PictureVariant.as_view()(request, variant='thumb', name=name)
+        self.assertEqual((response.status_code, response['Content-Type']), (status.HTTP_200_OK, 'image/jpeg'))
+        with Image.open(BytesIO(b''.join(response.streaming_content))) as thumb:
+            self.assertEqual(thumb.size, (72, 96))
+        with Image.open(variant_path) as cached:
+            self.assertEqual(cached.size, (72, 96))
+
+        response = PictureVariant.as_view()(request, variant='huge', name=name)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class UnreachableEmailBackend(BaseEmailBackend):
+    def open(self):
+        raise ConnectionRefusedError('Mail server is down')
+
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError('Mail server is down')
+
+
+class Outbox(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('goalie', 'goalie@fakefalse.com', 'goaliepassword')
+
+    def test_verification_email_waits_for_worker(self):
+        Profile.send_verification_email(User, self.user, created=True)
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(send_pending(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['goalie@fakefalse.com'])
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.SENT)
+        self.assertEqual(send_pending(), (0, 0))
+
+    def test_password_reset_uses_outbox(self):
+        response = self.client.post(reverse('password_reset'), {'email': 'goalie@fakefalse.com'})
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.to, 'goalie@fakefalse.com')
+        self.assertIn('/reset/', email.body)
+
+    @override_settings(EMAIL_BACKEND='Rentals.tests.UnreachableEmailBackend',
+                       OUTBOX_RETRY_DELAY=30, OUTBOX_MAX_ATTEMPTS=2)
+    def test_retries_with_backoff_then_gives_up(self):
+        email = OutboxEmail.enqueue('Subject', 'Body', ['goalie@fakefalse.com'])
+
+        self.assertEqual(send_pending(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.PENDING, 1))
+        self.assertIn('Mail server is down', email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=25))
+        # Not due yet
+        self.assertEqual(send_pending(), (0, 0))
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(send_pending(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.FAILED, 2))
+        self.assertEqual(send_pending(), (0, 0))
+
+
+class PasswordHashing(APITestCase):
+    def setUp(self):
+        self.token_url = reverse('token-get')
+
+    def test_pooled_hash_matches_plain_hasher(self):
+        pooled = PooledPBKDF2PasswordHasher()
+        encoded = pooled.encode('testpassword', 'somesalt')
+
+        self.assertEqual(encoded, PBKDF2PasswordHasher().encode('testpassword', 'somesalt', pooled.iterations))
+        self.assertTrue(pooled.verify('testpassword', encoded))
+        self.assertFalse(pooled.verify('wrongpassword', encoded))
+
+    def test_cost_follows_settings(self):
+        pooled = PooledPBKDF2PasswordHasher()
+        with self.settings(PASSWORD_HASHING_ITERATIONS=1000):
+            self.assertEqual(pooled.get_cost(), {'iterations': 1000})
+            self.assertEqual(pooled.iterations, 1000)
+
+    def test_hash_inline_without_pool(self):
+        with self.settings(PASSWORD_HASHING_POOL=None):
+            encoded = make_password('testpassword')
+
+        self.assertTrue(check_password('testpassword', encoded))
+
+    def test_login_upgrades_hash(self):
+        with self.settings(PASSWORD_HASHING_ITERATIONS=1000):
+            user = User.objects.create_user('testuser', 'test@example.com', 'testpassword')
+        self.assertIn('$1000$', user.password)
+
+        response = self.client.post(self.token_url, {'username': 'testuser', 'password': 'testpassword'},
+                                    format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertIn('${}$'.format(settings.PASSWORD_HASHING_ITERATIONS), user.password)
+        self.assertTrue(user.check_password('testpassword'))
+
+
+class CachedTokenAuth(APITestCase):
+    def setUp(self):
+        local_token_cache.clear()
+        self.test_user = User.objects.create_user('testuser', 'test@example.com', 'testpassword')
+        self.token = Token.objects.get(user=self.test_user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.detail_url = reverse('user-detail', kwargs={'pk': self.test_user.id})
+
+    def test_second_request_skips_token_lookup(self):
+        # Token lookup plus the user itself
+        with self.assertNumQueries(2):
+            response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['username'], 'testuser')
+
+    def test_deactivated_user_is_forgotten(self):
+        self.assertEqual(self.client.get(self.detail_url).status_code, status.HTTP_200_OK)
+
+        self.test_user.is_active = False
+        self.test_user.save()
+
+        self.assertEqual(self.client.get(self.detail_url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_last_login_keeps_tokens(self):
+        self.assertEqual(self.client.get(self.detail_url).status_code, status.HTTP_200_OK)
+        update_last_login(None, self.test_user)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.detail_url).status_code, status.HTTP_200_OK)
+
+    def test_cache_groups(self):
+        cache = LRUCache(2, 60, group=lambda value: value[0])
+        cache.set('a', (1, 'a'))
+        cache.set('b', (2, 'b'))
+        cache.set('c', (1, 'c'))
+        # 'a' was the least recently used, so it made room for 'c'
+        self.assertIsNone(cache.get('a'))
+        cache.delete_group(1)
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual(cache.get('b'), (2, 'b'))
+        self.assertEqual(cache._groups, {2: {'b'}})
+
+    def test_logout_forgets_token(self):
+        self.assertEqual(self.client.get(self.detail_url).status_code, status.HTTP_200_OK)
+
+        response = self.client.post(reverse('token-logout'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Token.objects.filter(key=self.token.key).exists())
+        self.assertEqual(self.client.get(self.detail_url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_shared_cache_tier(self):
+        with self.settings(TOKEN_AUTH_SHARED_CACHE='default'):
+            self.assertEqual(self.client.get(self.detail_url).status_code, status.HTTP_200_OK)
+            # Another process would start with an empty local cache
+            local_token_cache.clear()
+
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get(self.detail_url).status_code, status.HTTP_200_OK)
+
+            self.token.delete()
+            local_token_cache.clear()
+            self.assertEqual(self.client.get(self.detail_url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
 class UserAuthenticate(APITestCase):
     def setUp(self):
         # We want to go ahead and originally create a user.
@@ -2,6 +2,8 @@ from django.conf.urls import url, include
 from django.contrib.auth import views as auth_views
 from rest_framework.urlpatterns import format_suffix_patterns
 from Rentals import views
+from Rentals.forms import OutboxPasswordResetForm
+from Rentals.pictures import HASHED_NAME_PATTERN
 from rest_framework.authtoken import views as rest_views
 
 # Patterns that have associated models and serializers
@@ -16,6 +18,9 @@ urlpatterns = format_suffix_patterns([
     # Used to get a token for a user
     url(r'^api-token-auth/', rest_views.obtain_auth_token, name='token-get'),
 
+    # Deletes the token used to make the request
+    url(r'^api-token-logout/$', views.TokenLogout.as_view(), name='token-logout'),
+
     # Login and logout view for the browseable API
     url(r'api-auth/', include('rest_framework.urls', namespace='rest_framework')),
 
@@ -24,6 +29,16 @@ urlpatterns = format_suffix_patterns([
 
     url(r'^unapply/$', views.RemoveGoalieFromGame.as_view(), name='unapply'),
 
+    # Long-poll for goalie and message events
+    url(r'^events/$', views.Events.as_view(), name='events'),
+
+    # Hit and miss counts for the response cache, for admins
+    url(r'^cache-stats/$', views.CacheStats.as_view(), name='cache-stats'),
+    url(r'^metrics/$', views.Metrics.as_view(), name='metrics'),
+
+    # Whole table exports for analytics, for admins
+    url(r'^export/(?P<table>[a-z]+)/(?P<file_format>[a-z]+)/$', views.Export.as_view(), name='export'),
+
     # Let the front-end check if a username or email is already in use
     url(r'^check-username/$', views.CheckUsernameUnique.as_view(), name='check-username'),
     url(r'^check-email/$', views.CheckEmailUnique.as_view(), name='check-email'),
@@ -32,9 +47,15 @@ urlpatterns = format_suffix_patterns([
     url(r'^game/$',
         views.GameList.as_view(),
         name='game-list'),
+    url(r'^game/bulk/$',
+        views.GameBulk.as_view(),
+        name='game-bulk'),
     url(r'^game/(?P<pk>[0-9]+)/$',
         views.GameDetail.as_view(),
         name='game-detail'),
+    url(r'^game/(?P<pk>[0-9]+)/candidates/$',
+        views.GameCandidates.as_view(),
+        name='game-candidates'),
 
     # Location
     url(r'^location/$',
@@ -52,6 +73,14 @@ urlpatterns = format_suffix_patterns([
         views.MessageDetail.as_view(),
         name='message-detail'),
 
+    # A user's conversations with the latest message and unread count for each
+    url(r'^inbox/$',
+        views.Inbox.as_view(),
+        name='inbox'),
+    url(r'^inbox/read/$',
+        views.MarkMessagesRead.as_view(),
+        name='inbox-read'),
+
     # Profile
     url(r'^profile/$',
         views.ProfileList.as_view(),
@@ -59,6 +88,9 @@ urlpatterns = format_suffix_patterns([
     url(r'^profile/(?P<pk>[0-9]+)/$',
         views.ProfileDetail.as_view(),
         name='profile-detail'),
+    url(r'^picture/(?P<variant>[a-z]+)/(?P<name>{})$'.format(HASHED_NAME_PATTERN),
+        views.PictureVariant.as_view(),
+        name='picture-variant'),
 
     # User URLs
     url(r'^user/$',
@@ -70,11 +102,12 @@ urlpatterns = format_suffix_patterns([
 
 ])
 
-# Password reset views
+# Password reset views. Reset emails are queued in the outbox instead of being sent during the request
 urlpatterns += [
-    url(r'^password_reset/$', auth_views.PasswordResetView, name='password_reset'),
-    url(r'^password_reset/done/$', auth_views.PasswordResetDoneView, name='password_reset_done'),
+    url(r'^password_reset/$', auth_views.PasswordResetView.as_view(form_class=OutboxPasswordResetForm),
+        name='password_reset'),
+    url(r'^password_reset/done/$', auth_views.PasswordResetDoneView.as_view(), name='password_reset_done'),
     url(r'^reset/(?P<uidb64>[0-9A-Za-z_\-]+)/(?P<token>[0-9A-Za-z]{1,13}-[0-9A-Za-z]{1,20})/$',
-        auth_views.PasswordResetConfirmView, name='password_reset_confirm'),
-    url(r'^reset/done/$', auth_views.PasswordResetCompleteView, name='password_reset_complete'),
+        auth_views.PasswordResetConfirmView.as_view(), name='password_reset_confirm'),
+    url(r'^reset/done/$', auth_views.PasswordResetCompleteView.as_view(), name='password_reset_complete'),
 ]
@@ -1,12 +1,20 @@
+import logging
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
 from django.utils.http import urlsafe_base64_decode
 from django.utils import timezone
 
-from rest_framework import generics, status
+from rest_framework import generics, serializers, status
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
@@ -14,13 +22,46 @@ from rest_framework.views import APIView
 
 from rest_framework.permissions import IsAdminUser
 
+from . import goalie_queue
+from .bulk import chunks, OPEN_GAME_REFRESH_BATCH_SIZE
+from .caching import CachedResponseMixin, get_cache_stats
+from .distance import batch_distance_km
+from .events import get_broker, publish_on_commit, GOALIE_ASSIGNED, GOALIE_REMOVED, NEW_MESSAGE
+from .export import EXPORT_FORMATS, TableExport
+from .fastlist import FastListMixin
+from .fieldsets import ExpandedQuerysetMixin
+from .geo import geohash_radius_filter
+from .matching import rank_goalies
+from .metrics import get_metrics
+from .models import OpenGame
+from .pagination import GamePagination, InboxPagination, MessagePagination, NearbyGamePagination, OpenGamePagination
+from .parsers import CSVParser
+from .pictures import CONTENT_TYPES, get_variant, get_variants, PICTURE_DIRECTORY
 from .serializers import *
 from .tokens import account_activation_token
 
 import geopy.distance
 
-# Wait time in minutes
-WAIT_TIME = 5
+logger = logging.getLogger(__name__)
+
+# Shortlist size for GameCandidates
+CANDIDATES_LIMIT = 10
+CANDIDATES_MAX_LIMIT = 100
+# Long-poll timeouts for Events, in seconds. Kept under the usual 60 second proxy timeout
+EVENTS_TIMEOUT = 25
+EVENTS_MAX_TIMEOUT = 55
+# Message sync (MessageList ?since=)
+SYNC_PAGE_SIZE = 200
+SYNC_MAX_PAGE_SIZE = 1000
+MESSAGE_SYNC_FIELDS = ('id', 'game', 'body', 'game_user', 'goalie_user', 'creation_time', 'sender_is_goalie')
+SYNC_TIME_COLUMN = MESSAGE_SYNC_FIELDS.index('creation_time')
+SYNC_TIME_FIELD = serializers.DateTimeField()
+# Games stay in the upcoming games list for this long after they start
+UPCOMING_GAME_GRACE = timedelta(days=1)
+# Largest radius_km GameList takes. Bigger circles would read a large part of the Game table
+NEARBY_MAX_RADIUS_KM = 500
+# Most games GameBulk takes in one request
+BULK_MAX_GAMES = 1000
 CURRENT_SITE = 'localhost:8000'
 
 
@@ -34,104 +75,168 @@ def calculate_distance_between_coordinate(coords1, coords2):
 # game: id of game
 # goalie: id of goalie
 # Returns:
-#     200 if added to queue
+#     200 if added to the game's queue, which is resolved once the game has been up for goalie_queue.WAIT_TIME
+#         minutes. Also if they were already queued
 #     202 if given the game
+#     400 if the goalie doesn't exist
+#     404 if the game doesn't exist
 #     410 if the game is already filled
-# TODO: Add test to make sure ApplyForGame is working
 class ApplyForGame(APIView):
     def post(self, request):
-        print("Goalie applied!")
-        print(request.data)
         data = request.data
         game_id = data["game"]
         goalie_id = data["goalie"]
+        logger.info('Goalie applied', extra={'game': game_id, 'goalie': goalie_id})
         if not game_id:
             return Response("Field 'game' cannot be blank", status=status.HTTP_400_BAD_REQUEST)
         if not goalie_id:
             return Response("Field 'goalie' cannot be blank", status=status.HTTP_400_BAD_REQUEST)
-        game = Game.objects.get(pk=game_id)
-        goalie = User.objects.get(pk=goalie_id)
-
-        # Removing logic to have a queue of possible goalies in favor of First Come First Served
-        # if self.__game_was_recently_created(game.creation_time):
-        #     new_entry = Game.objects.get()
-        #     new_entry.applied_goalies.add(goalie)
-        #     new_entry.save()
-        #     return Response("Goalie {} queued for game {}".format(game_id, goalie_id), status=status.HTTP_200_OK)
-        # else:
-        #
-        return self.__add_goalie_if_needed(game, goalie)
-
+        if not User.objects.filter(pk=goalie_id).exists():
+            return Response("Goalie {} does not exist".format(goalie_id), status=status.HTTP_400_BAD_REQUEST)
+
+        queue_resolved = Game.objects.filter(pk=game_id).values_list('queue_resolved', flat=True).first()
+        if queue_resolved is None:
+            return Response("Game could not be found", status=status.HTTP_404_NOT_FOUND)
+        if not queue_resolved:
+            goalie_queue.enqueue(game_id, goalie_id)
+            return Response("Goalie {} queued for game {}".format(goalie_id, game_id), status=status.HTTP_200_OK)
+        return self.__add_goalie_if_needed(game_id, goalie_id)
+
+    # Safe under concurrent applies: the slot is claimed with a conditional UPDATE rather than read then saved
     @staticmethod
-    def __add_goalie_if_needed(game, goalie):
-        if not game.goalie_one:
-            game.goalie_one = goalie
-            game.save()
-            # TODO: Add push notification
-            return Response("Goalie saved", status=status.HTTP_202_ACCEPTED)
-        elif not game.goalie_two and game.two_goalies_needed:
-            game.goalie_two = goalie
-            game.save()
-            # TODO: Add push notification
+    def __add_goalie_if_needed(game_id, goalie_id):
+        slot = Game.claim_goalie_slot(game_id, goalie_id)
+        if slot is not None:
+            renter_id = Game.objects.filter(pk=game_id).values_list('user_id', flat=True).first()
+            publish_on_commit(renter_id, GOALIE_ASSIGNED, {'game': int(game_id), 'goalie': int(goalie_id),
+                                                           'slot': slot})
             return Response("Goalie saved", status=status.HTTP_202_ACCEPTED)
-        else:
-            return Response("Game has already been filled", status=status.HTTP_410_GONE)
-
-    @staticmethod
-    def __game_was_recently_created(creation_time):
-        return timezone.now() - creation_time > timedelta(minutes=WAIT_TIME)
+        if not Game.objects.filter(pk=game_id).exists():
+            return Response("Game could not be found", status=status.HTTP_404_NOT_FOUND)
+        if Game.objects.filter(Q(goalie_one=goalie_id) | Q(goalie_two=goalie_id), pk=game_id).exists():
+            return Response("Goalie {} is already playing in game {}".format(goalie_id, game_id),
+                            status=status.HTTP_409_CONFLICT)
+        return Response("Game has already been filled", status=status.HTTP_410_GONE)
 
 
 class RemoveGoalieFromGame(APIView):
     def post(self, request):
-        print("In RemoveGoalieFromGame")
         data = request.data
-        print(data)
         game_id = data["game"]
         goalie_id = data["goalie"]
-        game = Game.objects.get(pk=game_id)
-        if game.goalie_one_id == goalie_id:
-            game.goalie_one_id = None
-            game.save()
-            return Response("Attendance Cancelled", status=status.HTTP_202_ACCEPTED)
-        elif game.goalie_two_id == goalie_id:
-            game.goalie_two_id = None
-            game.save()
+        logger.info('Goalie removed', extra={'game': game_id, 'goalie': goalie_id})
+        # Only the goalie's own slot is cleared, so this can't undo a goalie claiming the other slot meanwhile
+        slot = Game.release_goalie_slot(game_id, goalie_id)
+        if slot is not None:
+            renter_id = Game.objects.filter(pk=game_id).values_list('user_id', flat=True).first()
+            publish_on_commit(renter_id, GOALIE_REMOVED, {'game': int(game_id), 'goalie': int(goalie_id),
+                                                          'slot': slot})
             return Response("Attendance Cancelled", status=status.HTTP_202_ACCEPTED)
         return Response("Game could not be found", status=status.HTTP_400_BAD_REQUEST)
 
 
-# TODO: Create an algorithm to pick the best goalie
-# def __get_top_goalies(queryset):
-#     if queryset.__len__() == 0:
-#         return None, None
-#     elif queryset.__len__() == 1:
-#         return queryset[0], None
-#     return queryset[0], queryset[1]
-
-
 # TODO: Don't let users create games where they aren't the user
 # TODO: Authorize credit card on create
 # TODO: Charge credit care at game time iff there are adequate goalies for the game
 # TODO: Deal with billing for the game
 # Game Model Views
-class GameList(generics.ListCreateAPIView):
-    queryset = Game.objects.filter(game_time__gt=timezone.now() - timedelta(days=1))
+class GameList(ExpandedQuerysetMixin, FastListMixin, generics.ListCreateAPIView):
+    queryset = Game.objects.all()
     serializer_class = GameSerializer
+    pagination_class = GamePagination
+
+    # Upcoming games, worked out per request so long-running workers don't keep a stale cutoff.
+    # Optional query parameters:
+    #     from: ISO 8601 time, defaults to a day ago
+    #     to: ISO 8601 time, no upper bound by default
+    #     skill_level: only games at this skill level
+    #     open: true for only the games that still need a goalie
+    #     fields, expand: see fieldsets.py, e.g. ?expand=goalie_one,goalie_two.profile
+    def get_queryset(self):
+        queryset = self.__in_window(Game.objects.all())
+        if self.__open_only():
+            queryset = queryset.filter(open_slot__isnull=False)
+        return queryset
+
+    # Works on OpenGame as well as Game, since both have game_time and skill_level
+    def __in_window(self, queryset):
+        params = self.request.query_params
+        start = self.__parse_time(params, 'from') or timezone.now() - UPCOMING_GAME_GRACE
+        queryset = queryset.filter(game_time__gte=start)
+        end = self.__parse_time(params, 'to')
+        if end is not None:
+            queryset = queryset.filter(game_time__lt=end)
+        if 'skill_level' in params:
+            try:
+                queryset = queryset.filter(skill_level=int(params['skill_level']))
+            except ValueError:
+                raise ValidationError({'skill_level': 'Expected a whole number'})
+        return queryset
 
-    def get(self, request, *args, **kwargs):
-        print("Printing request info")
-        print(request.data)
-        return super().get(request, *args, **kwargs)
+    @staticmethod
+    def __parse_time(params, name):
+        if name not in params:
+            return None
+        try:
+            value = parse_datetime(params[name])
+        except ValueError:
+            value = None
+        if value is None:
+            raise ValidationError({name: 'Expected an ISO 8601 date and time, e.g. 2019-02-12T20:00:00Z'})
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    def __open_only(self):
+        return self.request.query_params.get('open', '').lower() in ('true', '1')
+
+    # Passing lat, lon and radius_km returns only the games within radius_km of that point, closest first, a
+    # page at a time (see NearbyGamePagination)
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        if 'lat' not in params and 'lon' not in params and 'radius_km' not in params:
+            if self.__open_only():
+                return self.__list_open(request)
+            return super().list(request, *args, **kwargs)
+        try:
+            latitude = float(params['lat'])
+            longitude = float(params['lon'])
+            radius_km = float(params['radius_km'])
+        except (KeyError, ValueError):
+            return Response("Fields 'lat', 'lon' and 'radius_km' must all be given as numbers",
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not -90 <= latitude <= 90 or not -180 <= longitude <= 180 or not 0 <= radius_km <= NEARBY_MAX_RADIUS_KM:
+            return Response('Coordinates out of range, or radius_km over {}'.format(NEARBY_MAX_RADIUS_KM),
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        games = self.__games_near(self.filter_queryset(self.get_queryset()), latitude, longitude, radius_km)
+        paginator = NearbyGamePagination()
+        serializer = self.get_serializer(paginator.paginate_queryset(games, request, view=self), many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    # The goalie feed. Pages through OpenGame, which only has the games that still need a goalie, and then
+    # fetches just that page of games
+    def __list_open(self, request):
+        paginator = OpenGamePagination()
+        page = paginator.paginate_queryset(self.__in_window(OpenGame.objects.all()), request, view=self)
+        games = self.filter_queryset(Game.objects.all()).in_bulk([open_game.game_id for open_game in page])
+        serializer = self.get_serializer([games[open_game.game_id] for open_game in page
+                                          if open_game.game_id in games], many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    # Only rows in the geohash cells around the point are read, so distances are computed for a
+    # handful of candidates rather than for every game in the table
+    @staticmethod
+    def __games_near(queryset, latitude, longitude, radius_km):
+        candidates = list(queryset.filter(geohash_radius_filter(latitude, longitude, radius_km)))
+        distances = batch_distance_km(latitude, longitude,
+                                      [game.latitude for game in candidates],
+                                      [game.longitude for game in candidates])
+        nearby = [(distance, game.id, game) for distance, game in zip(distances, candidates) if distance <= radius_km]
+        nearby.sort(key=lambda entry: entry[:2])
+        return [game for _, _, game in nearby]
 
     def post(self, request, *args, **kwargs):
-        # print(request.authenticators)
-        # print('request.user.id: {}, request.data: {}'.format(request.user.id, request.data['user']))
-        print("Printing request")
-        print(request)
-        # TODO: Use the user ID here to calculate the distance to available games. If they're too far, don't return them
-        print(request.data["user"])
-        # print(request.headers)
         if 'user' not in request.data or \
                 (request.user.id != request.data['user'] and request.user.is_superuser is False):
             return Response('Game user must be same as user requesting create', status=status.HTTP_400_BAD_REQUEST)
@@ -139,21 +244,207 @@ class GameList(generics.ListCreateAPIView):
         return super().post(request, *args, **kwargs)
 
 
-class GameDetail(generics.RetrieveUpdateDestroyAPIView):
+class GameDetail(ExpandedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Game.objects.all()
     serializer_class = GameSerializer
 
+    # The game's OpenGame row is refreshed by Game's post_save receiver, in the same transaction as the UPDATE
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+
+    # Deleting the game deletes its OpenGame row too, in the same transaction
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+
+
+# Many games in one request, for leagues scheduling a season. The body is a JSON list of games, or CSV with a
+# header row naming the fields (Content-Type: text/csv). Either every row is written or none are:
+#     POST  creates the games, with the same fields as GameList. Returns 201 and the new games
+#     PATCH changes the skill_level, location, game_time or two_goalies_needed of the games with each row's id.
+#           Returns 200 and the updated games
+# Up to BULK_MAX_GAMES rows. If any row is invalid, returns 400 with the errors of each invalid row, numbered
+# from 0 in the order they were sent:
+#     {"errors": [{"row": 3, "errors": {"skill_level": ["..."]}}]}
+class GameBulk(APIView):
+    parser_classes = (JSONParser, CSVParser)
+
+    def post(self, request):
+        error = self.__check_size(request.data)
+        if error is not None:
+            return error
+        serializer = BulkGameSerializer(data=request.data, many=True, context={'request': request})
+        if not serializer.is_valid():
+            return self.__row_errors(serializer.errors)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def patch(self, request):
+        error = self.__check_size(request.data)
+        if error is not None:
+            return error
+        games = Game.objects.all()
+        if request.user.is_superuser is False:
+            games = games.filter(user=request.user)
+        serializer = GameRescheduleSerializer(games, data=request.data, many=True)
+        if not serializer.is_valid():
+            return self.__row_errors(serializer.errors)
+
+        ids = [row['id'] for row in serializer.validated_data]
+        found = set()
+        for batch in chunks(ids, OPEN_GAME_REFRESH_BATCH_SIZE):
+            found.update(games.filter(pk__in=batch).values_list('pk', flat=True))
+        errors = [{}] * len(ids)
+        seen = set()
+        for row, pk in enumerate(ids):
+            # Games the user doesn't own look the same as games that don't exist
+            if pk not in found:
+                errors[row] = {'id': ['Game {} does not exist'.format(pk)]}
+            elif pk in seen:
+                errors[row] = {'id': ['Game {} is in more than one row'.format(pk)]}
+            seen.add(pk)
+        if any(errors):
+            return self.__row_errors(errors)
+
+        return Response(GameSerializer(serializer.save(), many=True).data)
+
+    @staticmethod
+    def __check_size(data):
+        if isinstance(data, list) and not data:
+            return Response('No games given', status=status.HTTP_400_BAD_REQUEST)
+        if isinstance(data, list) and len(data) > BULK_MAX_GAMES:
+            return Response('At most {} games per request'.format(BULK_MAX_GAMES),
+                            status=status.HTTP_400_BAD_REQUEST)
+        return None
+
+    @staticmethod
+    def __row_errors(errors):
+        # A body that isn't a list at all gets one error for the whole request
+        if isinstance(errors, dict):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'errors': [{'row': row, 'errors': row_errors} for row, row_errors in enumerate(errors)
+                                    if row_errors]}, status=status.HTTP_400_BAD_REQUEST)
+
+
+# The goalies best suited to a game, best first. Only the game's renter can see them.
+# Optional query parameters:
+#     limit: how many goalies to return, up to 100. Defaults to 10
+class GameCandidates(APIView):
+    @staticmethod
+    def get(request, pk):
+        games = Game.objects.all()
+        if request.user.is_superuser is False:
+            games = games.filter(user=request.user)
+        try:
+            game = games.get(pk=pk)
+        except ObjectDoesNotExist:
+            return Response("Game does not exist", status=status.HTTP_404_NOT_FOUND)
+        try:
+            limit = int(request.query_params.get('limit', CANDIDATES_LIMIT))
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= CANDIDATES_MAX_LIMIT:
+            return Response("Field 'limit' must be a number from 1 to {}".format(CANDIDATES_MAX_LIMIT),
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(rank_goalies(game, limit, exclude=(game.goalie_one_id, game.goalie_two_id)))
+
+
+# Long-poll for events about the requesting user: goalies being assigned to or removed from their games,
+# and new messages sent to them. Holds the request open until there is an event or the timeout runs out.
+# Query parameters:
+#     cursor: the cursor from the previous response. Leave it out on the first request
+#     timeout: seconds to wait, up to 55. Defaults to 25
+# Returns {"cursor": ..., "events": [{"id": ..., "type": ..., "data": {...}}, ...]}, with no events on timeout
+class Events(APIView):
+    @staticmethod
+    def get(request):
+        try:
+            timeout = float(request.query_params.get('timeout', EVENTS_TIMEOUT))
+        except ValueError:
+            timeout = None
+        if timeout is None or not 0 <= timeout <= EVENTS_MAX_TIMEOUT:
+            return Response("Field 'timeout' must be a number of seconds from 0 to {}".format(EVENTS_MAX_TIMEOUT),
+                            status=status.HTTP_400_BAD_REQUEST)
+        events, cursor = get_broker().wait(request.user.id, request.query_params.get('cursor'), timeout)
+        return Response({'cursor': cursor, 'events': events})
+
+
+# Hit and miss counts for the cached views in the process that serves the request
+class CacheStats(APIView):
+    permission_classes = (IsAdminUser,)
+
+    @staticmethod
+    def get(request):
+        return Response(get_cache_stats())
+
+
+# Latency, DB time, query count and render time histograms for each view, see metrics.py
+class Metrics(APIView):
+    permission_classes = (IsAdminUser,)
+
+    @staticmethod
+    def get(request):
+        return Response({'views': get_metrics(), 'response_cache': get_cache_stats()})
+
+
+# Streams a whole table (games, messages or profiles) for analytics, see export.py. The format is part of the
+# path (ndjson, csv or parquet) because ?format= picks one of the API's own renderers. Optional query parameters:
+#     after_id: only rows with a greater id, e.g. the X-Export-Watermark of the previous export
+#     since: ISO 8601 time, only games or messages created since then
+class Export(APIView):
+    permission_classes = (IsAdminUser,)
+
+    @staticmethod
+    def get(request, table, file_format):
+        params = request.query_params
+        after_id = None
+        if 'after_id' in params:
+            try:
+                after_id = int(params['after_id'])
+            except ValueError:
+                raise ValidationError({'after_id': 'Expected a whole number'})
+        since = None
+        if 'since' in params:
+            try:
+                since = parse_datetime(params['since'])
+            except ValueError:
+                pass
+            if since is None:
+                raise ValidationError({'since': 'Expected an ISO 8601 date and time, e.g. 2019-02-12T20:00:00Z'})
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        try:
+            export = TableExport(table, after_id=after_id, since=since)
+            body = export.stream(file_format)
+        except ValueError as error:
+            return Response(str(error), status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(body, content_type=EXPORT_FORMATS[file_format])
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(export.filename(file_format))
+        response['X-Export-Watermark'] = '' if export.watermark is None else str(export.watermark)
+        return response
+
+
+# Deletes the token the request was made with. The client gets a fresh one from api-token-auth next time
+class TokenLogout(APIView):
+    @staticmethod
+    def post(request):
+        if request.auth is None:
+            return Response('Must be logged in with a token', status.HTTP_400_BAD_REQUEST)
+        request.auth.delete()
+        return Response('Logged out', status.HTTP_200_OK)
+
 
 # TODO: Figure out why this error happened
 # This one was being funny on the server. Commenting out the activate at the bottom seemed to fix it.
 def activate(request, uidb64, token):
-    print('uidb64 is {}, token is {}, request is {}'.format(uidb64, token, request))
     try:
         uid = urlsafe_base64_decode(uidb64).decode()
-        print('UID decoded is: {}'.format(uid))
         user = User.objects.get(pk=uid)
     except(TypeError, ValueError, OverflowError, User.DoesNotExist):
-        print('Hit an error')
+        # The token is a credential, so it's left out
+        logger.warning('Activation link for an unknown user', extra={'uidb64': uidb64})
         user = None
     if user is not None and account_activation_token.check_token(user, token):
         user.is_active = True
@@ -198,50 +489,154 @@ class CheckEmailUnique(APIView):
 
 
 # Location Model Views
-class LocationList(generics.ListCreateAPIView):
+# Locations hardly ever change, so their responses are cached until one does (see caching.py)
+class LocationList(CachedResponseMixin, FastListMixin, generics.ListCreateAPIView):
     queryset = Location.objects.all()
     serializer_class = LocationSerializer
+    cache_max_age = 60
 
 
-class LocationDetail(generics.RetrieveUpdateDestroyAPIView):
+class LocationDetail(CachedResponseMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Location.objects.all()
     serializer_class = LocationSerializer
+    cache_max_age = 60
 
 
 # Message Model Views
-class MessageList(generics.ListCreateAPIView):
+class MessageList(ExpandedQuerysetMixin, FastListMixin, generics.ListCreateAPIView):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
+    pagination_class = MessagePagination
+
+    def get_queryset(self):
+        if self.request.user.is_superuser is False:
+            return Message.for_user(self.request.user)
+        return Message.objects.all()
+
+    def perform_create(self, serializer):
+        message = serializer.save()
+        recipient_id = message.game_user_id if message.sender_is_goalie else message.goalie_user_id
+        publish_on_commit(recipient_id, NEW_MESSAGE, MessageSerializer(message).data)
+
+    # Incremental sync for polling clients: ?since=<cursor> returns only the messages created after the cursor.
+    # Message ids only ever go up, so the cursor is the id of the last message the client has seen, starting
+    # from 0. The response is compact: the field names once, then one list of values per message.
+    #     {"cursor": 12, "more": false, "fields": ["id", ...], "messages": [[11, ...], [12, ...]]}
+    # If "more" is true there are more than ?limit= (default 200) new messages and the client should ask again
+    # straight away. The ETag is the new cursor, so a client sending it back in If-None-Match gets an empty
+    # 304 when nothing has changed.
+    def list(self, request, *args, **kwargs):
+        if 'since' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+        try:
+            since = int(request.query_params['since'])
+            limit = min(int(request.query_params.get('limit', SYNC_PAGE_SIZE)), SYNC_MAX_PAGE_SIZE)
+            if since < 0 or limit < 1:
+                raise ValueError
+        except ValueError:
+            return Response("Fields 'since' and 'limit' must be whole numbers", status=status.HTTP_400_BAD_REQUEST)
+
+        rows = list(self.get_queryset().filter(id__gt=since).order_by('id')
+                    .values_list(*MESSAGE_SYNC_FIELDS)[:limit + 1])
+        more = len(rows) > limit
+        rows = rows[:limit]
+        cursor = rows[-1][0] if rows else since
+
+        etag = '"{}"'.format(cursor)
+        if not rows and request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(OrderedDict([
+                ('cursor', cursor),
+                ('more', more),
+                ('fields', MESSAGE_SYNC_FIELDS),
+                ('messages', [self.__compact(row) for row in rows]),
+            ]))
+        response['ETag'] = etag
+        response['Vary'] = 'Authorization'
+        return response
 
-    def get(self, request, *args, **kwargs):
-        if request.user.is_superuser is False:
-            self.queryset = Message.objects.filter(game_user=request.user).__or__(
-                Message.objects.filter(goalie_user=request.user))
-        return super().get(request, *args, **kwargs)
+    @staticmethod
+    def __compact(row):
+        row = list(row)
+        row[SYNC_TIME_COLUMN] = SYNC_TIME_FIELD.to_representation(row[SYNC_TIME_COLUMN])
+        return row
 
 
-class MessageDetail(generics.RetrieveAPIView):
+class MessageDetail(ExpandedQuerysetMixin, generics.RetrieveAPIView):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
 
-    def get(self, request, *args, **kwargs):
-        if request.user.is_superuser is False:
-            self.queryset = Message.objects.filter(game_user=request.user).__or__(
-                Message.objects.filter(goalie_user=request.user))
-        return super().get(request, *args, **kwargs)
+    def get_queryset(self):
+        if self.request.user.is_superuser is False:
+            return Message.for_user(self.request.user)
+        return Message.objects.all()
+
+
+# The requesting user's conversations, most recently active first. A conversation is the messages between a
+# renter and a goalie about one game. Each entry has the latest message and how many messages in the
+# conversation the user hasn't read. Runs one grouped query over the user's messages, read off the
+# (game_user, creation_time) and (goalie_user, creation_time) indexes, and one to fetch the latest messages.
+# Keyset paginated on the latest message's id, so a page's cursor stays put as new messages arrive
+class Inbox(APIView):
+    pagination_class = InboxPagination
+
+    def get(self, request):
+        user = request.user
+        paginator = self.pagination_class()
+        conversations = paginator.paginate_queryset(
+            Message.for_user(user)
+            .values('game', 'game_user', 'goalie_user')
+            .annotate(latest_id=Max('id'), unread_count=Count('id', filter=Message.unread_by(user))),
+            request, view=self)
+        latest_messages = Message.objects.in_bulk([conversation['latest_id'] for conversation in conversations])
+        return paginator.get_paginated_response([OrderedDict([
+            ('game', conversation['game']),
+            ('game_user', conversation['game_user']),
+            ('goalie_user', conversation['goalie_user']),
+            ('unread_count', conversation['unread_count']),
+            ('latest_message', MessageSerializer(latest_messages[conversation['latest_id']]).data),
+        ]) for conversation in conversations])
+
+
+# Normal auth
+# game: id of game
+# Marks every message sent to the user about the game as read
+class MarkMessagesRead(APIView):
+    @staticmethod
+    def post(request):
+        game_id = request.data.get('game')
+        if not game_id:
+            return Response("Field 'game' cannot be blank", status=status.HTTP_400_BAD_REQUEST)
+        updated = Message.objects.filter(Message.unread_by(request.user), game=game_id).update(read=True)
+        return Response({'marked_read': updated}, status=status.HTTP_200_OK)
 
 
 # Profile Model Views
-class ProfileList(generics.ListCreateAPIView):
+class ProfileList(ExpandedQuerysetMixin, generics.ListCreateAPIView):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
 
 
-class ProfileDetail(generics.RetrieveUpdateDestroyAPIView):
+class ProfileDetail(ExpandedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
 
 
+# A resized profile picture, made on the first request for it (see pictures.py). The URLs come from
+# ProfileSerializer's picture_variants. Names are content hashes, so clients can keep the file for good
+class PictureVariant(APIView):
+    @staticmethod
+    def get(request, variant, name):
+        picture_name = '{}/{}'.format(PICTURE_DIRECTORY, name)
+        if variant not in get_variants() or not default_storage.exists(picture_name):
+            return Response('Picture does not exist', status=status.HTTP_404_NOT_FOUND)
+        stored = get_variant(picture_name, variant)
+        response = FileResponse(default_storage.open(stored), content_type=CONTENT_TYPES[stored.rsplit('.', 1)[1]])
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+
 # User Model Views
 # TODO: Throttle create requests
 class UserList(generics.ListCreateAPIView):
@@ -274,7 +669,9 @@ def api_root(request, given_format=None):
         'apply': reverse('apply', request=request, format=given_format),
         'check-username': reverse('check-username', request=request, format=given_format),
         'check-email': reverse('check-email', request=request, format=given_format),
+        'events': reverse('events', request=request, format=given_format),
         'game': reverse('game-list', request=request, format=given_format),
+        'inbox': reverse('inbox', request=request, format=given_format),
         'location': reverse('location-list', request=request, format=given_format),
         'message': reverse('message-list', request=request, format=given_format),
         'profile': reverse('profile-list', request=request, format=given_format),